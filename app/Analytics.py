@@ -0,0 +1,263 @@
+import os, time, struct, datetime, threading, logging
+from array import array
+from itertools import compress
+from operator import eq
+from os.path import abspath, dirname
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("portions", "retries", "failures", "sequences", "rotation_time")
+PORTIONS, RETRIES, FAILURES, SEQUENCES, ROTATION_TIME = range(len(METRICS))
+
+# raw history: timestamp, event, machine name, value
+EVENT = struct.Struct("<dB16sf")
+EVENT_PORTION = 1
+EVENT_FINISH = 2
+EVENT_FAILURE = 3
+EVENT_EMPTY = 4
+EVENT_REFILL = 5
+
+# number of buckets kept per resolution
+RESOLUTIONS = {
+    "hourly": 24 * 14,
+    "daily": 400,
+    "monthly": 36
+}
+
+class Rollup:
+    """Fixed size ring of buckets, one array per metric
+
+    A slot is reused when its bucket is older than size buckets, so the
+    memory use never grows. epochs holds the bucket key each slot belongs
+    to, stale slots are skipped in queries.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.epochs = array("q", [-1]) * size
+        self.values = [array("d", [0]) * size for _ in METRICS]
+
+    def add(self, key, metric, value):
+        slot = key % self.size
+        epoch = self.epochs[slot]
+        if key < epoch:
+            # the slot holds a newer bucket, e.g. after a clock step or from an out of order history
+            return
+        if epoch != key:
+            self.epochs[slot] = key
+            for values in self.values:
+                values[slot] = 0
+        self.values[metric][slot] += value
+
+    def _slices(self, first, last):
+        # the buckets first..last are at most two contiguous slices of the ring
+        first = max(first, last - self.size + 1)
+        start = first % self.size
+        end = start + last - first + 1
+        if end <= self.size:
+            return [(start, end, first)]
+        return [(start, self.size, first), (0, end - self.size, first + self.size - start)]
+
+    def total(self, first, last):
+        totals = [0.0] * len(METRICS)
+        for start, end, key in self._slices(first, last):
+            valid = list(map(eq, self.epochs[start:end], range(key, key + end - start)))
+            for metric, values in enumerate(self.values):
+                totals[metric] += sum(compress(values[start:end], valid))
+        return totals
+
+    def series(self, first, last):
+        result = []
+        for key in range(max(first, last - self.size + 1), last + 1):
+            slot = key % self.size
+            if self.epochs[slot] == key:
+                result.append((key, [values[slot] for values in self.values]))
+            else:
+                result.append((key, [0.0] * len(METRICS)))
+        return result
+
+def _bucketStart(resolution, key):
+    if resolution == "hourly":
+        day = datetime.date.fromordinal(key // 24 + 719163)
+        return f"{day.isoformat()}T{key % 24:02d}:00"
+    if resolution == "daily":
+        return datetime.date.fromordinal(key + 719163).isoformat()
+    return f"{key // 12}-{key % 12 + 1:02d}"
+
+def _metrics(totals):
+    metrics = {name: round(value, 3) if name == "rotation_time" else int(value) for name, value in zip(METRICS, totals)}
+    metrics["mean_rotation_time"] = round(totals[ROTATION_TIME] / totals[PORTIONS], 3) if totals[PORTIONS] else None
+    metrics["failure_rate"] = round(totals[FAILURES] / totals[SEQUENCES], 3) if totals[SEQUENCES] else None
+    return metrics
+
+class Analytics:
+    """Consumption statistics per machine, updated with every event
+
+    Events are kept as hourly, daily and monthly rollups and appended to a
+    raw history file, from which the rollups are rebuilt at startup. The
+    hopper level is estimated from the portions since the last refill.
+    """
+
+    def __init__(self, file = None, hopperCapacity = None):
+        self.file = file
+        self.hopperCapacity = hopperCapacity or {}
+        self.rollups = {}
+        self.sinceRefill = {}
+        self.lastRefill = {}
+        self._names = {}
+        self._keyCache = (0, 0, None)
+        self._output = None
+        self._lock = threading.Lock()
+
+    def _keys(self, timestamp):
+        start, end, keys = self._keyCache
+        if start <= timestamp < end:
+            return keys
+        local = time.localtime(timestamp)
+        offset = local.tm_gmtoff
+        hour = int((timestamp + offset) // 3600)
+        keys = (hour, int((timestamp + offset) // 86400), local.tm_year * 12 + local.tm_mon - 1)
+        self._keyCache = (hour * 3600 - offset, (hour + 1) * 3600 - offset, keys)
+        return keys
+
+    def _machine(self, machine):
+        rollups = self.rollups.get(machine)
+        if rollups is None:
+            rollups = tuple([Rollup(size) for size in RESOLUTIONS.values()])
+            self.rollups[machine] = rollups
+            self.sinceRefill.setdefault(machine, 0)
+        return rollups
+
+    def _apply(self, timestamp, event, machine, value):
+        rollups = self._machine(machine)
+        keys = self._keys(timestamp)
+        if event == EVENT_PORTION:
+            for rollup, key in zip(rollups, keys):
+                rollup.add(key, PORTIONS, 1)
+                rollup.add(key, ROTATION_TIME, value)
+            self.sinceRefill[machine] += 1
+        elif event == EVENT_FINISH:
+            for rollup, key in zip(rollups, keys):
+                rollup.add(key, SEQUENCES, 1)
+                rollup.add(key, RETRIES, value)
+        elif event == EVENT_FAILURE or event == EVENT_EMPTY:
+            for rollup, key in zip(rollups, keys):
+                rollup.add(key, FAILURES, 1)
+            if event == EVENT_EMPTY and machine in self.hopperCapacity:
+                self.sinceRefill[machine] = max(self.sinceRefill[machine], self.hopperCapacity[machine])
+        elif event == EVENT_REFILL:
+            self.sinceRefill[machine] = 0
+            self.lastRefill[machine] = timestamp
+
+    def _record(self, event, machine, value = 0, timestamp = None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self._apply(timestamp, event, machine, value)
+            if self._output is not None:
+                try:
+                    self._output.write(EVENT.pack(timestamp, event, machine.encode()[:16], value or 0))
+                    self._output.flush()
+                except OSError as err:
+                    logger.error(f"Cannot write analytics history: {err}")
+
+    def recordPortion(self, machine, rotationTime = None, timestamp = None):
+        self._record(EVENT_PORTION, machine, rotationTime or 0, timestamp)
+
+    def recordFinish(self, machine, retries = 0, timestamp = None):
+        self._record(EVENT_FINISH, machine, retries, timestamp)
+
+    def recordFailure(self, machine, code, timestamp = None):
+        self._record(EVENT_EMPTY if code == "empty" else EVENT_FAILURE, machine, 0, timestamp)
+
+    def refill(self, machine, timestamp = None):
+        self._record(EVENT_REFILL, machine, 0, timestamp)
+
+    def open(self):
+        """Rebuild the rollups from the history file and append new events to it"""
+        if self.file is None:
+            return
+        try:
+            with open(self.file, "rb") as f:
+                self.rebuild(f.read())
+        except FileNotFoundError:
+            pass
+        try:
+            os.makedirs(dirname(abspath(self.file)), exist_ok=True)
+            self._output = open(self.file, "ab")
+        except OSError as err:
+            logger.error(f"Cannot write analytics history: {err}")
+
+    def close(self):
+        with self._lock:
+            if self._output is not None:
+                self._output.close()
+                self._output = None
+
+    def rebuild(self, history):
+        """Recompute all rollups from raw history bytes"""
+        usable = len(history) - len(history) % EVENT.size
+        with self._lock:
+            self.rollups = {}
+            self.sinceRefill = {}
+            self.lastRefill = {}
+            names = self._names
+            for timestamp, event, name, value in EVENT.iter_unpack(memoryview(history)[:usable]):
+                machine = names.get(name)
+                if machine is None:
+                    machine = name.rstrip(b"\0").decode()
+                    names[name] = machine
+                self._apply(timestamp, event, machine, value)
+        return usable // EVENT.size
+
+    def hopperLevel(self, machine):
+        capacity = self.hopperCapacity.get(machine)
+        if capacity is None:
+            return None
+        return max(0, capacity - self.sinceRefill.get(machine, 0))
+
+    def _range(self, resolution, count, end):
+        index = list(RESOLUTIONS).index(resolution)
+        last = self._keys(end if end is not None else time.time())[index]
+        return index, last - count + 1, last
+
+    def totals(self, resolution = "daily", count = 1, machine = None, end = None):
+        """Metrics of the last count buckets, for one machine or all machines together"""
+        with self._lock:
+            index, first, last = self._range(resolution, count, end)
+            machines = [machine] if machine is not None else list(self.rollups)
+            totals = [0.0] * len(METRICS)
+            for name in machines:
+                if name in self.rollups:
+                    totals = list(map(sum, zip(totals, self.rollups[name][index].total(first, last))))
+        return _metrics(totals)
+
+    def series(self, resolution = "daily", count = 7, machine = None, end = None):
+        with self._lock:
+            index, first, last = self._range(resolution, count, end)
+            machines = [machine] if machine is not None else list(self.rollups)
+            buckets = {}
+            for name in machines:
+                if name not in self.rollups:
+                    continue
+                for key, values in self.rollups[name][index].series(first, last):
+                    buckets[key] = list(map(sum, zip(buckets.get(key, [0.0] * len(METRICS)), values)))
+        return [dict(_metrics(buckets[key]), start=_bucketStart(resolution, key)) for key in sorted(buckets)]
+
+    def query(self, query):
+        """Answer an analytics request: {"resolution", "count", "machine", "series"}"""
+        resolution = query.get("resolution", "daily")
+        if resolution not in RESOLUTIONS:
+            return {"query": query, "error": f"Unknown resolution {resolution}"}
+        count = min(int(query.get("count", 1)), RESOLUTIONS[resolution])
+        result = {"query": query, "totals": self.totals(resolution, count, query.get("machine"))}
+        if query.get("series", False):
+            result["series"] = self.series(resolution, count, query.get("machine"))
+        return result
+
+    def summary(self):
+        """Today per machine and the estimated hopper levels, for the status message"""
+        return {
+            machine: dict(self.totals("daily", 1, machine), hopper_level=self.hopperLevel(machine))
+            for machine in sorted(set(self.rollups) | set(self.hopperCapacity))
+        }
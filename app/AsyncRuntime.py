@@ -0,0 +1,122 @@
+import asyncio, signal, time, logging
+from concurrent.futures import ThreadPoolExecutor
+from LagMonitor import sdNotify
+
+logger = logging.getLogger(__name__)
+
+class AsyncRuntime:
+    """Runs the CatFeeder on one asyncio event loop
+
+    The display port and the MQTT socket are watched by the loop, scheduled
+    jobs run as loop timers and signals are delivered through the loop.
+    Events from GPIO and timer threads are handed to the loop, so the
+    feeder state is only changed on the loop thread. Work that may block,
+    like connecting, runs in a small executor; the panel is answered on a
+    thread of its own, so MQTT connect retries cannot hold up its frames.
+    """
+
+    def __init__(self, feeder, executorThreads = 2):
+        self.feeder = feeder
+        self.executorThreads = executorThreads
+        self.loop = None
+        self.displayExecutor = None
+        self._stopped = None
+        self._tickHandle = None
+        self._jobsHandle = None
+        self._deadline = None
+
+    def run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        self.loop = loop
+        loop.set_default_executor(ThreadPoolExecutor(self.executorThreads, thread_name_prefix="CatFeederWorker"))
+        # one thread also keeps the panel frames in order
+        self.displayExecutor = ThreadPoolExecutor(1, thread_name_prefix="CatFeederDisplay")
+        self._stopped = loop.create_future()
+        self._installSignalHandlers()
+        self.feeder.eventLoop = loop
+        try:
+            self.feeder._setup()
+            self.feeder.lagMonitor.start()
+            sdNotify("READY=1")
+            self._deadline = time.monotonic()
+            self._tick()
+            await self._stopped
+            sdNotify("STOPPING=1")
+        finally:
+            self.feeder.lagMonitor.stop()
+            for handle in (self._tickHandle, self._jobsHandle):
+                if handle is not None:
+                    handle.cancel()
+            self.feeder._unload()
+            # give the MQTT client a moment to write its last messages
+            await asyncio.sleep(0.1)
+            self.feeder.eventLoop = None
+            self.displayExecutor.shutdown(wait=False)
+            self.displayExecutor = None
+
+    def _installSignalHandlers(self):
+        handlers = {
+            signal.SIGINT: self._stop,
+            signal.SIGTERM: self._stop,
+            signal.SIGHUP: self._reload,
+            signal.SIGUSR1: self.feeder._runUser1Handler,
+            signal.SIGUSR2: self.feeder._runUser2Handler
+        }
+        for signum, handler in handlers.items():
+            try:
+                self.loop.add_signal_handler(signum, handler)
+            except (ValueError, RuntimeError):
+                logger.debug('Signals can only be handled on the main thread')
+                return
+
+    def _tick(self):
+        pause = self.feeder.pauseRunLoop or 1
+        self.feeder.lagMonitor.tick(self._deadline)
+        if time.monotonic() - self._deadline > pause:
+            # we are too far behind, do not try to catch up
+            self._deadline = time.monotonic()
+        self._runFeeder()
+        self._deadline += pause
+        self._tickHandle = self.loop.call_later(max(0, self._deadline - time.monotonic()), self._tick)
+        self._scheduleJobs()
+
+    def _runFeeder(self):
+        try:
+            self.feeder.run()
+        except Exception as e:
+            logger.error(f"Run method failed: {e}")
+            self._stop()
+
+    def _scheduleJobs(self):
+        # wake up when the next job is due instead of on the next tick
+        if self._jobsHandle is not None:
+            self._jobsHandle.cancel()
+            self._jobsHandle = None
+        idle = self.feeder.scheduler.idle_seconds
+        if idle is not None and idle < (self.feeder.pauseRunLoop or 1):
+            self._jobsHandle = self.loop.call_later(max(0, idle), self._runJobs)
+
+    def _runJobs(self):
+        self._jobsHandle = None
+        self.feeder._recordSchedulerLag()
+        self.feeder.scheduler.run_pending()
+
+    def _reload(self):
+        self.feeder.isReloadSignal = True
+        self.wake()
+
+    def wake(self):
+        """Run the feeder soon, e.g. after a reload signal or a configuration update"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._runFeeder)
+
+    def _stop(self):
+        if self._stopped is not None and not self._stopped.done():
+            self._stopped.set_result(True)
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stop)
@@ -1,14 +1,25 @@
-import schedule, time, logging, datetime
+import schedule, time, logging, datetime, gc
 import pytz
 import json
-from functools import partial
+import threading
+from os.path import abspath, dirname
+from collections import deque
 from gpiozero import Button, LED
-from Config import Config
+from Config import Config, ConfigError
 from FeedJob import FeedJob
+from FeedQueue import FeedQueue, FeedRequest
 from Daemon import Daemon
 from Display import Display
 from FeedingMachine import FeedingMachine
-from MQTTClient import MQTTClient
+from MotorProcess import MotorControlProcess
+from MQTTClient import MQTTClient, MAX_PORTIONS
+from Profiler import DebugTools, COMMAND_FILE
+from Tracing import tracer, monotonicToNs
+from StateStore import StateStore
+from Analytics import Analytics
+from AsyncRuntime import AsyncRuntime
+from EventBus import EventBus, BLOCK, DROP_OLDEST, MachineRound, MachineSuccessful, MachineFailed, MachineFinished, JobProgress, JobSuccessful, JobFailed, JobFinished, FeedingStarted, FeedingFinished, FeedRequested
+from Notification import Notification, NotificationDispatcher, SmtpSink, MqttSink, WebhookSink
 
 logger = logging.getLogger(__name__)
 tz = pytz.timezone('Europe/Amsterdam')
@@ -24,38 +35,94 @@ class CatFeeder(Daemon):
     mqttClient = None
 
     statusLedActive = False
-    feedingMachines = []
-    feedJobs = []
+    feedingMachines = None
+    feedJobs = None
 
     manualFeedingButton = None
+    motorProcess = None
     jobIsRunning = False
+    feedQueue = None
+    jobLock = None
+    stateStore = None
+    notifications = None
+    analytics = None
+    config = None
+    runtime = None
+    eventLoop = None
+    bus = None
 
     def __init__(self):
         super(CatFeeder, self).__init__()
+        self.feedingMachines = []
+        self.feedJobs = []
+        self.scheduler = schedule.Scheduler()
+        self.pendingUpdates = deque()
+        self.feedQueue = FeedQueue(maxPortions=MAX_PORTIONS)
+        self.jobLock = threading.Lock()
+        self.debugTools = DebugTools()
 
     def _setup(self):
         logger.info('Starting CatFeeder service')
-        self._reloadConfig()
+        if self.config == None:
+            self.config = Config()
+        if self.runtime == None and self.config.runtime.get("asyncio", False):
+            # the runtime calls _setup again from its event loop
+            self.runtime = AsyncRuntime(self, self.config.runtime.get("executorThreads", 2))
+            return
+        self._reloadConfig(self.config)
+        self._restoreState()
+        # everything allocated so far lives as long as the daemon, keep it out of the collector
+        gc.collect()
+        gc.freeze()
+
+    def _infiniteLoop(self):
+        if self.runtime != None:
+            self.runtime.run()
+        else:
+            super(CatFeeder, self)._infiniteLoop()
+
+    def _onLoop(self, handler):
+        # with the asyncio runtime, events from GPIO and timer threads are handled on the loop
+        if self.eventLoop == None:
+            return handler
+        loop = self.eventLoop
+        return lambda *args: loop.call_soon_threadsafe(handler, *args)
 
     def _runUser1Handler(self):
-        self._feedPortions()
+        # the main loop may hold the queue and job locks when the signal arrives, only hand the request off
+        self.bus.publish(FeedRequested(1, "signal"))
+
+    def _runUser2Handler(self):
+        self.debugTools.submitCommandFile(COMMAND_FILE)
+
+    def debugSignal(self, action):
+        with open(COMMAND_FILE, "w") as f:
+            f.write(action)
+        self.user2Signal()
 
     def _initDisplay(self):
-        self.display = Display(self.config)
-        self.display.onManualFeed = self._feedPortions
+        if self.display != None:
+            self.display.unload()
+        executor = self.runtime.displayExecutor if self.runtime != None else None
+        self.display = Display(self.config, loop=self.eventLoop, executor=executor, bus=self.bus)
 
     def _initManualFeedingButton(self):
+        if self.manualFeedingButton != None:
+            self.manualFeedingButton.close()
+            self.manualFeedingButton = None
         if self.config.manualFeedingButtonPort != None:
             self.manualFeedingButton = Button(self.config.manualFeedingButtonPort)
-            self.manualFeedingButton.when_held = self._feedPortions
-            self.manualFeedingButton.when_pressed = self._timeUntilNextFeeding
+            self.manualFeedingButton.when_held = lambda: self.bus.publish(FeedRequested(1, "button"))
+            self.manualFeedingButton.when_pressed = self._onLoop(self._timeUntilNextFeeding)
 
     def _initMqtt(self):
-        def feeding_callback(portions):
-            self._feedPortions(portions)
+        def feeding_callback(portions, requestId = None):
+            request = self._feedPortions(portions, "mqtt", requestId)
+            if request is not None and requestId is not None:
+                request.addDoneCallback(lambda request: self.mqttClient.send_feed_result(request))
 
         def status_callback():
-            nextJob = min(schedule.get_jobs('feeding'))
+            nextJob = min(self.scheduler.get_jobs('feeding'))
             feedJob = nextJob.job_func.keywords['feedJob']
             status = {
                 "last_feed": None,
@@ -63,20 +130,43 @@ class CatFeeder(Daemon):
                 "last_feed_status": None,
                 "next_feed": nextJob.next_run.replace(microsecond=0).astimezone().isoformat(),
                 "next_feed_portions": feedJob.portions,
-                "schedule_enabled": True
+                "schedule_enabled": True,
+                "config_version": self.config.version,
+                "queue": self.feedQueue.metrics(),
+                "lag": self.lagMonitor.statistics(),
+                "events": self.bus.statistics(),
+                "motors": {machine.name: machine.stats.statistics() for machine in self.feedingMachines},
+                "analytics": self.analytics.summary() if self.analytics != None else None
             }
             if self.lastJob != None:
-                status["last_feed"] = self.lastJobRun.replace(microsecond=0).astimezone().isoformat()
-                status["last_feed_portions"] = self.lastJob.portions
-                status["last_feed_status"] = self.lastJobStatus
+                status.update(self._lastFeedStatus(self.lastJob, self.lastJobRun, self.lastJobStatus))
             return status
 
-        def update_callback():
-            pass
+        def update_callback(update):
+            # applied from the main loop, the MQTT client may have to be replaced
+            self.pendingUpdates.append(update)
+            if self.runtime != None:
+                self.runtime.wake()
 
         def displaytest_callback(method, params):
             self.display.sendSignal(method, params)
 
+        def debug_callback(command):
+            self.debugTools.submit(command, lambda result: self.mqttClient.send_debug_result(result))
+
+        def analytics_callback(query):
+            if self.analytics == None:
+                return {"query": query, "error": "Analytics are disabled"}
+            return self.analytics.query(query)
+
+        def refill_callback(machineName):
+            if self.analytics != None:
+                names = [machineName] if machineName != None else [machine.name for machine in self.feedingMachines]
+                for name in names:
+                    logger.info('Hopper of '+name+' was refilled')
+                    self.analytics.refill(name)
+                self.mqttClient.send_status_message()
+
         if self.mqttClient != None:
             self.mqttClient.disconnect()
 
@@ -84,14 +174,28 @@ class CatFeeder(Daemon):
             "feeding_callback": feeding_callback,
             "status_callback": status_callback,
             "update_callback": update_callback,
-            "displaytest_callback": displaytest_callback
+            "displaytest_callback": displaytest_callback,
+            "debug_callback": debug_callback,
+            "analytics_callback": analytics_callback,
+            "refill_callback": refill_callback
         })
 
+        if self.eventLoop != None:
+            self.mqttClient.attach_loop(self.eventLoop)
         self.mqttClient.connect()
         self.mqttClient.send_status_message()
 
+    def _lastFeedStatus(self, feedJob, run, jobStatus):
+        return {
+            "last_feed": run.replace(microsecond=0).astimezone().isoformat(),
+            "last_feed_portions": feedJob.portions,
+            "last_feed_status": jobStatus,
+            "last_feed_trace_id": feedJob.span.traceId if feedJob.span != None else None
+        }
+
     def _timeUntilNextFeeding(self):
-        next_job = min(schedule.get_jobs('feeding')).next_run
+        jobs = self.scheduler.get_jobs('feeding')
+        next_job = min(jobs).next_run if jobs else None
         if not next_job:
             logger.debug('no next feeding')
             return None;
@@ -105,18 +209,149 @@ class CatFeeder(Daemon):
 
     def _reloadConfig(self, config = None):
         if(config is None):
-            config = Config()
-            self.config = config
+            # reload the file the daemon was started with
+            config = Config(self.config.file if self.config != None else None)
+        self.config = config
         self.config.readConfig()
 
+        self._initEventBus()
+        self._initFeedQueue()
+        self._initStateStore()
+        self._initLagMonitor()
+        self.debugTools.configure(self.config.debug)
+        tracer.configure(self.config.tracing)
+        self._initNotifications()
         self._initManualFeedingButton()
         self._initDisplay()
         self._initStatusLed()
         self._reloadFeedingMachines()
+        self._initAnalytics()
         self._setupScheduler()
         self._initMqtt()
         self._timeUntilNextFeeding()
 
+    def _initEventBus(self):
+        if self.bus != None:
+            return
+        self.bus = EventBus()
+        # the feeding state depends on every event, this one never drops; with the asyncio runtime it runs on the loop
+        self.bus.subscriber("control", 1024, BLOCK, loop=self.eventLoop) \
+            .on(MachineRound, self._machineRoundHandler) \
+            .on(MachineSuccessful, self._machineSuccessfulHandler) \
+            .on(MachineFailed, self._machineFailureHandler) \
+            .on(MachineFinished, self._machineFinishHandler) \
+            .on(JobProgress, self._saveJobState) \
+            .on(JobSuccessful, self._jobSuccessfulHandler) \
+            .on(JobFailed, self._jobErrorHandler) \
+            .on(JobFinished, self._jobFinished) \
+            .on(FeedRequested, self._feedRequestedHandler)
+        # slow consumers get their own threads, so they do not hold up the motor or the job control;
+        # the analytics must not lose events, with a full queue the producer waits instead
+        self.bus.subscriber("analytics", 1024, BLOCK) \
+            .on(MachineRound, self._recordRound) \
+            .on(MachineFinished, self._recordFinish) \
+            .on(JobFailed, self._recordFailure)
+        self.bus.subscriber("indicators", 64, DROP_OLDEST) \
+            .on(FeedingStarted, self._feedingStarted) \
+            .on(JobFailed, self._indicateFailure) \
+            .on(FeedingFinished, self._feedingFinished)
+        self.bus.start()
+
+    def _initFeedQueue(self):
+        options = self.config.feedQueue
+        self.feedQueue.configure(
+            merge=options.get("merge", True),
+            maxPortions=options.get("maxPortions", MAX_PORTIONS),
+            maxDepth=options.get("maxDepth", 20)
+        )
+
+    def _initStateStore(self):
+        options = self.config.state
+        file = options.get("file", dirname(abspath(self.config.file)) + "/state.json")
+        if self.stateStore != None and self.stateStore.file != file:
+            self.stateStore.stop()
+            self.stateStore = None
+        if self.stateStore == None:
+            self.stateStore = StateStore(file)
+            self.stateStore.load()
+        self.stateStore.writeInterval = options.get("writeInterval", 0.2)
+        self.stateStore.start()
+
+    def _restoreState(self):
+        state = self.stateStore.load()
+        lastJob = state.get("last_job")
+        if lastJob != None:
+            self.lastJob = FeedJob(lastJob["portions"], lastJob.get("time"), [], bus=self.bus)
+            self.lastJobRun = datetime.datetime.fromisoformat(lastJob["run"])
+            self.lastJobStatus = lastJob["status"]
+        job = state.get("job")
+        if job != None and self.config.state.get("resume", True):
+            # machines that are not in the snapshot had finished
+            machinePortions = {machine.name: job["machines"].get(machine.name, 0) for machine in self.feedingMachines}
+            if any(machinePortions.values()):
+                logger.warning('Resuming the interrupted feeding of '+job["started"]+' with '+str(machinePortions))
+                request = FeedRequest(max(machinePortions.values()), "resume", time=job.get("time"))
+                request.machinePortions = machinePortions
+                self._queueFeeding(request)
+        if self.config.state.get("catchUp", False):
+            self._catchUpFeedings(state.get("last_slot"))
+
+    def _catchUpFeedings(self, lastSlot):
+        # without a snapshot there is no way to tell which feedings were missed
+        if lastSlot == None:
+            return
+        lastSlot = datetime.datetime.fromisoformat(lastSlot)
+        now = datetime.datetime.now()
+        graceWindow = datetime.timedelta(seconds=self.config.state.get("graceWindow", 3600))
+        for feedJob in self.feedJobs:
+            slotTime = datetime.time.fromisoformat(feedJob.time)
+            for days in (1, 0):
+                slot = datetime.datetime.combine(now.date() - datetime.timedelta(days=days), slotTime)
+                if lastSlot < slot <= now and now - slot <= graceWindow:
+                    logger.warning('Catching up on the missed feeding of '+slot.isoformat())
+                    self._runFeedJob(feedJob)
+
+    def _saveJobState(self, event):
+        feedJob = event.job
+        self.stateStore.update(job={
+            "portions": feedJob.portions,
+            "time": feedJob.time,
+            "sources": [request.source for request in feedJob.requests],
+            "started": self.lastJobRun.isoformat(),
+            "machines": feedJob.remainingPortions()
+        })
+
+    def _initNotifications(self):
+        if self.notifications != None:
+            self.notifications.stop()
+            self.notifications = None
+        options = self.config.notifications
+        if not options.get("enabled", False):
+            return
+        sinks = []
+        if options.get("smtp"):
+            sinks.append(SmtpSink(options["smtp"]))
+        if options.get("mqtt", False):
+            sinks.append(MqttSink(lambda: self.mqttClient))
+        if options.get("webhook"):
+            sinks.append(WebhookSink(options["webhook"]))
+        self.notifications = NotificationDispatcher(sinks, options.get("queueSize", 100), options.get("rateLimit", 600), options.get("codes"))
+        self.notifications.start()
+
+    def _initAnalytics(self):
+        if self.analytics != None:
+            self.analytics.close()
+            self.analytics = None
+        options = self.config.analytics
+        if not options.get("enabled", True):
+            return
+        hopperCapacity = {machine['name']: machine['hopperCapacity'] for machine in self.config.feedingMachines if machine.get('hopperCapacity')}
+        self.analytics = Analytics(options.get("file", dirname(abspath(self.config.file)) + "/analytics.bin"), hopperCapacity)
+        self.analytics.open()
+
+    def _initLagMonitor(self):
+        self.lagMonitor.lagThreshold = self.config.watchdog.get("lagThreshold", 10)
+
     def _reloadFeedingMachines(self):
         if self.statusLed != None:
             self.statusLed.blink(0.5,0.5,3)
@@ -125,72 +360,188 @@ class CatFeeder(Daemon):
         for machine in self.feedingMachines:
             machine.closeAll()
         del self.feedingMachines[:]
+        if self.motorProcess != None:
+            self.motorProcess.stop()
+            self.motorProcess = None
+        machines = []
         for machine in self.config.feedingMachines:
             if not machine['enabled']:
                 logger.info('Machine '+machine['name']+' is disabled')
                 continue
-            newFeedingMachine = FeedingMachine(machine['name'], machine['motorPort'], machine['motorSensorPort'], machine['foodSensorPortOut'], machine['foodSensorPortIn'])
+            machines.append(machine)
+        if self.config.motorProcess.get("enabled", False):
+            self.motorProcess = MotorControlProcess(machines, self.config.motorProcess.get("priority", 50), bus=self.bus)
+            self.motorProcess.start()
+            newFeedingMachines = self.motorProcess.machines
+        else:
+            newFeedingMachines = [FeedingMachine(machine['name'], machine['motorPort'], machine['motorSensorPort'], machine['foodSensorPortOut'], machine['foodSensorPortIn'], self.bus) for machine in machines]
+        for machine, newFeedingMachine in zip(machines, newFeedingMachines):
+            newFeedingMachine.power = machine.get('power', 0)
+            if self.motorProcess == None:
+                newFeedingMachine.nominalRotationTime = machine.get('nominalRotationTime')
             self.feedingMachines.append(newFeedingMachine)
 
     def _initStatusLed(self):
+        if self.statusLed != None:
+            self.statusLed.close()
+            self.statusLed = None
         if self.config.statusLedPort != None:
-            if self.statusLed:
-                self.statusLed.close()
             self.statusLed = LED(self.config.statusLedPort)
 
-    def _createFeedJob(self, portions = 1, time = None):
-        feedJob = FeedJob(portions, time, self.feedingMachines)
-        feedJob.onError = partial(self._jobErrorHandler, feedJob)
-        feedJob.onFinish = partial(self._jobFinished, feedJob)
-        feedJob.onSuccessful = partial(self._jobSuccessfulHandler, feedJob)
+    def _createFeedJob(self, portions = 1, time = None, machinePortions = None):
+        feedJob = FeedJob(portions, time, self.feedingMachines, machinePortions, self.bus)
+        feedJob.concurrency = self.config.dispatch.get("concurrency")
+        feedJob.powerBudget = self.config.dispatch.get("powerBudget")
+        feedJob.startStagger = self.config.dispatch.get("startStagger", 0)
         return feedJob
 
-    def _feedPortions(self, portions = 1):
-        logger.debug('Manual feeding')
-        feedJob = self._createFeedJob(portions)
-        wasFed = self._runFeedJob(feedJob)
-        if not wasFed:
-            logger.warning('Cannot feed now, another feeding sequence is already running')
+    def _machineFailureHandler(self, event):
+        self.lastJob.machineFailed(event.machine, event.error)
+
+    def _machineSuccessfulHandler(self, event):
+        self.lastJob.machineSuccessful(event.machine)
+
+    def _machineFinishHandler(self, event):
+        self.lastJob.machineFinished(event.machine)
+
+    def _machineRoundHandler(self, event):
+        self.lastJob.machineRound(event.machine)
+
+    def _feedRequestedHandler(self, event):
+        self._feedPortions(event.portions, event.source)
+
+    def _recordRound(self, event):
+        if self.analytics != None:
+            self.analytics.recordPortion(event.machine.name, event.rotationTime)
+
+    def _recordFinish(self, event):
+        if self.analytics != None:
+            self.analytics.recordFinish(event.machine.name, event.noFoodCounter)
+
+    def _recordFailure(self, event):
+        if self.analytics != None:
+            self.analytics.recordFailure(event.machine.name, event.error.code)
+
+    def _feedPortions(self, portions = 1, source = "manual", requestId = None):
+        logger.debug('Feeding request from '+source)
+        return self._queueFeeding(FeedRequest(portions, source, requestId))
 
     def _runFeedJob(self, feedJob: FeedJob):
-        if not self.jobIsRunning:
+        self.stateStore.update(last_slot=datetime.datetime.now().isoformat())
+        request = FeedRequest(feedJob.portions, "schedule", time=feedJob.time)
+        request.machinePortions = feedJob.machinePortions
+        self._queueFeeding(request)
+
+    def _queueFeeding(self, request: FeedRequest):
+        # a schedule entry may feed only the machines it lists
+        if max([request.portions] + list(request.machinePortions.values())) < 1:
+            logger.error('Cannot feed '+str(request.portions)+' portions')
+            request.complete("invalid")
+            return None
+        queued = self.feedQueue.push(request)
+        if queued is not request and queued is not None:
+            logger.info('Feed request '+str(request.requestId)+' was already received')
+        elif self.jobIsRunning:
+            logger.info('Another feeding sequence is running, the request was queued')
+        self._dispatchFeeding()
+        return queued
+
+    def _dispatchFeeding(self):
+        with self.jobLock:
+            if self.jobIsRunning:
+                return False
+            batch = self.feedQueue.pop()
+            if not batch:
+                return False
             self.jobIsRunning = True
-            self.lastJob = feedJob
-            self.lastJobRun = datetime.datetime.now()
-            self.lastJobStatus = "running"
-            self.mqttClient.send_status_message()
-            feedJob.feed()
-            self.display.sendTime()
-            self._timeUntilNextFeeding()
-            self.statusLedActive = True
-            if self.statusLed != None:
-                self.statusLed.on()
-            return True
-        else:
-            return False
+        portions = sum([request.portions for request in batch])
+        machinePortions = None
+        if any([request.machinePortions for request in batch]):
+            machinePortions = {machine.name: sum([request.machinePortions.get(machine.name, request.portions) for request in batch]) for machine in self.feedingMachines}
+        if len(batch) > 1:
+            logger.info(f"Merged {len(batch)} feed requests into one job of {portions} portions")
+        feedJob = self._createFeedJob(portions, batch[0].time, machinePortions)
+        feedJob.requests = batch
+        feedJob.span = self._startTrace(feedJob, batch)
+        self.lastJob = feedJob
+        self.lastJobRun = datetime.datetime.now()
+        self.lastJobStatus = "running"
+        self.bus.publish(FeedingStarted(feedJob))
+        feedJob.feed()
+        return True
+
+    def _startTrace(self, feedJob, batch):
+        # the trace starts when the first request came in, so the time in the queue is included
+        span = tracer.startTrace("feed_job", monotonicToNs(min([request.createdAt for request in batch])),
+            portions=feedJob.portions,
+            trigger=",".join(sorted(set([request.source for request in batch]))),
+            requests=len(batch))
+        if span == None:
+            return None
+        logger.info('Feed job trace '+span.traceId+' ('+span.attributes["trigger"]+')')
+        for request in batch:
+            queued = span.child("queued", monotonicToNs(request.createdAt), source=request.source, request_id=request.requestId, portions=request.portions)
+            queued.finish(monotonicToNs(request.startedAt))
+        return span
+
+    def _feedingStarted(self, event):
+        self.mqttClient.send_status_message()
+        self.display.sendTime()
+        self._timeUntilNextFeeding()
+        self.statusLedActive = True
+        if self.statusLed != None:
+            self.statusLed.on()
 
-    def _jobSuccessfulHandler(self, feedJob, machine):
+    def _jobSuccessfulHandler(self, event):
         self.lastJobStatus = "successful"
 
-    def _jobErrorHandler(self, feedJob, machine, error):
-        self.statusLedActive = True
-        if error.code != None:
-            self.lastJobStatus = error.code
+    def _jobErrorHandler(self, event):
+        if event.error.code != None:
+            self.lastJobStatus = event.error.code
         else:
             self.lastJobStatus = "error"
+
+    def _indicateFailure(self, event):
+        self.statusLedActive = True
+        status = event.error.code if event.error.code != None else "error"
         if self.statusLed != None:
             self.statusLed.blink(0.1,0.2,30,False)
         self.statusLedActive = False
+        if self.notifications != None:
+            name = self.config.device.get("name", self.config.device.get("id"))
+            self.notifications.notify(Notification(status, f"{name}: machine {event.machine.name} {status}", event.error.message, self.config.device.get("id"), event.machine.name))
 
-    def _jobFinished(self, feedJob):
+    def _feedingFinished(self, event):
         if self.statusLed != None:
             self.statusLed.off()
         self.statusLedActive = False
-        self.jobIsRunning = False
-        self.display.sendFeedingSuccessful(feedJob)
-        logger.debug('Job has finished')
+        self.display.sendFeedingSuccessful(event.job)
         self._timeUntilNextFeeding()
-        self.mqttClient.send_status_message()
+        # the next job may already be running, report the one that finished
+        self.mqttClient.send_status_message(self._lastFeedStatus(event.job, event.run, event.status))
+
+    def _jobFinished(self, event):
+        feedJob = event.job
+        logger.debug('Job has finished')
+        if self.lastJobStatus == "running":
+            self.lastJobStatus = "error"
+        if feedJob.span != None:
+            feedJob.span.setAttribute("status", self.lastJobStatus)
+            if self.lastJobStatus != "successful":
+                feedJob.span.setError(self.lastJobStatus)
+            feedJob.span.finish()
+        for request in feedJob.requests:
+            request.complete(self.lastJobStatus)
+        self.stateStore.update(job=None, last_job={
+            "portions": feedJob.portions,
+            "time": feedJob.time,
+            "run": self.lastJobRun.isoformat(),
+            "status": self.lastJobStatus
+        })
+        with self.jobLock:
+            self.jobIsRunning = False
+        self.bus.publish(FeedingFinished(feedJob, self.lastJobStatus, self.lastJobRun))
+        self._dispatchFeeding()
 
     def _heartbeat(self):
         if self.statusLed != None:
@@ -200,22 +551,29 @@ class CatFeeder(Daemon):
             logger.debug('Heartbeat')
 
     def _setupScheduler(self):
-        schedule.clear()
+        self.scheduler.clear()
         self.feedJobs = []
         if self.statusLed != None:
-            schedule.every(10).seconds.do(self._heartbeat).tag('debug')
-        schedule.every().day.at("00:00").do(self.display.sendTime).tag('display')
+            self.scheduler.every(10).seconds.do(self._heartbeat).tag('debug')
+        self.scheduler.every().day.at("00:00").do(self.display.sendTime).tag('display')
         for feeding in self.config.schedule:
             logger.info("I will feed " + str(feeding['portions']) + " portions at " + feeding['time'])
-            feedJob = self._createFeedJob(feeding['portions'], feeding['time'])
-            schedule.every().day.at(feeding['time']).do(self._runFeedJob, feedJob=feedJob).tag('feeding')
+            feedJob = self._createFeedJob(feeding['portions'], feeding['time'], feeding.get('machines'))
+            self.scheduler.every().day.at(feeding['time']).do(self._runFeedJob, feedJob=feedJob).tag('feeding')
             self.feedJobs.append(feedJob)
 
     def _unload(self):
         logger.info('Stopping CatFeeder service')
-        schedule.clear()
+        self.scheduler.clear()
+        self.feedQueue.clear()
         for machine in self.feedingMachines:
             machine.closeAll()
+        if self.motorProcess != None:
+            self.motorProcess.stop()
+        if self.bus != None:
+            # delivers what is still queued, so the LED, display and analytics see the last job
+            self.bus.stop()
+            self.bus = None
         if self.manualFeedingButton != None:
             self.manualFeedingButton.close()
         if self.statusLed != None:
@@ -224,13 +582,102 @@ class CatFeeder(Daemon):
             self.display.unload()
         if self.mqttClient != None:
             self.mqttClient.disconnect()
+        if self.stateStore != None:
+            self.stateStore.stop()
+        if self.notifications != None:
+            self.notifications.stop()
+        if self.analytics != None:
+            self.analytics.close()
+
+    def _reinitialise(self, changed):
+        # only the subsystems whose part of the configuration has changed
+        if "feedQueue" in changed:
+            self._initFeedQueue()
+        if "state" in changed:
+            self._initStateStore()
+        if "watchdog" in changed:
+            self._initLagMonitor()
+        if "debug" in changed:
+            self.debugTools.configure(self.config.debug)
+        if "notifications" in changed:
+            self._initNotifications()
+        if "tracing" in changed:
+            tracer.configure(self.config.tracing)
+        if "manualFeedingButtonPort" in changed:
+            self._initManualFeedingButton()
+        if "display" in changed:
+            self._initDisplay()
+        if "statusLedPort" in changed:
+            self._initStatusLed()
+        if "feedingMachines" in changed or "motorProcess" in changed:
+            self._reloadFeedingMachines()
+        if "feedingMachines" in changed or "analytics" in changed:
+            self._initAnalytics()
+        if changed & {"schedule", "feedingMachines", "motorProcess", "statusLedPort", "display"}:
+            self._setupScheduler()
+            self.display.sendFeedingJobs()
+            self._timeUntilNextFeeding()
+        if "mqtt" in changed or "device" in changed:
+            self._initMqtt()
+
+    def _applyConfigUpdate(self):
+        update = self.pendingUpdates[0]
+        oldData = self.config.data
+        try:
+            newData = self.config.buildUpdate(update)
+        except ConfigError as err:
+            self.pendingUpdates.popleft()
+            logger.warning(f"Configuration update was rejected: {err.message}")
+            self.mqttClient.send_update_result({"version": update.get("version"), "status": "rejected", "error": err.code, "message": err.message, "current_version": self.config.version})
+            return
+        changed = set([key for key in set(oldData) | set(newData) if key != "version" and oldData.get(key) != newData.get(key)])
+        if changed & {"feedingMachines", "motorProcess"} and self.jobIsRunning:
+            # try again when the machines are idle
+            return
+        self.pendingUpdates.popleft()
+        # the client the update came in on stays until the update is acknowledged
+        reconnect = changed & {"mqtt", "device"}
+        try:
+            self.config.writeConfig(newData)
+            self.config.applyData(newData)
+            self._reinitialise(changed - reconnect)
+        except Exception as err:
+            logger.error(f"Configuration version {newData['version']} failed, rolling back: {err}")
+            self._rollbackConfig(oldData, changed - reconnect)
+            result = {"version": newData["version"], "status": "rolled_back", "error": "apply_failed", "message": str(err), "current_version": self.config.version}
+        else:
+            logger.info(f"Configuration version {self.config.version} applied ({', '.join(sorted(changed)) or 'no changes'})")
+            result = {"version": newData["version"], "status": "applied", "changed": sorted(changed)}
+        self.mqttClient.send_update_result(result)
+        if reconnect and result["status"] == "applied":
+            self._initMqtt()
+
+    def _rollbackConfig(self, oldData, changed):
+        # a failing rollback must not stop the daemon
+        try:
+            self.config.writeConfig(oldData)
+        except Exception as err:
+            logger.error(f"Cannot write back configuration version {oldData.get('version', 0)}: {err}")
+        self.config.applyData(oldData)
+        try:
+            self._reinitialise(changed)
+        except Exception as err:
+            logger.error(f"Rolling back to configuration version {self.config.version} failed: {err}")
+
+    def _recordSchedulerLag(self):
+        now = datetime.datetime.now()
+        for job in self.scheduler.get_jobs():
+            if job.should_run:
+                self.lagMonitor.recordTimer((now - job.next_run).total_seconds())
 
     def run(self):
         try:
             if self.isReloadSignal:
                 self._reloadConfig()
                 self.isReloadSignal = False
-            else:
-                schedule.run_pending()
+            elif self.pendingUpdates:
+                self._applyConfigUpdate()
+            self._recordSchedulerLag()
+            self.scheduler.run_pending()
         except Exception:
             raise
@@ -1,25 +1,126 @@
-import json
+import json, os, re, copy, tempfile
 from os.path import abspath, dirname
 
+class ConfigError(Exception):
+    """Exception raised when a configuration or a configuration update is invalid
+
+    Attributes:
+        code -- short reason, sent back with the update result
+        message -- explanation of the error
+    """
+
+    def __init__(self, code, message):
+        super(ConfigError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+TIME_PATTERN = re.compile(r"^([01]\d|2[0-3]):[0-5]\d(:[0-5]\d)?$")
+MACHINE_KEYS = ("name", "enabled", "motorPort", "motorSensorPort", "foodSensorPortOut", "foodSensorPortIn")
+
+def atomicWrite(file, data, prefix):
+    """Write data next to file and swap it in, so a crash never leaves half a file"""
+    directory = dirname(abspath(file))
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path, file)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+def _pointer(path):
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise ConfigError("invalid_patch", f"Invalid path '{path}'")
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+def _resolve(document, parts):
+    target = document
+    for part in parts:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            target = target[part]
+    return target
+
+def applyPatch(document, operations):
+    """Apply JSON patch (RFC 6902) operations add, remove, replace and test to a copy of document"""
+    document = copy.deepcopy(document)
+    for operation in operations:
+        op = operation.get("op")
+        parts = _pointer(operation.get("path", ""))
+        if not parts:
+            raise ConfigError("invalid_patch", "Cannot patch the whole document")
+        try:
+            parent = _resolve(document, parts[:-1])
+            key = parts[-1]
+            if isinstance(parent, list) and key != "-":
+                key = int(key)
+            if op == "test":
+                if parent[key] != operation.get("value"):
+                    raise ConfigError("test_failed", f"Test of {operation['path']} failed")
+            elif op == "remove":
+                del parent[key]
+            elif op == "replace":
+                parent[key]  # replace only existing values
+                parent[key] = operation["value"]
+            elif op == "add":
+                if isinstance(parent, list):
+                    if key == "-":
+                        parent.append(operation["value"])
+                    else:
+                        parent.insert(key, operation["value"])
+                else:
+                    parent[key] = operation["value"]
+            else:
+                raise ConfigError("invalid_patch", f"Unsupported operation '{op}'")
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise ConfigError("invalid_patch", f"Cannot {op} {operation.get('path')}")
+    return document
+
 class Config:
-    file = ""
-    schedule = []
-    loglevel = "ERROR"
-    feedingMachines = []
-    manualFeedingButtonPort = None
-    statusLedPort = None
-    mqtt = {}
-    device = {}
+    __slots__ = ("file", "data", "version", "schedule", "loglevel", "feedingMachines", "manualFeedingButtonPort", "statusLedPort", "mqtt", "device", "feedQueue", "watchdog", "debug", "motorProcess", "dispatch", "display", "tracing", "state", "notifications", "analytics", "runtime")
 
     def __init__(self, file = None):
         if(file is None):
             file = dirname(abspath(__file__)) + "/config.json"
         self.file = file
+        self.data = {}
+        self.version = 0
+        self.schedule = []
+        self.loglevel = "ERROR"
+        self.feedingMachines = []
+        self.manualFeedingButtonPort = None
+        self.statusLedPort = None
+        self.mqtt = {}
+        self.device = {}
+        self.feedQueue = {}
+        self.watchdog = {}
+        self.debug = {}
+        self.motorProcess = {}
+        self.dispatch = {}
+        self.display = {}
+        self.tracing = {}
+        self.state = {}
+        self.notifications = {}
+        self.analytics = {}
+        self.runtime = {}
         self.readConfig()
 
     def readConfig(self):
         f = open(self.file, "r")
         data = json.loads(f.read())
+        self.applyData(data)
+        f.close()
+
+    def applyData(self, data):
+        self.data = data
+        self.version = data.get("version", 0)
         self.schedule = data["schedule"]
         self.loglevel = data["loglevel"]
         self.feedingMachines = data["feedingMachines"]
@@ -27,4 +128,65 @@ class Config:
         self.statusLedPort = data["statusLedPort"]
         self.mqtt = data["mqtt"]
         self.device = data["device"]
-        f.close() 
+        self.feedQueue = data.get("feedQueue", {})
+        self.watchdog = data.get("watchdog", {})
+        self.debug = data.get("debug", {})
+        self.motorProcess = data.get("motorProcess", {})
+        self.dispatch = data.get("dispatch", {})
+        self.display = data.get("display", {})
+        self.tracing = data.get("tracing", {})
+        self.state = data.get("state", {})
+        self.notifications = data.get("notifications", {})
+        self.analytics = data.get("analytics", {})
+        self.runtime = data.get("runtime", {})
+
+    def writeConfig(self, data):
+        atomicWrite(self.file, json.dumps(data, indent=2), ".config.")
+
+    def buildUpdate(self, update):
+        """Return the new configuration for an update message, raises ConfigError when it cannot be applied
+
+        An update contains a version and either a complete "config" or a
+        "patch" with JSON patch operations on "base_version".
+        """
+        version = update.get("version")
+        if not isinstance(version, int):
+            raise ConfigError("invalid_update", "An update needs an integer version")
+        if version <= self.version:
+            raise ConfigError("outdated", f"Version {version} is not newer than {self.version}")
+        if "config" in update:
+            data = copy.deepcopy(update["config"])
+        elif "patch" in update:
+            if update.get("base_version") != self.version:
+                raise ConfigError("version_conflict", f"Patch is based on version {update.get('base_version')}, current version is {self.version}")
+            data = applyPatch(self.data, update["patch"])
+        else:
+            raise ConfigError("invalid_update", "An update needs a config or a patch")
+        data["version"] = version
+        self.validate(data)
+        return data
+
+    @staticmethod
+    def validate(data):
+        for key in ("schedule", "loglevel", "feedingMachines", "manualFeedingButtonPort", "statusLedPort", "mqtt", "device"):
+            if key not in data:
+                raise ConfigError("invalid_config", f"'{key}' is missing")
+        if not isinstance(data["schedule"], list):
+            raise ConfigError("invalid_config", "'schedule' must be a list")
+        for feeding in data["schedule"]:
+            if not isinstance(feeding.get("time"), str) or not TIME_PATTERN.match(feeding["time"]):
+                raise ConfigError("invalid_config", f"Invalid feeding time {feeding.get('time')}")
+            if not isinstance(feeding.get("portions"), int) or feeding["portions"] < 0:
+                raise ConfigError("invalid_config", f"Invalid portions for {feeding['time']}")
+        if not isinstance(data["feedingMachines"], list):
+            raise ConfigError("invalid_config", "'feedingMachines' must be a list")
+        names = set()
+        for machine in data["feedingMachines"]:
+            for key in MACHINE_KEYS:
+                if key not in machine:
+                    raise ConfigError("invalid_config", f"Machine is missing '{key}'")
+            if machine["name"] in names:
+                raise ConfigError("invalid_config", f"Machine name {machine['name']} is used twice")
+            names.add(machine["name"])
+        if not isinstance(data["mqtt"], dict) or not isinstance(data["device"], dict) or not data["device"].get("id"):
+            raise ConfigError("invalid_config", "'mqtt' and 'device' with an 'id' are required")
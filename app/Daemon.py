@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import sys, os, time, psutil, signal, logging
+from LagMonitor import lagMonitor, sdNotify
 logger = logging.getLogger(__name__)
 logger.propagate = True
 
@@ -14,6 +15,7 @@ class Daemon(object):
         self.restartPause = 1    # 0 means without a pause between stop and start during the restart of the daemon
         self.waitToHardKill = 5  # when terminate a process, wait until kill the process with SIGTERM signal
         self.isReloadSignal = False
+        self.lagMonitor = lagMonitor
         self._canDaemonRun = True
         self.processName = os.path.basename(sys.argv[0])
         self.stdin = stdin
@@ -26,6 +28,8 @@ class Daemon(object):
         self.isReloadSignal = True
     def _user1_handler(self, signum, frame):
         self._runUser1Handler()
+    def _user2_handler(self, signum, frame):
+        self._runUser2Handler()
     def _makeDaemon(self):
         """
         Make a daemon, do double-fork magic.
@@ -83,6 +87,7 @@ class Daemon(object):
         signal.signal(signal.SIGTERM, self._sigterm_handler)
         signal.signal(signal.SIGHUP, self._reload_handler)
         signal.signal(signal.SIGUSR1, self._user1_handler)
+        signal.signal(signal.SIGUSR2, self._user2_handler)
         # Check if the daemon is already running.
         procs = self._getProces()
         if procs:
@@ -102,6 +107,7 @@ class Daemon(object):
         signal.signal(signal.SIGTERM, self._sigterm_handler)
         signal.signal(signal.SIGHUP, self._reload_handler)
         signal.signal(signal.SIGUSR1, self._user1_handler)
+        signal.signal(signal.SIGUSR2, self._user2_handler)
 
         self._setup()
         # Start a infinitive loop that periodically runs run() method
@@ -140,6 +146,17 @@ class Daemon(object):
                 logger.info(f"Send SIGUSR1 signal into the daemon process with PID {p.pid}.")
         else:
             logger.info("The daemon is not running!")
+    def user2Signal(self):
+        """
+        Send USR2 signal to daemon.
+        """
+        procs = self._getProces()
+        if procs:
+            for p in procs:
+                os.kill(p.pid, signal.SIGUSR2)
+                logger.info(f"Send SIGUSR2 signal into the daemon process with PID {p.pid}.")
+        else:
+            logger.info("The daemon is not running!")
     def stop(self):
         """
         Stop the daemon.
@@ -172,20 +189,35 @@ class Daemon(object):
         """
         Define own options here.
         """
+    def _runUser2Handler():
+        """
+        Define own options here.
+        """
     def _unload():
         """
         Define unload options here.
         """
     def _infiniteLoop(self):
         try:
+            self.lagMonitor.start()
+            sdNotify("READY=1")
             if self.pauseRunLoop:
                 time.sleep(self.pauseRunLoop)
+                deadline = time.monotonic()
                 while self._canDaemonRun:
+                    self.lagMonitor.tick(deadline)
+                    if time.monotonic() - deadline > self.pauseRunLoop:
+                        # we are too far behind, do not try to catch up
+                        deadline = time.monotonic()
                     self.run()
-                    time.sleep(self.pauseRunLoop)
+                    deadline += self.pauseRunLoop
+                    time.sleep(max(0, deadline - time.monotonic()))
             else:
                 while self._canDaemonRun:
+                    self.lagMonitor.tick(time.monotonic())
                     self.run()
+            sdNotify("STOPPING=1")
+            self.lagMonitor.stop()
             self._unload()
         except Exception as e:
             logger.error(f"Run method failed: {e}")
@@ -1,32 +1,75 @@
 import serial, logging, threading
-from time import sleep, localtime
+from time import sleep, localtime, monotonic
 from functools import partial
+from UartCapture import UartCapture, FrameDecoder, RX, TX
+from EventBus import FeedRequested
 
 logger = logging.getLogger(__name__)
 
+class ChecksumError(Exception):
+    pass
+
 class Display:
 
     ser = None
     config = None
+    capture = None
     ownAddress = [255,255]
     displayAddress = [255,252]
-
-    onManualFeed = None
+    # seconds the panel needs before it accepts the answer to some requests
+    responseDelay = 1
+    # at most one dump of the capture per this many seconds
+    dumpInterval = 60
+
+    bus = None
+    loop = None
+    executor = None
     _running = False
+    _lastDump = None
+    _readerFd = None
 
-    def __init__(self, config):
+    def __init__(self, config, connect = True, loop = None, executor = None, bus = None):
         self.config = config
+        self.loop = loop
+        self.executor = executor
+        self.bus = bus
+        captureOptions = config.display.get("capture", {})
+        self.capture = UartCapture(captureOptions.get("size", 4096), captureOptions.get("file"))
+        self.dumpOnError = captureOptions.get("dumpOnError")
+        self.decoder = FrameDecoder(self.ownAddress)
+        self.checksumErrors = 0
+        if not connect:
+            return
         try:
-            self.ser = serial.Serial ("/dev/ttyS0", 2400, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE)
-            self.onManualFeed = self._void
+            port = config.display.get("port", "/dev/ttyS0")
+            self.ser = serial.serial_for_url(port, 2400, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE)
             self._running = True
-            threading.Thread(target=self._startListener).start()
+            if not self._attachReader():
+                threading.Thread(target=self._startListener).start()
             self.install()
         except serial.SerialException as err:
             pass
 
-    def _void(self):
-        pass
+    def _attachReader(self):
+        # with an event loop the port is watched by the loop instead of a listener thread
+        if self.loop is None:
+            return False
+        try:
+            self._readerFd = self.ser.fileno()
+        except (AttributeError, OSError):
+            return False
+        self.loop.add_reader(self._readerFd, self._readAvailable)
+        return True
+
+    def _readAvailable(self):
+        try:
+            received = self.ser.read(self.ser.in_waiting or 1)
+        except serial.SerialException as err:
+            logger.error(f"Display port failed: {err}")
+            self.loop.remove_reader(self._readerFd)
+            self._readerFd = None
+            return
+        self._received(received)
 
     def install(self):
         self.sendStatus()
@@ -35,8 +78,12 @@ class Display:
 
     def unload(self):
         self._running = False
+        if self._readerFd is not None:
+            self.loop.remove_reader(self._readerFd)
+            self._readerFd = None
         if self.ser != None:
             self.ser.close()
+        self.capture.close()
 
     def sendTime(self):
         now=localtime()
@@ -90,7 +137,9 @@ class Display:
         line.append(checksum)
 #        logger.debug(f'Sending data to display: {line}')
         if self.ser is not None:
-            self.ser.write(bytearray(line))
+            data = bytearray(line)
+            self.capture.record(TX, data)
+            self.ser.write(data)
 
     def _interpretInput(self, method, data = []):
 #        match method:
@@ -98,11 +147,14 @@ class Display:
         if method == 1 and len(data) > 1:
             self.sendSignal(1, [170])
             if data[1:] == [0,1,0,1,0,1]:
-                self.onManualFeed()
+                if self.bus != None:
+                    self.bus.publish(FeedRequested(1, "display"))
+                else:
+                    logger.warning('Manual feeding from the display is ignored, there is no event bus')
             elif data[0] <= 24:
                 #TODO: update feedingtime
                 if data[5] == 6:
-                    sleep(1)
+                    sleep(self.responseDelay)
                     self.sendFeedingJobs()
         elif method == 2:
             self.sendFeedingJobs()
@@ -111,7 +163,7 @@ class Display:
             self.sendStatus()
         elif method == 6:
             self.sendSignal(6, [170])
-            sleep(1)
+            sleep(self.responseDelay)
             self.sendTime()
         elif method == 9:
             if len(data) > 0 and data[0] == 255:
@@ -127,29 +179,53 @@ class Display:
         elif method == 18:
             logger.debug('play recording')
         else:
-            logger.warning("unknown UART signal received: ", [method, data])
-        return
+            logger.warning(f"unknown UART signal received: {[method, data]}")
+            return False
+        return True
 
     def _validateInput(self, mth, len, data, checksum):
         calculatedChecksum = sum(self.ownAddress + [mth, len] + data) & 0xFF
         checksumSuccesful = checksum == calculatedChecksum
         if checksumSuccesful:
-            self._interpretInput(mth, data)
+            return self._interpretInput(mth, data)
         else:
-            raise Exception('Checksum invalid', [mth, len, data, checksum])
+            raise ChecksumError('Checksum invalid', [mth, len, data, checksum])
+
+    def _handleFrame(self, mth, len, data, checksum):
+        try:
+            return self._validateInput(mth, len, data, checksum)
+        except ChecksumError as err:
+            self.checksumErrors += 1
+            logger.warning(f"Invalid checksum on display input: {err.args[1]}")
+            self._dumpCapture()
+
+    def _dumpCapture(self):
+        if self.dumpOnError is None:
+            return
+        now = monotonic()
+        if self._lastDump is not None and now - self._lastDump < self.dumpInterval:
+            return
+        self._lastDump = now
+        try:
+            records = self.capture.dump(self.dumpOnError)
+            logger.warning(f"Wrote the last {records} UART records to {self.dumpOnError}")
+        except OSError as err:
+            logger.error(f"Cannot write UART capture: {err}")
 
     def _startListener(self):
         while self._running:
             try:
-                self.ser.read_until(bytearray(self.ownAddress))
-                meta = self.ser.read(2)
-                mth = meta[0]
-                len = meta[1]
-                data = []
-                if len > 0:
-                    data = list(self.ser.read(len))
-                checksum = self.ser.read(1)
-                checksum = checksum[0]
-                threading.Thread(target=partial(self._validateInput, mth, len, data, checksum)).start()
+                self._received(self.ser.read(self.ser.in_waiting or 1))
             except Exception:
                 continue
+
+    def _received(self, received):
+        if not received:
+            return
+        self.capture.record(RX, received)
+        for frame in self.decoder.feed(received):
+            # handling may wait for the panel, keep it off the reader
+            if self._readerFd is not None:
+                self.loop.run_in_executor(self.executor, partial(self._handleFrame, *frame))
+            else:
+                threading.Thread(target=partial(self._handleFrame, *frame)).start()
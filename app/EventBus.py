@@ -0,0 +1,224 @@
+import time, threading, logging
+from collections import deque
+from typing import NamedTuple, Any
+from LagMonitor import percentiles
+
+logger = logging.getLogger(__name__)
+
+# what a subscriber does with an event when its queue is full
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+
+class MachineRound(NamedTuple):
+    machine: Any
+    currentRound: int
+    rotationTime: float
+
+class MachineSuccessful(NamedTuple):
+    machine: Any
+
+class MachineFailed(NamedTuple):
+    machine: Any
+    error: Any
+
+class MachineFinished(NamedTuple):
+    machine: Any
+    noFoodCounter: int
+
+class JobProgress(NamedTuple):
+    job: Any
+
+class JobSuccessful(NamedTuple):
+    job: Any
+    machine: Any
+
+class JobFailed(NamedTuple):
+    job: Any
+    machine: Any
+    error: Any
+
+class JobFinished(NamedTuple):
+    job: Any
+
+class FeedingStarted(NamedTuple):
+    job: Any
+
+class FeedingFinished(NamedTuple):
+    job: Any
+    status: str
+    run: Any
+
+class FeedRequested(NamedTuple):
+    portions: int
+    source: str
+
+class Subscriber:
+    """Handlers for event types, delivered in publishing order
+
+    A queued subscriber has a bounded queue and its own dispatch thread, or
+    runs on an asyncio loop when one is given. An inline subscriber runs its
+    handlers on the publishing thread and is meant for cheap handlers only.
+    """
+
+    def __init__(self, bus, name, queueSize = 256, overflow = DROP_OLDEST, loop = None, inline = False):
+        self.bus = bus
+        self.name = name
+        self.queueSize = queueSize
+        self.overflow = overflow
+        self.loop = loop
+        self.inline = inline
+        self.handlers = {}
+        self.delivered = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=1000)
+        # appending and popping on a deque is atomic, the producer only takes a lock to wake the consumer
+        self._queue = deque(maxlen=queueSize if overflow == DROP_OLDEST else None)
+        self._space = threading.Condition()
+        self._waiting = 0
+        self._consumer = None
+        self._wakeup = threading.Event()
+        self._sleeping = False
+        self._scheduled = False
+        self._stopped = False
+        self._thread = None
+
+    def on(self, eventType, handler):
+        self.handlers[eventType] = handler
+        self.bus._route(eventType, self)
+        return self
+
+    def offer(self, event):
+        if self.inline:
+            self._deliver(event)
+            return
+        queue = self._queue
+        if len(queue) < self.queueSize:
+            pass
+        elif self.overflow == BLOCK:
+            # a handler publishing to its own subscriber must not wait for itself
+            if threading.get_ident() != self._consumer:
+                self._waitForSpace()
+        else:
+            # deque drops the oldest entry itself
+            self.dropped += 1
+            if self.overflow == DROP_NEWEST:
+                return
+        queue.append((time.monotonic(), event))
+        if self.loop != None:
+            if not self._scheduled:
+                self._scheduled = True
+                self.loop.call_soon_threadsafe(self._drain)
+        elif self._sleeping:
+            self._wakeup.set()
+
+    def _deliver(self, event, publishedAt = None):
+        if publishedAt != None:
+            self.latencies.append(time.monotonic() - publishedAt)
+        self.delivered += 1
+        try:
+            self.handlers[type(event)](event)
+        except Exception as err:
+            logger.error(f"Handler of {self.name} for {type(event).__name__} failed: {err}")
+
+    def _waitForSpace(self):
+        with self._space:
+            self._waiting += 1
+            while len(self._queue) >= self.queueSize and not self._stopped:
+                self._space.wait(0.1)
+            self._waiting -= 1
+
+    def _next(self):
+        entry = self._queue.popleft()
+        if self._waiting:
+            with self._space:
+                self._space.notify()
+        return entry
+
+    def _drain(self):
+        self._consumer = threading.get_ident()
+        self._scheduled = False
+        while self._queue:
+            publishedAt, event = self._next()
+            self._deliver(event, publishedAt)
+
+    def _run(self):
+        self._consumer = threading.get_ident()
+        queue = self._queue
+        while True:
+            if queue:
+                publishedAt, event = self._next()
+                self._deliver(event, publishedAt)
+                continue
+            if self._stopped:
+                return
+            self._sleeping = True
+            # an event published after the check above sees _sleeping and sets the wakeup
+            if not queue and not self._stopped:
+                self._wakeup.wait()
+                self._wakeup.clear()
+            self._sleeping = False
+
+    def start(self):
+        if self.inline or self.loop != None or self._thread != None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="Events-" + self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout = 5):
+        """Stop after the queued events were delivered"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread != None:
+            if self._thread is not threading.current_thread():
+                self._thread.join(timeout)
+            self._thread = None
+
+    def statistics(self):
+        return {
+            "depth": len(self._queue),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "latency_ms": percentiles(list(self.latencies), 1000, 3)
+        }
+
+class EventBus:
+    """Typed events from producers to pre-registered subscribers
+
+    publish() looks up the subscribers of the event type in a dictionary
+    that is replaced, never changed, when a subscription is added, and hands
+    the event to each of them without taking a lock. Slow consumers run on
+    their own dispatch thread, so they do not hold up the producer.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self._routes = {}
+
+    def subscriber(self, name, queueSize = 256, overflow = DROP_OLDEST, loop = None, inline = False):
+        subscriber = Subscriber(self, name, queueSize, overflow, loop, inline)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def _route(self, eventType, subscriber):
+        routes = dict(self._routes)
+        subscribers = routes.get(eventType, ())
+        if subscriber not in subscribers:
+            routes[eventType] = subscribers + (subscriber,)
+        self._routes = routes
+
+    def publish(self, event):
+        for subscriber in self._routes.get(type(event), ()):
+            subscriber.offer(event)
+
+    def start(self):
+        for subscriber in self.subscribers:
+            subscriber.start()
+
+    def stop(self):
+        for subscriber in self.subscribers:
+            subscriber.stop()
+
+    def statistics(self):
+        return {subscriber.name: subscriber.statistics() for subscriber in self.subscribers if not subscriber.inline}
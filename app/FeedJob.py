@@ -1,46 +1,153 @@
-import time, logging
-from functools import partial
+import time, logging, threading
+from collections import deque
+from LagMonitor import MonitoredTimer
+from EventBus import JobProgress, JobSuccessful, JobFailed, JobFinished
 
 logger = logging.getLogger(__name__)
 
 class FeedJob:
-    portions = 0
-    feedingMachines = []
+    """Runs a feeding on the FeedingMachines
 
-    machinesDone = 0
-    time = None
+    Without limits every machine starts its whole sequence at once. With a
+    concurrency limit, a power budget or a start stagger the machines are
+    started one by one: motor starts are at least startStagger seconds apart,
+    at most concurrency motors run at the same time and the summed power of
+    the running machines stays within powerBudget. When not every machine
+    can run at once the rounds are interleaved, so every machine makes
+    progress while the others wait.
+    """
+    __slots__ = (
+        "portions", "time", "feedingMachines", "machinePortions", "machinesDone", "requests", "span",
+        "concurrency", "powerBudget", "startStagger", "bus",
+        "_roundsLeft", "_ready", "_running", "_failed", "_roundByRound", "_lastStart", "_lock"
+    )
 
-    onError = None
-    onSuccessful = None
-    onFinish = None
-
-    def __init__(self, portions, time, feedingMachines):
+    def __init__(self, portions, time, feedingMachines, machinePortions = None, bus = None):
         self.portions = portions
         self.time = time
         self.feedingMachines = feedingMachines
-        def doNothing():
-            return
-        self.onError = doNothing
-        self.onFinish = doNothing
-        self.onSuccessful = doNothing
+        self.machinePortions = machinePortions or {}
+        self.machinesDone = 0
+        self.requests = ()
+        # root span of the trace, the machines record their rounds below it
+        self.span = None
+        self.concurrency = None
+        self.powerBudget = None
+        self.startStagger = 0
+        self.bus = bus
+        self._roundsLeft = {}
+        self._ready = deque()
+        self._running = []
+        self._failed = set()
+        self._roundByRound = False
+        self._lastStart = None
+        self._lock = threading.Lock()
+
+    def portionsFor(self, machine):
+        return self.machinePortions.get(machine.name, self.portions)
+
+    def remainingPortions(self):
+        """Portions per machine that were not dispensed yet"""
+        with self._lock:
+            remaining = dict(self._roundsLeft)
+            for machine in self._running:
+                remaining[machine.name] = remaining.get(machine.name, 0) + (machine.currentRound or 0)
+        return {name: portions for name, portions in remaining.items() if portions > 0}
 
-    def _failureHandler(self, machine, error):
-        currentRound = (self.portions - error.roundsLeft) + 1
+    def machineRound(self, machine):
+        self.bus.publish(JobProgress(self))
+
+    def machineFailed(self, machine, error):
+        currentRound = (self.portionsFor(machine) - self._roundsLeft.get(machine.name, 0) - error.roundsLeft) + 1
         logger.error('Machine '+machine.name+' failed on portion #'+str(currentRound)+': '+error.message)
-        self.onError(machine, error)
-        # possibly send Notification here
+        with self._lock:
+            self._failed.add(machine.name)
+        if machine.span != None:
+            machine.span.setError(error.message)
+            machine.span.setAttribute("error", error.code)
+        self.bus.publish(JobFailed(self, machine, error))
+
+    def machineSuccessful(self, machine):
+        if self._roundsLeft.get(machine.name, 0) <= 0:
+            self.bus.publish(JobSuccessful(self, machine))
+
+    def machineFinished(self, machine):
+        if machine.span != None:
+            machine.span.finish()
+            machine.span = None
+        with self._lock:
+            if machine in self._running:
+                self._running.remove(machine)
+            if self._roundsLeft.get(machine.name, 0) > 0 and machine.name not in self._failed:
+                self._ready.append(machine)
+            else:
+                self.machinesDone += 1
+            finished = not self._running and not self._ready
+        if finished:
+            self.bus.publish(JobFinished(self))
+        else:
+            self._startNext()
 
-    def _finishHandler(self, machine):
-        self.machinesDone += 1
-        if self.machinesDone >= len(self.feedingMachines):
-            self.onFinish()
+    def _isParallel(self):
+        return (self.concurrency is None or self.concurrency >= len(self._ready)) and self.powerBudget is None and not self.startStagger
+
+    def _fitsPowerBudget(self, machine):
+        if self.powerBudget is None or not self._running:
+            return True
+        return sum([running.power for running in self._running]) + machine.power <= self.powerBudget
+
+    def _canRunAll(self):
+        if self.concurrency is not None and self.concurrency < len(self._ready):
+            return False
+        return self.powerBudget is None or sum([machine.power for machine in self._ready]) <= self.powerBudget
+
+    def _startNext(self):
+        started = []
+        with self._lock:
+            while self._ready:
+                machine = self._ready[0]
+                if self.concurrency is not None and len(self._running) >= self.concurrency:
+                    break
+                if not self._fitsPowerBudget(machine):
+                    break
+                now = time.monotonic()
+                if self._lastStart is not None and now - self._lastStart < self.startStagger:
+                    MonitoredTimer(self.startStagger - (now - self._lastStart), self._startNext).start()
+                    break
+                self._ready.popleft()
+                self._running.append(machine)
+                self._lastStart = now
+                rounds = 1 if self._roundByRound else self._roundsLeft[machine.name]
+                self._roundsLeft[machine.name] -= rounds
+                started.append((machine, rounds))
+        for machine, rounds in started:
+            self._runMachine(machine, rounds)
+
+    def _runMachine(self, machine, rounds):
+        if self.span != None:
+            machine.span = self.span.child("machine", machine=machine.name, rounds=rounds)
+        machine.runSequence(rounds)
 
     def feed(self):
         # do feeding here
-        machinesDone = 0
+        self.machinesDone = 0
         logger.debug("I'm going to feed " + str(self.portions) + " portions now. Here kitty kitty...")
-        for machine in self.feedingMachines:
-            machine.onFailure = partial(self._failureHandler, machine)
-            machine.onSuccessful = partial(self.onSuccessful, machine)
-            machine.onFinish = partial(self._finishHandler, machine)
-            machine.runSequence(self.portions)
+        self._ready = deque([machine for machine in self.feedingMachines if self.portionsFor(machine) > 0])
+        self._roundsLeft = {machine.name: self.portionsFor(machine) for machine in self._ready}
+        self.bus.publish(JobProgress(self))
+        if len(self._ready) == 0:
+            logger.warning('No feeding machines are enabled')
+            self.bus.publish(JobFinished(self))
+            return
+        if self._isParallel():
+            machines = list(self._ready)
+            self._ready.clear()
+            self._running = list(machines)
+            for machine in machines:
+                rounds = self._roundsLeft[machine.name]
+                self._roundsLeft[machine.name] = 0
+                self._runMachine(machine, rounds)
+            return
+        self._roundByRound = not self._canRunAll()
+        logger.debug('Staggered feeding'+(', one round at a time' if self._roundByRound else ''))
+        self._startNext()
@@ -0,0 +1,194 @@
+import threading, time, heapq, itertools, logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# lower value means higher priority
+PRIORITY_SCHEDULE = 0
+PRIORITY_MANUAL = 1
+PRIORITY_REMOTE = 2
+
+SOURCE_PRIORITIES = {
+    "schedule": PRIORITY_SCHEDULE,
+    "resume": PRIORITY_SCHEDULE,
+    "button": PRIORITY_MANUAL,
+    "display": PRIORITY_MANUAL,
+    "signal": PRIORITY_MANUAL,
+    "manual": PRIORITY_MANUAL,
+    "mqtt": PRIORITY_REMOTE,
+    "remote": PRIORITY_REMOTE
+}
+
+class FeedRequest:
+    """A single request to feed, waiting in the FeedQueue
+
+    Attributes:
+        portions -- how many portions were requested
+        source -- where the request came from (schedule, resume, button, display, signal, mqtt)
+        requestId -- optional id used for deduplication
+        time -- the schedule slot for scheduled requests
+        machinePortions -- optional portions per machine name, overriding portions
+        result -- "successful", an error code or "dropped" once completed
+    """
+    __slots__ = ("portions", "source", "priority", "requestId", "time", "machinePortions", "createdAt", "startedAt", "result", "_done", "_doneCallbacks", "_lock")
+
+    def __init__(self, portions, source = "manual", requestId = None, time = None):
+        self.portions = portions
+        self.source = source
+        self.priority = SOURCE_PRIORITIES.get(source, PRIORITY_REMOTE)
+        self.requestId = requestId
+        self.time = time
+        self.machinePortions = {}
+        self.createdAt = _now()
+        self.startedAt = None
+        self.result = None
+        self._done = threading.Event()
+        self._doneCallbacks = []
+        self._lock = threading.Lock()
+
+    def isDone(self):
+        return self._done.is_set()
+
+    def wait(self, timeout = None):
+        if self._done.wait(timeout):
+            return self.result
+        return None
+
+    def addDoneCallback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._doneCallbacks.append(callback)
+                return
+        callback(self)
+
+    def complete(self, result):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.result = result
+            self._done.set()
+            callbacks = self._doneCallbacks
+            self._doneCallbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as err:
+                logger.error(f"Feed request callback failed: {err}")
+
+def _now():
+    return time.monotonic()
+
+class FeedQueue:
+    """Thread-safe priority queue for feed requests
+
+    Pending requests are ordered by priority (schedule > manual > remote) and
+    arrival. When merging is enabled, pop() combines pending requests into one
+    batch as long as the total stays within maxPortions.
+    """
+
+    def __init__(self, merge = True, maxPortions = 5, maxDepth = 20, historySize = 100):
+        self.merge = merge
+        self.maxPortions = maxPortions
+        self.maxDepth = maxDepth
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()
+        self._historySize = historySize
+        self._waitTimes = deque(maxlen=historySize)
+        self._stats = {
+            "enqueued": 0,
+            "dispatched": 0,
+            "merged": 0,
+            "deduplicated": 0,
+            "dropped": 0
+        }
+
+    def configure(self, merge = None, maxPortions = None, maxDepth = None):
+        with self._lock:
+            if merge is not None:
+                self.merge = merge
+            if maxPortions is not None:
+                self.maxPortions = maxPortions
+            if maxDepth is not None:
+                self.maxDepth = maxDepth
+
+    def push(self, request: FeedRequest):
+        """Add a request, returns the request that will be served
+
+        A request with an id that was seen recently returns the earlier request
+        instead. Returns None when the queue is full.
+        """
+        with self._lock:
+            if request.requestId is not None:
+                known = self._recent.get(request.requestId)
+                if known is not None:
+                    self._stats["deduplicated"] += 1
+                    return known
+            if len(self._heap) >= self.maxDepth:
+                self._stats["dropped"] += 1
+                dropped = True
+            else:
+                dropped = False
+                heapq.heappush(self._heap, (request.priority, next(self._counter), request))
+                self._stats["enqueued"] += 1
+                self._remember(request)
+        if dropped:
+            logger.warning('Feed queue is full, dropping request from '+request.source)
+            request.complete("dropped")
+            return None
+        return request
+
+    def _remember(self, request):
+        if request.requestId is None:
+            return
+        self._recent[request.requestId] = request
+        while len(self._recent) > self._historySize:
+            self._recent.popitem(last=False)
+
+    def pop(self):
+        """Remove the next batch of requests, returns an empty list if nothing is pending"""
+        with self._lock:
+            if not self._heap:
+                return []
+            batch = [heapq.heappop(self._heap)[2]]
+            total = batch[0].portions
+            if self.merge:
+                skipped = []
+                while self._heap:
+                    entry = heapq.heappop(self._heap)
+                    if total + entry[2].portions <= self.maxPortions:
+                        batch.append(entry[2])
+                        total += entry[2].portions
+                    else:
+                        skipped.append(entry)
+                for entry in skipped:
+                    heapq.heappush(self._heap, entry)
+                self._stats["merged"] += len(batch) - 1
+            now = _now()
+            for request in batch:
+                request.startedAt = now
+                self._waitTimes.append(now - request.createdAt)
+            self._stats["dispatched"] += 1
+            return batch
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def clear(self, result = "dropped"):
+        with self._lock:
+            pending = [entry[2] for entry in self._heap]
+            self._heap = []
+        for request in pending:
+            request.complete(result)
+
+    def metrics(self):
+        with self._lock:
+            waitTimes = sorted(self._waitTimes)
+            metrics = dict(self._stats)
+            metrics["depth"] = len(self._heap)
+        metrics["wait_avg"] = round(sum(waitTimes) / len(waitTimes), 3) if waitTimes else None
+        metrics["wait_max"] = round(waitTimes[-1], 3) if waitTimes else None
+        metrics["wait_p95"] = round(waitTimes[min(len(waitTimes) - 1, int(len(waitTimes) * 0.95))], 3) if waitTimes else None
+        return metrics
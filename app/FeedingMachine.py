@@ -1,7 +1,10 @@
 from gpiozero import Button, OutputDevice, SmoothedInputDevice, LED
 from functools import partial
-import threading, time
+import threading, time, statistics
 import logging
+from collections import deque
+from LagMonitor import MonitoredTimer, DeadlineTimer, percentiles
+from EventBus import MachineRound, MachineSuccessful, MachineFailed, MachineFinished
 
 logger = logging.getLogger(__name__)
 
@@ -30,48 +33,119 @@ class FoodDispenseError(FeedingMachineError):
     """
     code = "empty"
 
-class FeedingMachine:
-    name = None
+def _summary(samples, scale = 1):
+    summary = percentiles(samples, scale)
+    summary["mean"] = round(statistics.fmean(samples) * scale, 4) if samples else None
+    summary["stdev"] = round(statistics.pstdev(samples) * scale, 4) if samples else None
+    return summary
 
-    motorSensor = None
-    motor = None
-    fakeMotor = None
-    foodSensor = None
-    foodSensorTrigger = None
+class StopStatistics:
+    """Stop overshoot and portion size of one machine
 
-    motorActive = False
-    foodWasDispensed = None
-    noFoodCounter = 0
-    motorSensorWasPressed = True
+    The stop position is how far the motor turned past the sensor edge, in
+    rotations. A portion is a rotation plus the difference between this
+    and the previous stop position, so its spread shows how consistent the
+    portions are.
+    """
+    __slots__ = ("overshoots", "positions", "portions", "rotationTime", "_lastPosition")
 
-    motorThreshold = 5
-    maxAttempts = 5
-    currentRound = None
-    timeoutThread = None
-    foodSensorThread = None
+    def __init__(self, historySize = 500):
+        self.overshoots = deque(maxlen=historySize)
+        self.positions = deque(maxlen=historySize)
+        self.portions = deque(maxlen=historySize)
+        self.rotationTime = None
+        self._lastPosition = None
 
-    motorPort = None
-    motorSensorPort = None
-    foodSensorPortOut = None
-    foodSensorPortIn = None
+    def record(self, overshoot, position = None, rounds = None):
+        """Record a stop; rounds only for sequences without retries, they count towards the portion size"""
+        if overshoot is None:
+            # stopped by a failure, the start of the next portion is unknown
+            self._lastPosition = None
+            return
+        self.overshoots.append(overshoot)
+        if position is None:
+            self._lastPosition = None
+            return
+        self.positions.append(position)
+        if rounds and self._lastPosition is not None:
+            self.portions.append((rounds + position - self._lastPosition) / rounds)
+        self._lastPosition = position
 
-    onFailure = None
-    onFinish = None
-    onSuccessful = None
+    def statistics(self):
+        portions = _summary(self.portions)
+        portions["cv"] = round(portions["stdev"] / portions["mean"], 4) if portions["mean"] else None
+        return {
+            "overshoot_ms": _summary(self.overshoots, 1000),
+            "stop_position": _summary(self.positions),
+            "portion_size": portions,
+            "rotation_time": round(self.rotationTime, 4) if self.rotationTime != None else None
+        }
 
-    def __init__(self, name, motorPort = None, motorSensorPort = None, foodSensorPortOut = None, foodSensorPortIn = None):
+class FeedingMachine:
+    __slots__ = (
+        "name", "motorSensor", "motor", "fakeMotor", "foodSensor", "foodSensorTrigger",
+        "motorActive", "foodWasDispensed", "noFoodCounter", "motorSensorWasPressed",
+        "currentRound", "sequenceRounds", "timeoutDeadline", "stopDeadline", "stopTimer", "lastStopLatency",
+        "span", "roundSpan", "roundStartedAt", "edgeTime", "previousEdgeTime", "lastRotationTime", "lastStopPosition",
+        "rotationTime", "nominalRotationTime", "expectedOvershoot", "deadlineTimer", "stats",
+        "motorPort", "motorSensorPort", "foodSensorPortOut", "foodSensorPortIn",
+        "power", "bus"
+    )
+
+    motorThreshold = 5
+    maxAttempts = 5
+    # delays in seconds, class wide so the emulated motor can be sped up
+    sensorArmDelay = 0.5
+    stopDelay = 0.3
+    fakeMotorDuration = 3
+    # weight of a new sample in the learned rotation time and stop overshoot
+    learningRate = 0.2
+
+    def __init__(self, name, motorPort = None, motorSensorPort = None, foodSensorPortOut = None, foodSensorPortIn = None, bus = None):
         #gpio ports input
         self.name = name
         self.motorPort = motorPort
         self.motorSensorPort = motorSensorPort
+        self.foodSensorPortOut = None
+        self.foodSensorPortIn = None
         if foodSensorPortIn != None:
             self.foodSensorPortOut = foodSensorPortOut
             self.foodSensorPortIn = foodSensorPortIn
-        def doNothing():
-            return
-        self.onFailure = doNothing
-        self.onFinish = doNothing
-        self.onSuccessful = doNothing
+        self.motorSensor = None
+        self.motor = None
+        self.fakeMotor = None
+        self.foodSensor = None
+        self.foodSensorTrigger = None
+        # round state
+        self.motorActive = False
+        self.foodWasDispensed = None
+        self.noFoodCounter = 0
+        self.motorSensorWasPressed = True
+        self.currentRound = None
+        self.sequenceRounds = None
+        self.timeoutDeadline = None
+        self.stopDeadline = None
+        self.stopTimer = None
+        self.lastStopLatency = None
+        self.roundStartedAt = None
+        self.edgeTime = None
+        # edge of the previous round while the motor kept running, None after a standstill
+        self.previousEdgeTime = None
+        self.lastRotationTime = None
+        self.lastStopPosition = None
+        # learned from the sensor edges; with a nominal rotation time the stop delay follows the motor speed
+        self.rotationTime = None
+        self.nominalRotationTime = None
+        self.expectedOvershoot = 0
+        self.deadlineTimer = DeadlineTimer(name)
+        self.stats = StopStatistics()
+        # trace span of the running sequence, set by the FeedJob
+        self.span = None
+        self.roundSpan = None
+        # peak motor power, used by FeedJob to stay within the power budget
+        self.power = 0
+        # machine events are published here, CatFeeder shares its bus with the machines
+        self.bus = bus
         logger.debug("new FeedingMachine ("+self.name+") installed")
         self.initGpio()
 
@@ -86,6 +160,7 @@ class FeedingMachine:
             self.foodSensorTrigger = LED(self.foodSensorPortOut)
 
     def closeAll(self):
+        self.deadlineTimer.close()
         if self.motor != None:
             self.motor.close()
         if self.motorSensor != None:
@@ -99,13 +174,14 @@ class FeedingMachine:
         if self.motorActive:
             logger.error('Machine '+self.name+': Sequence was canceled, motor took too long')
             roundsLeft = self.currentRound
-            self.onFailure(MotorFailureError(self, roundsLeft, 'Motor took too long, possibly blocked'))
+            self._endRoundSpan(error='Motor took too long')
+            self.bus.publish(MachineFailed(self, MotorFailureError(self, roundsLeft, 'Motor took too long, possibly blocked')))
             self._stopSequence()
 
     def _cancelMotorTimeout(self):
-        if self.timeoutThread != None:
-            self.timeoutThread.cancel()
-            self.timeoutThread = None
+        if self.timeoutDeadline != None:
+            self.timeoutDeadline.cancel()
+            self.timeoutDeadline = None
 
     def _stopMotor(self):
         logger.debug('Machine '+self.name+': Stopping motor')
@@ -114,9 +190,28 @@ class FeedingMachine:
             self.motor.off()
         elif self.fakeMotor != None:
             self.fakeMotor.cancel()
+        stoppedAt = time.monotonic()
+        if self.stopDeadline != None:
+            self.lastStopLatency = stoppedAt - self.stopDeadline
+            # the timer woke up early by the expected overshoot, learn from how late it really was
+            lateness = stoppedAt - self.stopTimer.deadline
+            self.expectedOvershoot = max(0, self.expectedOvershoot + self.learningRate * (lateness - self.expectedOvershoot))
+            self.lastStopPosition = (stoppedAt - self.edgeTime) / self.rotationTime if self.rotationTime else None
+            self.stats.record(self.lastStopLatency, self.lastStopPosition, self.sequenceRounds if self.noFoodCounter == 0 else None)
+            self.stopDeadline = None
+            self.stopTimer = None
+        else:
+            self.lastStopLatency = None
+            self.lastStopPosition = None
+            self.stats.record(None)
+        if self.roundSpan != None:
+            self.roundSpan.addEvent("motor_off")
+            self.roundSpan.setAttribute("stop_latency", self.lastStopLatency)
+            self._endRoundSpan()
         self.currentRound = None
         self.motorActive = False
         self.motorSensorWasPressed = True
+        self.previousEdgeTime = None
 
     def _startMotor(self):
         if not self.motorActive:
@@ -124,36 +219,96 @@ class FeedingMachine:
             self.motorActive = True
             if self.motor != None:
                 self.motor.on()
+            if self.roundSpan != None:
+                self.roundSpan.addEvent("motor_on")
         if self.motor == None:
             #install fake motor
-            self.fakeMotor = threading.Timer(3, self._motorSensorPressed)
+            self.fakeMotor = MonitoredTimer(self.fakeMotorDuration, self._motorSensorPressed)
             self.fakeMotor.start()
 
     def _setMotorSensorListener(self):
         self.motorSensorWasPressed = False
+        if self.roundSpan != None:
+            self.roundSpan.addEvent("sensor_armed")
+
+    def _endRoundSpan(self, result = None, error = None):
+        span = self.roundSpan
+        if span == None:
+            return
+        self.roundSpan = None
+        if result != None:
+            span.setAttribute("result", result)
+        if error != None:
+            span.setError(error)
+        span.finish()
+
+    def _edgeTime(self):
+        now = time.monotonic()
+        if self.motorSensor != None:
+            # the pin factory timestamps the edge when it happens, this callback may run later
+            activeTime = self.motorSensor.active_time
+            if activeTime != None:
+                return now - activeTime
+        elif self.fakeMotor != None and self.fakeMotor.deadline != None:
+            return min(now, self.fakeMotor.deadline)
+        return now
+
+    def _learnRotationTime(self, rotationTime):
+        if self.rotationTime == None:
+            self.rotationTime = rotationTime
+        else:
+            self.rotationTime += self.learningRate * (rotationTime - self.rotationTime)
+        self.stats.rotationTime = self.rotationTime
+
+    def _currentStopDelay(self):
+        if self.nominalRotationTime and self.rotationTime:
+            # stop at the same angle past the sensor when the motor runs slower or faster
+            return self.stopDelay * self.rotationTime / self.nominalRotationTime
+        return self.stopDelay
+
+    def _scheduleStop(self):
+        delay = self._currentStopDelay()
+        self.stopDeadline = self.edgeTime + delay
+        if self.span != None:
+            self.roundSpan = self.span.child("stop_delay", delay=delay)
+        self.stopTimer = self.deadlineTimer.schedule(self.stopDeadline - min(self.expectedOvershoot, delay / 2), self._stopSequence)
 
     def _motorSensorPressed(self):
         if self.motorSensorWasPressed:
             #event was already handled
             return
+        edgeTime = self._edgeTime()
         logger.debug('Machine '+self.name+': Motor sensor for was pressed')
         self._cancelMotorTimeout()
         self.motorSensorWasPressed = True
+        self.edgeTime = edgeTime
+        if self.previousEdgeTime != None:
+            self.lastRotationTime = edgeTime - self.previousEdgeTime
+            self._learnRotationTime(self.lastRotationTime)
+        elif self.roundStartedAt != None:
+            # the first round includes the spin-up, it is reported but not learned from
+            self.lastRotationTime = edgeTime - self.roundStartedAt
+        self.previousEdgeTime = edgeTime
+        if self.roundSpan != None:
+            self.roundSpan.addEvent("sensor_edge")
         if self.foodWasDispensed == False:
             self.noFoodCounter = self.noFoodCounter + 1
+            self._endRoundSpan("no_food")
             logger.debug(f"No food came out, trying again. (attempt {self.noFoodCounter}/{self.maxAttempts})")
             if self.noFoodCounter >= self.maxAttempts:
                 logger.debug('Dispenser must be empty')
-                self.onFailure(FoodDispenseError(self, self.currentRound, 'To many attempts, dispenser possibly empty'))
+                self.bus.publish(MachineFailed(self, FoodDispenseError(self, self.currentRound, 'To many attempts, dispenser possibly empty')))
                 self._stopSequence()
             else:
                 self._nextSequence()
         else:
+            self._endRoundSpan("dispensed")
             self.currentRound = self.currentRound - 1;
+            self.bus.publish(MachineRound(self, self.currentRound, self.lastRotationTime))
             if self.currentRound is None or (not self.motorActive) or self.currentRound <= 0:
                 #Finished! Stop the motor just a bit later, so the sensor button will be released
-                threading.Timer(0.3, self._stopSequence).start()
-                self.onSuccessful()
+                self._scheduleStop()
+                self.bus.publish(MachineSuccessful(self))
             else:
                 self._nextSequence()
 
@@ -170,14 +325,16 @@ class FeedingMachine:
     def _nextSequence(self):
         try:
             logger.debug('Machine '+self.name+': Next round sequence (still '+str(self.currentRound - 1)+' rounds to go)')
-            self.timeoutThread = threading.Timer(self.motorThreshold, self._motorTimeout)
-            self.timeoutThread.start()
-            threading.Timer(0.5, self._setMotorSensorListener).start()
+            if self.span != None:
+                self.roundSpan = self.span.child("round", rounds_left=self.currentRound, attempt=self.noFoodCounter + 1)
+            self.roundStartedAt = time.monotonic()
+            self.timeoutDeadline = self.deadlineTimer.schedule(self.roundStartedAt + self.motorThreshold, self._motorTimeout)
+            self.deadlineTimer.schedule(self.roundStartedAt + self.sensorArmDelay, self._setMotorSensorListener)
             self._startFoodSensor()
             self._startMotor()
         except Exception as err:
             logger.error('Something went wrong')
-            self.onFailure(err)
+            self.bus.publish(MachineFailed(self, FeedingMachineError(self, self.currentRound, str(err))))
             self._stopSequence()
             raise
 
@@ -185,10 +342,11 @@ class FeedingMachine:
         logger.debug('Machine '+self.name+': Ending sequence')
         self._stopFoodSensor()
         self._stopMotor()
-        self.onFinish()
+        self.bus.publish(MachineFinished(self, self.noFoodCounter))
 
     def runSequence(self, rounds = 1):
         self.currentRound = rounds
+        self.sequenceRounds = rounds
         self.noFoodCounter = 0
         if self.currentRound > 0:
             logger.debug('Machine '+self.name+': Starting sequence of '+str(self.currentRound)+' rounds')
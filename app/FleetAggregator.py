@@ -0,0 +1,136 @@
+import paho.mqtt.client as mqtt
+import json
+import time
+import logging
+import threading
+from MQTTClient import TOPIC_PREFIX
+
+logger = logging.getLogger(__name__)
+
+AGGREGATOR_TOPIC = f"{TOPIC_PREFIX}/aggregator"
+
+class FleetView:
+    """In-memory view of all feeders, indexed by feeder id and by state
+
+    Every lookup by id, by presence state or by last feeding status is a
+    dictionary or set lookup.
+    """
+
+    def __init__(self):
+        self.feeders = {}
+        self.by_state = {}
+        self.by_feed_status = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, feeder_id):
+        entry = self.feeders.get(feeder_id)
+        if entry is None:
+            entry = {"feeder_id": feeder_id, "state": None, "name": None, "config_url": None, "status": None, "updated": None}
+            self.feeders[feeder_id] = entry
+        return entry
+
+    def _reindex(self, index, feeder_id, old, new):
+        if old == new:
+            return
+        if old in index:
+            index[old].discard(feeder_id)
+        index.setdefault(new, set()).add(feeder_id)
+
+    def update_presence(self, feeder_id, presence):
+        with self._lock:
+            entry = self._entry(feeder_id)
+            self._reindex(self.by_state, feeder_id, entry["state"], presence.get("state"))
+            entry["state"] = presence.get("state")
+            entry["name"] = presence.get("name", entry["name"])
+            entry["config_url"] = presence.get("config_url", entry["config_url"])
+            entry["updated"] = time.time()
+
+    def update_status(self, feeder_id, status):
+        with self._lock:
+            entry = self._entry(feeder_id)
+            self._reindex(self.by_feed_status, feeder_id, (entry["status"] or {}).get("last_feed_status"), status.get("last_feed_status"))
+            if entry["state"] is None:
+                self._reindex(self.by_state, feeder_id, None, "online")
+                entry["state"] = "online"
+            entry["status"] = status
+            entry["updated"] = time.time()
+
+    def get(self, feeder_id):
+        with self._lock:
+            entry = self.feeders.get(feeder_id)
+            return dict(entry) if entry is not None else None
+
+    def with_state(self, state):
+        with self._lock:
+            return sorted(self.by_state.get(state, ()))
+
+    def with_feed_status(self, status):
+        with self._lock:
+            return sorted(self.by_feed_status.get(status, ()))
+
+    def summary(self):
+        with self._lock:
+            return {
+                "feeders": len(self.feeders),
+                "states": {state: len(ids) for state, ids in self.by_state.items() if state is not None},
+                "feed_status": {status: len(ids) for status, ids in self.by_feed_status.items() if status is not None}
+            }
+
+class FleetAggregator:
+    """Collects the status and presence of all feeders
+
+    Queries are answered on cat_feeder/aggregator/response, e.g.
+    {"feeder_id": "links"}, {"state": "offline"}, {"feed_status": "blocked"}
+    or {} for a summary of the fleet.
+    """
+
+    def __init__(self, config):
+        mqtt_config = config.mqtt
+        self.mqtt_host = mqtt_config.get("host")
+        self.mqtt_port = mqtt_config.get("port", 1883)
+        self.view = FleetView()
+        self.client = mqtt.Client()
+        self.client.username_pw_set(mqtt_config.get("user"), mqtt_config.get("pass"))
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+    def _on_connect(self, client, userdata, flags, rc):
+        logger.info(f"Aggregator connected to MQTT '{self.mqtt_host}'")
+        self.client.subscribe(f"{TOPIC_PREFIX}/+/status")
+        self.client.subscribe(f"{TOPIC_PREFIX}/+/presence")
+        self.client.subscribe(f"{TOPIC_PREFIX}/discovery_response")
+        self.client.subscribe(f"{AGGREGATOR_TOPIC}/query")
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            self.handle_message(msg.topic, json.loads(msg.payload.decode()))
+        except Exception:
+            logger.warning(f"Invalid message on {msg.topic}")
+
+    def handle_message(self, topic, payload):
+        parts = topic.split("/")
+        if topic == f"{AGGREGATOR_TOPIC}/query":
+            self.client.publish(f"{AGGREGATOR_TOPIC}/response", json.dumps(self.query(payload)))
+        elif topic == f"{TOPIC_PREFIX}/discovery_response":
+            self.view.update_presence(payload["feeder_id"], dict(payload, state="online"))
+        elif len(parts) == 3 and parts[2] == "presence":
+            self.view.update_presence(parts[1], payload)
+        elif len(parts) == 3 and parts[2] == "status":
+            self.view.update_status(parts[1], payload)
+
+    def query(self, query):
+        if "feeder_id" in query:
+            return {"query": query, "result": self.view.get(query["feeder_id"])}
+        if "state" in query:
+            return {"query": query, "result": self.view.with_state(query["state"])}
+        if "feed_status" in query:
+            return {"query": query, "result": self.view.with_feed_status(query["feed_status"])}
+        return {"query": query, "result": self.view.summary()}
+
+    def run(self):
+        logger.info("Starting fleet aggregator")
+        self.client.connect_async(self.mqtt_host, self.mqtt_port, 10)
+        self.client.loop_forever(retry_first_connection=True)
+
+    def stop(self):
+        self.client.disconnect()
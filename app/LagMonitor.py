@@ -0,0 +1,218 @@
+import os, sys, socket, threading, time, heapq, itertools, traceback, logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+def sdNotify(state):
+    """Send a state to systemd (READY=1, WATCHDOG=1, STOPPING=1), does nothing outside systemd"""
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address[0] == "@":
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+        return True
+    except OSError as err:
+        logger.warning(f"Cannot notify systemd: {err}")
+        return False
+
+def dumpStacks(reason = ""):
+    frames = sys._current_frames()
+    lines = ["Thread stacks" + (" (" + reason + ")" if reason else "") + ":"]
+    for thread in threading.enumerate():
+        frame = frames.get(thread.ident)
+        if frame is None:
+            continue
+        lines.append(f"--- {thread.name} (daemon={thread.daemon})")
+        lines.extend([line.rstrip() for line in traceback.format_stack(frame)])
+    logger.error("\n".join(lines))
+
+def percentiles(samples, scale = 1, digits = 4):
+    """Count, p50, p90, p99 and max of the samples, multiplied by scale"""
+    if not samples:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        "count": len(ordered),
+        "p50": round(ordered[int(last * 0.5)] * scale, digits),
+        "p90": round(ordered[int(last * 0.9)] * scale, digits),
+        "p99": round(ordered[int(last * 0.99)] * scale, digits),
+        "max": round(ordered[last] * scale, digits)
+    }
+
+class LagMonitor:
+    """Measures how late the main loop and timer callbacks run
+
+    tick() is called by the main loop with the deadline of the tick and is
+    the only place where the systemd watchdog is pinged. A watcher thread
+    dumps the stacks of all threads when the loop did not progress for
+    lagThreshold seconds.
+    """
+
+    def __init__(self, historySize = 600, lagThreshold = 10.0):
+        self.lagThreshold = lagThreshold
+        self._loopLag = deque(maxlen=historySize)
+        self._timerLag = deque(maxlen=historySize)
+        self._lastProgress = time.monotonic()
+        self._lastWatchdogPing = 0
+        self._watchdogInterval = self._readWatchdogInterval()
+        self._stallReported = False
+        self._stopEvent = threading.Event()
+        self._watcher = None
+
+    def _readWatchdogInterval(self):
+        usec = os.environ.get("WATCHDOG_USEC")
+        if not usec:
+            return None
+        pid = os.environ.get("WATCHDOG_PID")
+        # the Daemon double fork changes the pid systemd knows, the pings still reach it through the notify socket
+        if pid and int(pid) != os.getpid() and not os.environ.get("NOTIFY_SOCKET"):
+            return None
+        return int(usec) / 1000000 / 2
+
+    def tick(self, deadline):
+        now = time.monotonic()
+        self._loopLag.append(max(0, now - deadline))
+        self._lastProgress = now
+        if self._stallReported:
+            logger.warning('Main loop is making progress again')
+            self._stallReported = False
+        if self._watchdogInterval and now - self._lastWatchdogPing >= self._watchdogInterval:
+            self._lastWatchdogPing = now
+            sdNotify("WATCHDOG=1")
+
+    def recordTimer(self, lag):
+        self._timerLag.append(max(0, lag))
+
+    def statistics(self):
+        return {
+            "loop": percentiles(list(self._loopLag)),
+            "timer": percentiles(list(self._timerLag))
+        }
+
+    def start(self):
+        # read again here, the monitor is created at import time before the daemon forks
+        self._watchdogInterval = self._readWatchdogInterval()
+        self._lastProgress = time.monotonic()
+        if self._watcher is None or not self._watcher.is_alive():
+            self._stopEvent.clear()
+            self._watcher = threading.Thread(target=self._watch, name="LagMonitor", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stopEvent.set()
+
+    def _watch(self):
+        while not self._stopEvent.wait(min(1.0, self.lagThreshold / 2)):
+            stalled = time.monotonic() - self._lastProgress
+            if stalled > self.lagThreshold and not self._stallReported:
+                self._stallReported = True
+                logger.error(f"Main loop did not make progress for {stalled:.1f} seconds")
+                dumpStacks("main loop stalled")
+
+class MonitoredTimer(threading.Timer):
+    """threading.Timer that reports how late the callback fired to the LagMonitor"""
+
+    monitor = None
+
+    def __init__(self, interval, function, args = None, kwargs = None):
+        super(MonitoredTimer, self).__init__(interval, function, args, kwargs)
+        self.deadline = None
+
+    def start(self):
+        self.deadline = time.monotonic() + self.interval
+        super(MonitoredTimer, self).start()
+
+    def run(self):
+        self.finished.wait(self.interval)
+        if not self.finished.is_set():
+            if self.monitor is not None:
+                self.monitor.recordTimer(time.monotonic() - self.deadline)
+            self.function(*self.args, **self.kwargs)
+        self.finished.set()
+
+class Deadline:
+    __slots__ = ("deadline", "function", "args", "cancelled")
+
+    def __init__(self, deadline, function, args):
+        self.deadline = deadline
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class DeadlineTimer:
+    """Runs callbacks at monotonic deadlines on one long-lived thread
+
+    Unlike a Timer per callback no thread has to be started, and the last
+    spinTime seconds before a deadline are spent polling the clock instead
+    of relying on the wake-up of a timed wait. Lateness is reported to the
+    LagMonitor like MonitoredTimer does.
+    """
+
+    monitor = None
+    spinTime = 0.002
+
+    def __init__(self, name):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def schedule(self, deadline, function, *args):
+        entry = Deadline(deadline, function, args)
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._counter), entry))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="Deadline-" + self.name, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return entry
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._heap = []
+            self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while not self._closed:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                remaining = self._heap[0][0] - time.monotonic()
+                if remaining <= self.spinTime:
+                    return heapq.heappop(self._heap)[2]
+                self._condition.wait(remaining - self.spinTime)
+        return None
+
+    def _run(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            while time.monotonic() < entry.deadline:
+                time.sleep(0)
+            if entry.cancelled:
+                continue
+            if self.monitor is not None:
+                self.monitor.recordTimer(time.monotonic() - entry.deadline)
+            try:
+                entry.function(*entry.args)
+            except Exception as err:
+                logger.error(f"Deadline callback of {self.name} failed: {err}")
+
+lagMonitor = LagMonitor()
+MonitoredTimer.monitor = lagMonitor
+DeadlineTimer.monitor = lagMonitor
@@ -1,7 +1,9 @@
 import paho.mqtt.client as mqtt
+import asyncio
 import json
 import socket
 import time
+import random
 import logging
 import threading
 
@@ -10,6 +12,8 @@ logger = logging.getLogger(__name__)
 TOPIC_PREFIX = "cat_feeder"
 DEFAULT_PORTIONS = 1
 MAX_PORTIONS = 5
+# seconds of discovery response spread per feeder in the fleet
+DISCOVERY_JITTER = 0.05
 
 class MQTTClient:
     def __init__(self, config, callbacks):
@@ -17,6 +21,7 @@ class MQTTClient:
         device_config = config.device
 
         self.mqtt_host = mqtt_config.get("host")
+        self.mqtt_port = mqtt_config.get("port", 1883)
         self.mqtt_user = mqtt_config.get("user")
         self.mqtt_pass = mqtt_config.get("pass")
         self.feeder_id = device_config.get("id")
@@ -24,21 +29,104 @@ class MQTTClient:
         self.config_url = device_config.get("config_url")
         self.connected = False
 
+        discovery_config = mqtt_config.get("discovery", {})
+        self.fleet_size = discovery_config.get("fleetSize", 1)
+        self.discovery_jitter = discovery_config.get("jitter", DISCOVERY_JITTER)
+        self.presence = mqtt_config.get("presence", False)
+        self.presence_topic = f"{TOPIC_PREFIX}/{self.feeder_id}/presence"
+        self._discovery_timer = None
+
         self.feeding_callback = callbacks.get("feeding_callback")
         self.status_callback = callbacks.get("status_callback")
         self.update_callback = callbacks.get("update_callback")
         self.displaytest_callback = callbacks.get("displaytest_callback")
+        self.debug_callback = callbacks.get("debug_callback")
+        self.analytics_callback = callbacks.get("analytics_callback")
+        self.refill_callback = callbacks.get("refill_callback")
 
         self.client = mqtt.Client()
         self.client.username_pw_set(self.mqtt_user, self.mqtt_pass)
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        if self.presence:
+            self.client.will_set(self.presence_topic, self._presence_payload("offline"), qos=1, retain=True)
 
         self.connection_lock = threading.Lock()
         self._stop_event = threading.Event()
+        self.loop = None
+        self._connect_future = None
+        self._misc_task = None
+
+    def attach_loop(self, loop):
+        """Drive the paho client from an asyncio loop instead of its own thread"""
+        self.loop = loop
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _on_loop(self, callback, *args):
+        # paho may call the socket callbacks from the connecting executor thread or from publish in any thread
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._watch_socket, sock.fileno())
+
+    def _watch_socket(self, fd):
+        self.loop.add_reader(fd, self.client.loop_read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _unwatch_socket(self, fd, reader = True):
+        # the socket may already be closed when this runs
+        try:
+            if reader:
+                self.loop.remove_reader(fd)
+            self.loop.remove_writer(fd)
+        except (ValueError, OSError):
+            pass
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self._unwatch_socket, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock.fileno(), self.client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self._unwatch_socket, sock.fileno(), False)
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+        if self.connected and not self._stop_event.is_set():
+            logger.warning("Unexpected MQTT disconnection. Trying to reconnect...")
+            self.connected = False
+            self.connect()
+
+    async def _connect_async(self):
+        while not self._stop_event.is_set() and not self.connected:
+            try:
+                logger.debug(f"Connecting to MQTT host {self.mqtt_host}...")
+                # connecting resolves and opens the socket, keep that off the loop
+                await self.loop.run_in_executor(None, self.client.connect, self.mqtt_host, self.mqtt_port, 10)
+                self.connected = True
+            except (ConnectionRefusedError, socket.gaierror, OSError):
+                logger.warning("Failed to connect. Trying again in 20 seconds.")
+                await asyncio.sleep(20)
 
     def connect(self):
+        if self.loop != None:
+            if self._connect_future is None or self._connect_future.done():
+                self._connect_future = asyncio.run_coroutine_threadsafe(self._connect_async(), self.loop)
+            return
         with self.connection_lock:
             if not self.connected and (not hasattr(self, '_connection_thread') or not self._connection_thread.is_alive()):
                 self._connection_thread = threading.Thread(target=self._connect_loop, daemon=True)
@@ -48,7 +136,7 @@ class MQTTClient:
         while not self._stop_event.is_set() and not self.connected:
             try:
                 logger.debug(f"Connecting to MQTT host {self.mqtt_host}...")
-                self.client.connect(self.mqtt_host, 1883, 10)
+                self.client.connect(self.mqtt_host, self.mqtt_port, 10)
                 self.client.loop_start()
                 self.connected = True  # Only set this if connection was successful
             except (ConnectionRefusedError, socket.gaierror) as e:
@@ -59,13 +147,30 @@ class MQTTClient:
                         return
 
     def disconnect(self):
+        if self.loop != None:
+            self._stop_event.set()
+            if self._connect_future != None:
+                self._connect_future.cancel()
+            if self._misc_task != None:
+                self.loop.call_soon_threadsafe(self._misc_task.cancel)
         if hasattr(self, '_connection_thread') and self._connection_thread.is_alive():
             self._stop_event.set()  # Send stop signal to the connect thread
             self._connection_thread.join()  # Wait for _connect_loop to finish
             self._stop_event = threading.Event()
+        if self._discovery_timer != None:
+            self._discovery_timer.cancel()
         if self.connected:
+            if self.presence:
+                try:
+                    info = self.client.publish(self.presence_topic, self._presence_payload("offline"), qos=1, retain=True)
+                    # on the event loop the message is written once control returns to the loop
+                    if self.loop == None:
+                        info.wait_for_publish(2)
+                except (ValueError, RuntimeError):
+                    logger.warning("Could not publish the offline presence")
             self.connected = False
-            self.client.loop_stop()
+            if self.loop == None:
+                self.client.loop_stop()
             self.client.disconnect()
 
     def _on_disconnect(self, client, userdata, rc):
@@ -78,14 +183,22 @@ class MQTTClient:
         status_request_topic = f"{TOPIC_PREFIX}/{self.feeder_id}/status_request"
         update_topic = f"{TOPIC_PREFIX}/{self.feeder_id}/update"
         displaytest_topic = f"{TOPIC_PREFIX}/{self.feeder_id}/displaytest"
+        debug_topic = f"{TOPIC_PREFIX}/{self.feeder_id}/debug"
+        analytics_topic = f"{TOPIC_PREFIX}/{self.feeder_id}/analytics_request"
+        refill_topic = f"{TOPIC_PREFIX}/{self.feeder_id}/refill"
         discovery_topic = f"{TOPIC_PREFIX}/discovery"
 
         self.client.subscribe(feed_topic)
         self.client.subscribe(status_request_topic)
         self.client.subscribe(update_topic)
         self.client.subscribe(displaytest_topic)
+        self.client.subscribe(debug_topic)
+        self.client.subscribe(analytics_topic)
+        self.client.subscribe(refill_topic)
         self.client.subscribe(discovery_topic)
 
+        if self.presence:
+            self.client.publish(self.presence_topic, self._presence_payload("online"), qos=1, retain=True)
         self.send_status_message()
 
     def _on_message(self, client, userdata, msg):
@@ -99,7 +212,7 @@ class MQTTClient:
                 if(portions > MAX_PORTIONS):
                     portions = MAX_PORTIONS
                 if self.feeding_callback:
-                    self.feeding_callback(portions)
+                    self.feeding_callback(portions, payload.get("request_id"))
 
             elif topic.endswith("/status_request"):
                 logger.debug("MQTT status request command was received")
@@ -116,23 +229,84 @@ class MQTTClient:
                 else:
                     logger.warning(f"Invalid display signal: {method} ({paramstring})")
 
-    #        elif topic.endswith("/update"):
-    #            logger.debug("MQTT update was received")
-    #            if self.update_callback:
-    #                self.update_callback(payload)
+            elif topic.endswith("/debug"):
+                logger.debug("MQTT debug command was received")
+                if self.debug_callback:
+                    self.debug_callback(payload)
+
+            elif topic.endswith("/analytics_request"):
+                logger.debug("MQTT analytics request was received")
+                if self.analytics_callback:
+                    result = self.analytics_callback(payload)
+                    self.client.publish(f"{TOPIC_PREFIX}/{self.feeder_id}/analytics", json.dumps(result))
+
+            elif topic.endswith("/refill"):
+                logger.debug("MQTT refill was received")
+                if self.refill_callback:
+                    self.refill_callback(payload.get("machine"))
+
+            elif topic.endswith("/update"):
+                logger.debug("MQTT update was received")
+                if self.update_callback:
+                    self.update_callback(payload)
 
             elif topic == f"{TOPIC_PREFIX}/discovery":
                 logger.debug("MQTT discovery command was received")
-                self.send_discovery_response()
+                self.schedule_discovery_response()
         except Exception:
             logger.warning("An invalid MQTT command was sent")
 
-    def send_status_message(self):
+    def send_status_message(self, overrides = None):
         topic = f"{TOPIC_PREFIX}/{self.feeder_id}/status"
         if self.connected and self.status_callback:
             status = self.status_callback()
+            if overrides:
+                status.update(overrides)
             self.client.publish(topic, json.dumps(status))
 
+    def send_update_result(self, result):
+        topic = f"{TOPIC_PREFIX}/{self.feeder_id}/update_result"
+        if self.connected:
+            self.client.publish(topic, json.dumps(result))
+
+    def send_alert(self, alert):
+        topic = f"{TOPIC_PREFIX}/{self.feeder_id}/alert"
+        if not self.connected:
+            return False
+        self.client.publish(topic, json.dumps(alert), qos=1)
+        return True
+
+    def send_feed_result(self, request):
+        topic = f"{TOPIC_PREFIX}/{self.feeder_id}/feed_result"
+        if self.connected:
+            payload = {
+                "request_id": request.requestId,
+                "portions": request.portions,
+                "result": request.result
+            }
+            self.client.publish(topic, json.dumps(payload))
+
+    def send_debug_result(self, result):
+        if self.connected:
+            self.client.publish(f"{TOPIC_PREFIX}/{self.feeder_id}/debug_result", json.dumps(result))
+
+    def _presence_payload(self, state):
+        return json.dumps({
+            "feeder_id": self.feeder_id,
+            "name": self.name,
+            "config_url": self.config_url,
+            "state": state
+        })
+
+    def schedule_discovery_response(self):
+        # spread the answers of the fleet, so a discovery broadcast does not cause a burst of replies
+        if self._discovery_timer != None and self._discovery_timer.is_alive():
+            return
+        delay = random.uniform(0, self.discovery_jitter * self.fleet_size)
+        self._discovery_timer = threading.Timer(delay, self.send_discovery_response)
+        self._discovery_timer.daemon = True
+        self._discovery_timer.start()
+
     def send_discovery_response(self):
         if self.connected:
             topic = f"{TOPIC_PREFIX}/discovery_response"
@@ -0,0 +1,254 @@
+import os, gc, time, ctypes, threading, logging
+import multiprocessing
+from FeedingMachine import FeedingMachine, FeedingMachineError, MotorFailureError, FoodDispenseError, StopStatistics
+from EventBus import EventBus, MachineRound, MachineSuccessful, MachineFailed, MachineFinished
+
+logger = logging.getLogger(__name__)
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+ERRORS = {
+    MotorFailureError.code: MotorFailureError,
+    FoodDispenseError.code: FoodDispenseError
+}
+
+def _makeRealtime(priority):
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (AttributeError, PermissionError, OSError) as err:
+        logger.warning(f"Cannot use SCHED_FIFO for the motor process: {err}")
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+            logger.warning(f"Cannot lock motor process memory: {os.strerror(ctypes.get_errno())}")
+    except OSError as err:
+        logger.warning(f"Cannot lock motor process memory: {err}")
+    gc.disable()
+
+def _childMain(connection, machines, timing, priority):
+    # keep logging I/O out of the motor timing, only problems are logged here
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s [motor|%(filename)s:%(lineno)d] %(message)s')
+    logging.getLogger().setLevel(logging.WARNING)
+    for attribute, value in timing.items():
+        setattr(FeedingMachine, attribute, value)
+    sendLock = threading.Lock()
+
+    def send(*event):
+        with sendLock:
+            connection.send(event)
+
+    def onFailure(event):
+        send("failure", event.machine.name, event.error.code, event.error.roundsLeft, event.error.message)
+
+    def onSuccessful(event):
+        send("successful", event.machine.name)
+
+    def onFinish(event):
+        machine = event.machine
+        send("finish", machine.name, machine.lastStopLatency, event.noFoodCounter, machine.lastStopPosition, machine.sequenceRounds, machine.rotationTime)
+
+    def onRound(event):
+        send("round", event.machine.name, event.currentRound, event.rotationTime)
+
+    # events are forwarded to the daemon as they happen, the pipe is the queue
+    bus = EventBus()
+    bus.subscriber("pipe", inline=True).on(MachineFailed, onFailure).on(MachineSuccessful, onSuccessful).on(MachineFinished, onFinish).on(MachineRound, onRound)
+    feedingMachines = {}
+    for machine in machines:
+        feedingMachine = FeedingMachine(machine['name'], machine['motorPort'], machine['motorSensorPort'], machine['foodSensorPortOut'], machine['foodSensorPortIn'], bus)
+        feedingMachine.nominalRotationTime = machine.get('nominalRotationTime')
+        feedingMachines[feedingMachine.name] = feedingMachine
+    _makeRealtime(priority)
+    send("ready", os.getpid())
+    try:
+        while True:
+            command = connection.recv()
+            if command[0] == "run":
+                feedingMachines[command[1]].runSequence(command[2])
+            elif command[0] == "close":
+                break
+    except (EOFError, OSError):
+        pass
+    finally:
+        for feedingMachine in feedingMachines.values():
+            feedingMachine.closeAll()
+
+class RemoteFeedingMachine:
+    """Stands in for a FeedingMachine that runs in the MotorControlProcess"""
+    __slots__ = ("name", "currentRound", "power", "span", "bus", "stats", "lastRotationTime", "noFoodCounter", "_process")
+
+    def __init__(self, name, process, bus = None):
+        self.name = name
+        self.currentRound = None
+        self.power = 0
+        self.span = None
+        self.bus = bus
+        self.stats = StopStatistics()
+        self.lastRotationTime = None
+        self.noFoodCounter = 0
+        self._process = process
+
+    def runSequence(self, rounds = 1):
+        self.currentRound = rounds
+        self._process.run(self, rounds)
+
+    def closeAll(self):
+        pass
+
+class MotorControlProcess:
+    """Runs the FeedingMachines in a child process with real-time priority
+
+    The child uses SCHED_FIFO, locks its memory and disables the garbage
+    collector, so MQTT, the display, logging and GC pauses in the daemon do
+    not delay the motor. Commands and events are exchanged over a pipe.
+    When the child stops unexpectedly the running machines fail and the
+    child is started again, after maxRestarts within restartWindow seconds
+    the process is marked failed and every sequence fails right away.
+    """
+
+    def __init__(self, machines, priority = 50, maxRestarts = 3, restartWindow = 600, bus = None):
+        self.priority = priority
+        self.maxRestarts = maxRestarts
+        self.restartWindow = restartWindow
+        self.pid = None
+        self.failed = False
+        self._restarts = []
+        self._stopping = False
+        self._failLock = threading.Lock()
+        self._lifecycleLock = threading.Lock()
+        self.machines = [RemoteFeedingMachine(machine['name'], self, bus) for machine in machines]
+        self._machinesByName = {machine.name: machine for machine in self.machines}
+        self._machineConfigs = machines
+        self._connection = None
+        self._process = None
+        self._listener = None
+        self._sendLock = threading.Lock()
+        self._ready = threading.Event()
+
+    def start(self, timeout = 10):
+        self._stopping = False
+        self._ready.clear()
+        context = multiprocessing.get_context("spawn")
+        self._connection, childConnection = context.Pipe()
+        timing = {
+            "fakeMotorDuration": FeedingMachine.fakeMotorDuration,
+            "sensorArmDelay": FeedingMachine.sensorArmDelay,
+            "stopDelay": FeedingMachine.stopDelay
+        }
+        self._process = context.Process(target=_childMain, args=(childConnection, self._machineConfigs, timing, self.priority), name="MotorControl", daemon=True)
+        self._process.start()
+        childConnection.close()
+        self._listener = threading.Thread(target=self._listen, name="MotorControlListener", daemon=True)
+        self._listener.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError("Motor control process did not start")
+        logger.info(f"Motor control process started with PID {self.pid}")
+
+    def send(self, *command):
+        with self._sendLock:
+            self._connection.send(command)
+
+    def run(self, machine, rounds):
+        if not self.failed:
+            try:
+                self.send("run", machine.name, rounds)
+                return
+            except (OSError, ValueError) as err:
+                logger.error(f"Cannot send to the motor control process: {err}")
+        self._fail(machine, "Motor control process is not running")
+
+    def stop(self):
+        self._stopping = True
+        with self._lifecycleLock:
+            if self._process is None:
+                return
+            try:
+                self.send("close")
+            except (OSError, ValueError):
+                pass
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join(1)
+            # the listener sees the child exit, closing the pipe under it could hand its fd to the next process
+            if self._listener is not threading.current_thread():
+                self._listener.join(5)
+            self._connection.close()
+            self._process = None
+
+    def _listen(self):
+        while True:
+            try:
+                event = self._connection.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                self._dispatch(event)
+            except Exception as err:
+                logger.error(f"Motor control event {event[0]} failed: {err}")
+        if self._process is None or self._stopping:
+            return
+        logger.error(f"Motor control process has stopped with exit code {self._process.exitcode}")
+        for machine in self.machines:
+            self._fail(machine, "Motor control process has stopped")
+        self._restart()
+
+    def _fail(self, machine, message):
+        # the listener and a failed send can both see the child die, the machine fails once
+        with self._failLock:
+            rounds = machine.currentRound
+            if rounds is None:
+                return
+            machine.currentRound = None
+        machine.bus.publish(MachineFailed(machine, FeedingMachineError(machine, rounds, message)))
+        machine.bus.publish(MachineFinished(machine, machine.noFoodCounter))
+
+    def _restart(self):
+        # stop() holds the lock while it waits for this thread
+        while not self._lifecycleLock.acquire(timeout=0.1):
+            if self._stopping:
+                return
+        try:
+            if self._stopping:
+                return
+            now = time.monotonic()
+            self._restarts = [restartedAt for restartedAt in self._restarts if now - restartedAt < self.restartWindow]
+            if len(self._restarts) >= self.maxRestarts:
+                logger.error(f"Motor control process stopped {len(self._restarts) + 1} times, feeding is disabled")
+                self.failed = True
+                return
+            self._restarts.append(now)
+            self._process.join(1)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._connection.close()
+            try:
+                self.start()
+            except (RuntimeError, OSError) as err:
+                logger.error(f"Cannot restart the motor control process: {err}")
+                self.failed = True
+        finally:
+            self._lifecycleLock.release()
+
+    def _dispatch(self, event):
+        if event[0] == "ready":
+            self.pid = event[1]
+            self._ready.set()
+            return
+        machine = self._machinesByName[event[1]]
+        if event[0] == "failure":
+            error = ERRORS.get(event[2], FeedingMachineError)(machine, event[3], event[4])
+            machine.bus.publish(MachineFailed(machine, error))
+        elif event[0] == "round":
+            machine.currentRound = event[2]
+            machine.lastRotationTime = event[3]
+            machine.bus.publish(MachineRound(machine, event[2], event[3]))
+        elif event[0] == "successful":
+            machine.bus.publish(MachineSuccessful(machine))
+        elif event[0] == "finish":
+            machine.currentRound = None
+            machine.noFoodCounter = event[3]
+            machine.stats.rotationTime = event[6]
+            machine.stats.record(event[2], event[4], event[5] if event[3] == 0 else None)
+            machine.bus.publish(MachineFinished(machine, event[3]))
@@ -1,6 +1,261 @@
 import smtplib, ssl
 import json
+import time
+import queue
+import logging
+import threading
+import http.client
+from email.message import EmailMessage
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# digests list at most this many of the collected notifications
+DIGEST_LINES = 20
 
 class Notification:
-    def __init__(self):
+    """A message about the feeder, e.g. a blocked motor or an empty dispenser
+
+    Attributes:
+        code -- error code, used for rate limiting (blocked, empty, error)
+        subject -- short summary
+        message -- explanation
+        feeder -- id of the feeder
+        machine -- name of the machine, if any
+        count -- how many notifications a digest stands for
+    """
+    __slots__ = ("code", "subject", "message", "feeder", "machine", "time", "count")
+
+    def __init__(self, code, subject, message, feeder = None, machine = None):
+        self.code = code
+        self.subject = subject
+        self.message = message
+        self.feeder = feeder
+        self.machine = machine
+        self.time = time.time()
+        self.count = 1
+
+    def toDict(self):
+        return {
+            "code": self.code,
+            "subject": self.subject,
+            "message": self.message,
+            "feeder": self.feeder,
+            "machine": self.machine,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.time)),
+            "count": self.count
+        }
+
+def digest(notifications):
+    """Combine notifications with the same code into one message"""
+    first = notifications[0]
+    lines = [time.strftime("%H:%M:%S", time.localtime(notification.time)) + " " + (notification.machine or "-") + ": " + notification.message for notification in notifications[:DIGEST_LINES]]
+    if len(notifications) > DIGEST_LINES:
+        lines.append(f"... and {len(notifications) - DIGEST_LINES} more")
+    result = Notification(first.code, f"{len(notifications)}x {first.subject}", "\n".join(lines), first.feeder)
+    result.count = sum([notification.count for notification in notifications])
+    return result
+
+class SmtpSink:
+    """Sends notifications by mail, keeping the connection to the relay open"""
+    name = "smtp"
+
+    def __init__(self, options):
+        self.host = options.get("host", "localhost")
+        self.port = options.get("port", 25)
+        self.user = options.get("user")
+        self.password = options.get("pass")
+        self.starttls = options.get("starttls", False)
+        self.sender = options.get("from", "catfeeder@localhost")
+        self.recipients = options.get("to", [])
+        self.timeout = options.get("timeout", 10)
+        self._smtp = None
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls(context=ssl.create_default_context())
+        if self.user != None:
+            smtp.login(self.user, self.password)
+        return smtp
+
+    def send(self, notification):
+        message = EmailMessage()
+        message["Subject"] = notification.subject
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.recipients)
+        message.set_content(notification.message)
+        for attempt in range(2):
+            if self._smtp is None:
+                self._smtp = self._connect()
+            try:
+                self._smtp.send_message(message)
+                return
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # the relay closed the idle connection, try once more with a new one
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+class MqttSink:
+    """Publishes notifications on cat_feeder/<id>/alert"""
+    name = "mqtt"
+
+    def __init__(self, getClient):
+        # the MQTT client is replaced when the configuration changes
+        self.getClient = getClient
+
+    def send(self, notification):
+        client = self.getClient()
+        if client is None or not client.send_alert(notification.toDict()):
+            raise ConnectionError("MQTT is not connected")
+
+    def close(self):
         pass
+
+class WebhookSink:
+    """POSTs notifications as JSON, reusing the HTTP connection"""
+    name = "webhook"
+
+    def __init__(self, options):
+        url = urlsplit(options["url"])
+        self.secure = url.scheme == "https"
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path or "/"
+        self.timeout = options.get("timeout", 10)
+        self._connection = None
+
+    def send(self, notification):
+        body = json.dumps(notification.toDict())
+        for attempt in range(2):
+            if self._connection is None:
+                if self.secure:
+                    self._connection = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+                else:
+                    self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._connection.request("POST", self.path, body, {"Content-Type": "application/json"})
+                response = self._connection.getresponse()
+                response.read()
+                if response.status >= 300:
+                    raise ConnectionError(f"Webhook returned {response.status}")
+                return
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+class NotificationDispatcher:
+    """Sends notifications from a background thread
+
+    notify() never blocks: when the queue is full the notification is
+    dropped. At most one notification per code is sent every rateLimit
+    seconds, the ones in between are collected and sent as one digest when
+    the interval has passed.
+    """
+
+    def __init__(self, sinks = None, queueSize = 100, rateLimit = 600, codes = None):
+        self.sinks = sinks or []
+        self.rateLimit = rateLimit
+        self.codes = codes
+        # notify() runs on the producers' threads, sending on the dispatcher thread
+        self._statsLock = threading.Lock()
+        self._stats = {"queued": 0, "sent": 0, "digests": 0, "dropped": 0, "failed": 0}
+        self._queue = queue.Queue(queueSize)
+        self._lastSent = {}
+        self._pending = {}
+        self._thread = None
+
+    def notify(self, notification):
+        if self.codes is not None and notification.code not in self.codes:
+            return False
+        try:
+            self._queue.put_nowait(notification)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("queued")
+        return True
+
+    def _count(self, key):
+        with self._statsLock:
+            self._stats[key] += 1
+
+    def metrics(self):
+        with self._statsLock:
+            return dict(self._stats)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="Notifications", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout = 5):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                notification = self._queue.get(timeout=self._nextDigest())
+            except queue.Empty:
+                notification = False
+            if notification is None:
+                break
+            if notification:
+                self._handle(notification)
+            self._sendDigests()
+        self._sendDigests(True)
+        for sink in self.sinks:
+            sink.close()
+
+    def _nextDigest(self):
+        if not self._pending:
+            return None
+        now = time.monotonic()
+        return max(0, min([self._lastSent[code] + self.rateLimit - now for code in self._pending]))
+
+    def _handle(self, notification):
+        lastSent = self._lastSent.get(notification.code)
+        if lastSent is not None and time.monotonic() - lastSent < self.rateLimit:
+            self._pending.setdefault(notification.code, []).append(notification)
+            return
+        self._send(notification)
+
+    def _sendDigests(self, force = False):
+        now = time.monotonic()
+        for code in list(self._pending):
+            if force or now - self._lastSent[code] >= self.rateLimit:
+                notifications = self._pending.pop(code)
+                self._count("digests")
+                self._send(digest(notifications))
+
+    def _send(self, notification):
+        delivered = False
+        for sink in self.sinks:
+            try:
+                sink.send(notification)
+                self._count("sent")
+                delivered = True
+            except Exception as err:
+                self._count("failed")
+                logger.warning(f"Cannot send notification with {sink.name}: {err}")
+        # when no sink got it the next notification of this code is not held back
+        if delivered:
+            self._lastSent[notification.code] = time.monotonic()
@@ -0,0 +1,228 @@
+import os, sys, queue, threading, time, tracemalloc, logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+DEBUG_DIR = "/var/log/voerautomaat/debug"
+COMMAND_FILE = "/var/log/voerautomaat/debug.command"
+
+class SamplingProfiler:
+    """Samples the stacks of all threads with sys._current_frames
+
+    The stacks are counted in the collapsed format ("thread;frame;frame count")
+    that flamegraph.pl and speedscope read. Nothing runs while stopped.
+    """
+
+    def __init__(self, rate = 100):
+        self.rate = rate
+        self.samples = 0
+        self.startedAt = None
+        self._stacks = Counter()
+        self._thread = None
+        self._stopEvent = threading.Event()
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.isRunning():
+            return False
+        self._stacks = Counter()
+        self.samples = 0
+        self.startedAt = time.time()
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._sample, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.isRunning():
+            return False
+        self._stopEvent.set()
+        self._thread.join()
+        return True
+
+    def _sample(self):
+        interval = 1 / self.rate
+        ownId = threading.get_ident()
+        while not self._stopEvent.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == ownId:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                self._stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "\n".join([f"{stack} {count}" for stack, count in self._stacks.most_common()]) + "\n"
+
+class MemoryProfiler:
+    """Takes tracemalloc snapshots and compares them with the previous one"""
+
+    def __init__(self, frames = 10):
+        self.frames = frames
+        self._previous = None
+
+    def isRunning(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(self.frames)
+        self._previous = None
+        return True
+
+    def stop(self):
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        self._previous = None
+        return True
+
+    def snapshot(self, limit = 30):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced: {current} bytes, peak: {peak} bytes", "", "top allocations:"]
+        lines.extend([str(stat) for stat in snapshot.statistics("lineno")[:limit]])
+        if self._previous is not None:
+            lines.extend(["", "difference with previous snapshot:"])
+            lines.extend([str(stat) for stat in snapshot.compare_to(self._previous, "lineno")[:limit]])
+        self._previous = snapshot
+        return "\n".join(lines) + "\n"
+
+class DebugTools:
+    """Handles debug commands from MQTT or the CLI and writes the results to outputDir
+
+    Commands are queued with submit() and run on a worker thread, a memory
+    snapshot takes long enough to stall the MQTT network thread or the
+    interrupted main loop. At most maxFiles result files are kept, the oldest
+    are removed first.
+    """
+
+    def __init__(self, outputDir = DEBUG_DIR, maxFiles = 20, sampleRate = 100, maxDuration = 300):
+        self.outputDir = outputDir
+        self.maxFiles = maxFiles
+        self.maxDuration = maxDuration
+        self.profiler = SamplingProfiler(sampleRate)
+        self.memoryProfiler = MemoryProfiler()
+        self._profileTimer = None
+        # SimpleQueue.put is reentrant, so a signal handler can use it
+        self._requests = queue.SimpleQueue()
+        self._worker = None
+        self._workerLock = threading.Lock()
+
+    def configure(self, options):
+        self.outputDir = options.get("outputDir", DEBUG_DIR)
+        self.maxFiles = options.get("maxFiles", 20)
+        self.maxDuration = options.get("maxDuration", 300)
+        if not self.profiler.isRunning():
+            self.profiler.rate = options.get("sampleRate", 100)
+
+    def submit(self, command, callback = None):
+        """Queue a command for the worker, callback receives the result"""
+        self._requests.put((command, callback))
+        self._startWorker()
+
+    def submitCommandFile(self, path = COMMAND_FILE, callback = None):
+        """Queue reading the command file, safe to call from a signal handler"""
+        self._requests.put((path, callback))
+        self._startWorker()
+
+    def _startWorker(self):
+        if self._worker is not None:
+            return
+        # a signal can interrupt the thread that holds the lock, it then leaves starting to that thread
+        if not self._workerLock.acquire(blocking=False):
+            return
+        try:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name="DebugTools", daemon=True)
+                self._worker.start()
+        finally:
+            self._workerLock.release()
+
+    def _work(self):
+        while True:
+            command, callback = self._requests.get()
+            try:
+                if isinstance(command, str):
+                    result = self.handleCommandFile(command)
+                else:
+                    result = self.handle(command)
+                if callback is not None and result is not None:
+                    callback(result)
+            except Exception as err:
+                logger.error(f"Debug command failed: {err}")
+
+    def handle(self, command):
+        action = command.get("action")
+        logger.info(f"Debug command '{action}' received")
+        if action == "profile_start":
+            if not self.profiler.isRunning():
+                self.profiler.rate = command.get("rate", self.profiler.rate)
+            started = self.profiler.start()
+            if started:
+                duration = min(command.get("duration", self.maxDuration), self.maxDuration)
+                self._profileTimer = threading.Timer(duration, self._stopProfiler)
+                self._profileTimer.daemon = True
+                self._profileTimer.start()
+            return {"action": action, "started": started, "rate": self.profiler.rate}
+        elif action == "profile_stop":
+            return {"action": action, "file": self._stopProfiler()}
+        elif action == "memory_start":
+            return {"action": action, "started": self.memoryProfiler.start()}
+        elif action == "memory_snapshot":
+            if not self.memoryProfiler.isRunning():
+                return {"action": action, "error": "memory tracing is not running"}
+            return {"action": action, "file": self._write("memory", "txt", self.memoryProfiler.snapshot())}
+        elif action == "memory_stop":
+            return {"action": action, "stopped": self.memoryProfiler.stop()}
+        else:
+            logger.warning(f"Unknown debug command '{action}'")
+            return {"action": action, "error": "unknown action"}
+
+    def handleCommandFile(self, path = COMMAND_FILE):
+        try:
+            with open(path, "r") as f:
+                action = f.read().strip()
+            os.remove(path)
+        except OSError as err:
+            logger.warning(f"Cannot read debug command: {err}")
+            return None
+        return self.handle({"action": action})
+
+    def _stopProfiler(self):
+        if self._profileTimer is not None:
+            self._profileTimer.cancel()
+            self._profileTimer = None
+        if not self.profiler.stop():
+            return None
+        logger.info(f"Profiler took {self.profiler.samples} samples")
+        return self._write("profile", "collapsed", self.profiler.collapsed())
+
+    def _write(self, kind, extension, content):
+        os.makedirs(self.outputDir, exist_ok=True)
+        now = time.time()
+        name = f"{kind}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}.{extension}"
+        path = os.path.join(self.outputDir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        self._cleanup()
+        return path
+
+    def _cleanup(self):
+        files = [os.path.join(self.outputDir, name) for name in os.listdir(self.outputDir)]
+        files = sorted([path for path in files if os.path.isfile(path)], key=os.path.getmtime)
+        for path in files[:max(0, len(files) - self.maxFiles)]:
+            os.remove(path)
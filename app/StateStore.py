@@ -0,0 +1,97 @@
+import os, json, threading, logging
+from os.path import abspath, dirname
+from Config import atomicWrite
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+class StateStore:
+    """Keeps a small snapshot of the daemon state in a file that survives a crash
+
+    update() only changes the in-memory state and wakes the writer thread,
+    which waits writeInterval seconds to coalesce changes and then replaces
+    the file atomically, so the file is always either the old or the new
+    snapshot.
+    """
+
+    def __init__(self, file, writeInterval = 0.2):
+        self.file = file
+        self.writeInterval = writeInterval
+        self.state = {"version": STATE_VERSION}
+        self.writes = 0
+        self._dirty = threading.Event()
+        self._stopEvent = threading.Event()
+        self._lock = threading.Lock()
+        self._writeLock = threading.Lock()
+        self._writer = None
+
+    def load(self):
+        """Read the snapshot of the previous run, returns an empty state when there is none"""
+        try:
+            with open(self.file, "rb") as f:
+                state = json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as err:
+            logger.warning(f"Cannot read state file {self.file}: {err}")
+            return {}
+        if state.get("version") != STATE_VERSION:
+            logger.warning(f"Ignoring state file with version {state.get('version')}")
+            return {}
+        with self._lock:
+            self.state = dict(state)
+        return state
+
+    def get(self, key, default = None):
+        with self._lock:
+            return self.state.get(key, default)
+
+    def update(self, **values):
+        with self._lock:
+            self.state.update(values)
+        self._dirty.set()
+
+    def start(self):
+        try:
+            os.makedirs(dirname(abspath(self.file)), exist_ok=True)
+        except OSError as err:
+            logger.error(f"Cannot create the directory of state file {self.file}: {err}")
+        if self._writer is None or not self._writer.is_alive():
+            self._stopEvent.clear()
+            self._writer = threading.Thread(target=self._run, name="StateStore", daemon=True)
+            self._writer.start()
+
+    def stop(self):
+        self._stopEvent.set()
+        self._dirty.set()
+        if self._writer is not None:
+            self._writer.join(5)
+            self._writer = None
+        self.flush()
+
+    def _run(self):
+        # flush() clears _dirty, a stop during the wait below is seen here
+        while not self._stopEvent.is_set():
+            self._dirty.wait()
+            if self._stopEvent.is_set():
+                return
+            # collect the changes of a burst of updates into one write
+            self._stopEvent.wait(self.writeInterval)
+            self.flush()
+
+    def flush(self):
+        with self._writeLock:
+            if not self._dirty.is_set():
+                return
+            self._dirty.clear()
+            with self._lock:
+                data = json.dumps(self.state)
+            try:
+                self._write(data)
+                self.writes += 1
+            except OSError as err:
+                logger.error(f"Cannot write state file {self.file}: {err}")
+
+    def _write(self, data):
+        atomicWrite(self.file, data, ".state.")
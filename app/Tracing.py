@@ -0,0 +1,166 @@
+import os, json, time, threading, logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "catfeeder"
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# wall clock time in nanoseconds, derived from the monotonic clock so spans never go back in time
+_EPOCH_OFFSET = time.time_ns() - time.monotonic_ns()
+
+def nowNs():
+    return time.monotonic_ns() + _EPOCH_OFFSET
+
+def monotonicToNs(seconds):
+    """Convert a time.monotonic() value to the span clock"""
+    return int(seconds * 1000000000) + _EPOCH_OFFSET
+
+def _attributeValue(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _attributes(attributes):
+    return [{"key": key, "value": _attributeValue(value)} for key, value in attributes.items() if value is not None]
+
+class Span:
+    """A timed operation within a trace, ended by end()"""
+    __slots__ = ("tracer", "traceId", "spanId", "parentId", "name", "start", "end", "attributes", "events", "status", "statusMessage")
+
+    def __init__(self, tracer, name, traceId, parentId = None, start = None, attributes = None):
+        self.tracer = tracer
+        self.name = name
+        self.traceId = traceId
+        self.spanId = os.urandom(8).hex()
+        self.parentId = parentId
+        self.start = start if start is not None else nowNs()
+        self.end = None
+        self.attributes = attributes or {}
+        self.events = []
+        self.status = STATUS_UNSET
+        self.statusMessage = None
+
+    def child(self, name, start = None, **attributes):
+        return self.tracer.startSpan(name, self, start, **attributes)
+
+    def setAttribute(self, key, value):
+        self.attributes[key] = value
+
+    def addEvent(self, name, **attributes):
+        self.events.append((nowNs(), name, attributes))
+
+    def setError(self, message):
+        self.status = STATUS_ERROR
+        self.statusMessage = message
+
+    def finish(self, end = None):
+        if self.end is not None:
+            return
+        self.end = end if end is not None else nowNs()
+        if self.status == STATUS_UNSET:
+            self.status = STATUS_OK
+        self.tracer._finished(self)
+
+    def toOtlp(self):
+        span = {
+            "traceId": self.traceId,
+            "spanId": self.spanId,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": _attributes(self.attributes),
+            "events": [{"timeUnixNano": str(timestamp), "name": name, "attributes": _attributes(attributes)} for timestamp, name, attributes in self.events],
+            "status": {"code": self.status}
+        }
+        if self.parentId is not None:
+            span["parentSpanId"] = self.parentId
+        if self.statusMessage is not None:
+            span["status"]["message"] = self.statusMessage
+        return span
+
+class Tracer:
+    """Records spans of feed jobs in a bounded buffer
+
+    A trace is exported when its root span ends, as one JSON line in the
+    OpenTelemetry (OTLP/JSON) layout. The export file is rotated to .1 when
+    it grows beyond maxFileSize bytes.
+    """
+
+    def __init__(self, historySize = 500, exportFile = None, maxFileSize = 1000000):
+        self.enabled = True
+        self.exportFile = exportFile
+        self.maxFileSize = maxFileSize
+        self.resource = {"service.name": SERVICE_NAME}
+        self.spans = deque(maxlen=historySize)
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def configure(self, options):
+        self.enabled = options.get("enabled", True)
+        self.exportFile = options.get("exportFile")
+        self.maxFileSize = options.get("maxFileSize", 1000000)
+        historySize = options.get("historySize", 500)
+        with self._lock:
+            if historySize != self.spans.maxlen:
+                self.spans = deque(self.spans, maxlen=historySize)
+
+    def startTrace(self, name, start = None, **attributes):
+        """Start the root span of a new trace, returns None when tracing is disabled"""
+        if not self.enabled:
+            return None
+        span = Span(self, name, os.urandom(16).hex(), None, start, attributes)
+        with self._lock:
+            self._open[span.traceId] = []
+        return span
+
+    def startSpan(self, name, parent, start = None, **attributes):
+        if parent is None:
+            return None
+        return Span(self, name, parent.traceId, parent.spanId, start, attributes)
+
+    def _finished(self, span):
+        with self._lock:
+            self.spans.append(span)
+            pending = self._open.get(span.traceId)
+            if pending is None:
+                return
+            pending.append(span)
+            if span.parentId is not None:
+                return
+            del self._open[span.traceId]
+        if self.exportFile:
+            self.export(pending)
+
+    def trace(self, traceId):
+        with self._lock:
+            return [span.toOtlp() for span in self.spans if span.traceId == traceId]
+
+    def toOtlp(self, spans):
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _attributes(self.resource)},
+                "scopeSpans": [{
+                    "scope": {"name": SERVICE_NAME},
+                    "spans": [span.toOtlp() for span in sorted(spans, key=lambda span: span.start)]
+                }]
+            }]
+        }
+
+    def export(self, spans):
+        try:
+            if os.path.exists(self.exportFile) and os.path.getsize(self.exportFile) > self.maxFileSize:
+                os.replace(self.exportFile, self.exportFile + ".1")
+            with open(self.exportFile, "a") as f:
+                f.write(json.dumps(self.toOtlp(spans)) + "\n")
+        except OSError as err:
+            logger.warning(f"Cannot export trace: {err}")
+
+tracer = Tracer()
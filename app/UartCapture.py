@@ -0,0 +1,113 @@
+import time, struct, threading, logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+RX = 0
+TX = 1
+MAGIC = b"UARTCAP1"
+# magic and the wall clock time of monotonic 0 in nanoseconds
+HEADER = struct.Struct("<8sq")
+# direction, monotonic time in nanoseconds and length, followed by the bytes
+RECORD = struct.Struct("<BqH")
+
+class UartCapture:
+    """Records the raw bytes on the display UART
+
+    The last size chunks are always kept in a ring buffer, so the traffic
+    that led to a protocol error can be dumped afterwards. With a file the
+    traffic is also appended to it as it happens, each capture starts with
+    its own header, so reopening the display does not lose earlier traffic.
+    """
+
+    def __init__(self, size = 4096, file = None):
+        self.records = deque(maxlen=size)
+        self.file = file
+        self._output = None
+        self._lock = threading.Lock()
+        if file != None:
+            self._output = open(file, "ab")
+            self._output.write(HEADER.pack(MAGIC, time.time_ns() - time.monotonic_ns()))
+
+    def record(self, direction, data):
+        record = (direction, time.monotonic_ns(), bytes(data))
+        self.records.append(record)
+        if self._output != None:
+            with self._lock:
+                self._output.write(RECORD.pack(*record[:2], len(record[2])) + record[2])
+
+    def dump(self, file):
+        """Write the ring buffer to a capture file"""
+        records = list(self.records)
+        writeCapture(file, records)
+        return len(records)
+
+    def close(self):
+        if self._output != None:
+            with self._lock:
+                self._output.close()
+                self._output = None
+
+def writeCapture(file, records):
+    with open(file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, time.time_ns() - time.monotonic_ns()))
+        for direction, timestamp, data in records:
+            f.write(RECORD.pack(direction, timestamp, len(data)) + data)
+
+def readCapture(file):
+    """Return the records (direction, monotonic ns, bytes) of a capture file"""
+    with open(file, "rb") as f:
+        content = f.read()
+    magic, _ = HEADER.unpack_from(content, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{file} is not a UART capture")
+    records = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(content):
+        if content.startswith(MAGIC, offset):
+            # the file was opened again, the records of the next capture follow
+            offset += HEADER.size
+            continue
+        direction, timestamp, length = RECORD.unpack_from(content, offset)
+        offset += RECORD.size
+        records.append((direction, timestamp, content[offset:offset + length]))
+        offset += length
+    return records
+
+class FrameDecoder:
+    """Splits a byte stream into frames of address, method, length, data and checksum
+
+    Bytes before an address are skipped; an incomplete frame stays in the
+    buffer until the rest arrives.
+    """
+
+    def __init__(self, address):
+        self.address = bytes(address)
+        self.skipped = 0
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Return the frames completed by data as (method, length, data, checksum)"""
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        while True:
+            start = buffer.find(self.address)
+            if start < 0:
+                # keep a byte that may be the start of the next address
+                keep = 1 if buffer[-1:] == self.address[:1] else 0
+                self.skipped += len(buffer) - keep
+                del buffer[:len(buffer) - keep]
+                break
+            if start > 0:
+                self.skipped += start
+                del buffer[:start]
+            if len(buffer) < 4:
+                break
+            length = buffer[3]
+            end = 5 + length
+            if len(buffer) < end:
+                break
+            frames.append((buffer[2], length, list(buffer[4:4 + length]), buffer[4 + length]))
+            del buffer[:end]
+        return frames
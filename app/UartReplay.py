@@ -0,0 +1,94 @@
+"""Replays a UART capture into the display decoder and protocol handling
+
+    python UartReplay.py capture.bin [--realtime] [--config config.json]
+
+By default the capture is replayed as fast as possible, with the response
+delays of the panel protocol skipped. With --realtime the original timing
+is kept. Answers of the daemon are recorded instead of sent.
+"""
+import json, time, argparse, logging
+from types import SimpleNamespace
+from UartCapture import readCapture, FrameDecoder, TX
+from Display import Display, ChecksumError
+from LagMonitor import percentiles
+
+class ReplaySerial:
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes += len(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+def replay(records, config = None, realtime = False):
+    """Feed the RX records to a Display, returns statistics of the run"""
+    if config is None:
+        config = SimpleNamespace(schedule=[], display={})
+    else:
+        # without the capture options, the answers of the replay must not end up in the daemon's capture files
+        config = SimpleNamespace(schedule=config.schedule, display={key: value for key, value in config.display.items() if key != "capture"})
+    display = Display(config, connect=False)
+    display.ser = ReplaySerial()
+    if not realtime:
+        display.responseDelay = 0
+    decoder = FrameDecoder(Display.ownAddress)
+    frames = 0
+    unknown = 0
+    checksumErrors = 0
+    handlingTimes = []
+    capturedResponses = []
+    waitingSince = None
+    first = records[0][1] if records else 0
+    started = time.perf_counter()
+    for direction, timestamp, data in records:
+        if direction == TX:
+            # how long the daemon took to answer in the capture
+            if waitingSince is not None:
+                capturedResponses.append((timestamp - waitingSince) / 1000000)
+                waitingSince = None
+            continue
+        if realtime:
+            delay = (timestamp - first) / 1000000000 - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        for frame in decoder.feed(data):
+            frames += 1
+            waitingSince = timestamp
+            handlingStarted = time.perf_counter()
+            try:
+                if display._validateInput(*frame) == False:
+                    unknown += 1
+            except ChecksumError:
+                checksumErrors += 1
+            handlingTimes.append((time.perf_counter() - handlingStarted) * 1000)
+    elapsed = time.perf_counter() - started
+    return {
+        "records": len(records),
+        "frames": frames,
+        "frames_per_second": round(frames / elapsed, 1) if elapsed > 0 else None,
+        "elapsed_s": round(elapsed, 3),
+        "checksum_errors": checksumErrors,
+        "unknown_methods": unknown,
+        "skipped_bytes": decoder.skipped,
+        "responses_sent": display.ser.writes,
+        "handling_ms": percentiles(handlingTimes, digits=3),
+        "captured_response_ms": percentiles(capturedResponses, digits=3)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a display UART capture")
+    parser.add_argument("capture")
+    parser.add_argument("--realtime", action="store_true", help="keep the timing of the capture")
+    parser.add_argument("--config", help="config.json for the feeding schedule")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    config = None
+    if args.config:
+        from Config import Config
+        config = Config(args.config)
+    print(json.dumps(replay(readCapture(args.capture), config, args.realtime), indent=2))
@@ -5,17 +5,21 @@ import sys
 import logging
 from logger import initLogger
 
-logger = logging.getLogger()
-initLogger(logger)
-
-from CatFeeder import CatFeeder
-
 #----------------------------------------------------------------------------------------------------
 # the main section
+# the motor control process is spawned and imports this module as __mp_main__,
+# it must not set up the daemon's log files or load the daemon
 if __name__ == "__main__":
+    logger = logging.getLogger()
+    initLogger(logger)
+
+    from CatFeeder import CatFeeder
     daemon = CatFeeder()
-    usageMessage = f"Usage: {sys.argv[0]} (start|stop|restart|status|reload|version|feed|verbose)"
-    if len(sys.argv) == 2:
+    usageMessage = f"Usage: {sys.argv[0]} (start|stop|restart|status|reload|version|feed|verbose|aggregator|debug <action>)"
+    if len(sys.argv) == 3 and sys.argv[1] == "debug":
+        daemon.debugSignal(sys.argv[2])
+        sys.exit(0)
+    elif len(sys.argv) == 2:
         choice = sys.argv[1]
         if choice == "start":
             daemon.start()
@@ -33,6 +37,10 @@ if __name__ == "__main__":
             daemon.user1Signal()
         elif choice == "verbose":
             daemon.verbose()
+        elif choice == "aggregator":
+            from Config import Config
+            from FleetAggregator import FleetAggregator
+            FleetAggregator(Config()).run()
         else:
             print("Unknown command.")
             print(usageMessage)
@@ -0,0 +1,67 @@
+"""Rebuild and query cost of the consumption analytics
+
+Generates raw history for a number of machines feeding every few hours
+with retries, failures and refills, then times rebuilding all rollups
+from the history bytes and the range queries used for MQTT.
+
+    python benchmarks/analytics.py [days] [feedingsPerDay] [machines]
+"""
+import common
+import sys, json, time, random
+from Analytics import Analytics, EVENT, EVENT_PORTION, EVENT_FINISH, EVENT_FAILURE, EVENT_EMPTY, EVENT_REFILL
+
+def buildHistory(days, feedingsPerDay, machines, seed = 1):
+    random.seed(seed)
+    end = time.time()
+    start = end - days * 86400
+    events = bytearray()
+    for day in range(days):
+        if day % 14 == 0:
+            for machine in range(machines):
+                events += EVENT.pack(start + day * 86400, EVENT_REFILL, f"machine{machine}".encode(), 0)
+        for feeding in range(feedingsPerDay):
+            timestamp = start + day * 86400 + feeding * 86400 / feedingsPerDay
+            for machine in range(machines):
+                name = f"machine{machine}".encode()
+                for portion in range(random.randint(1, 3)):
+                    events += EVENT.pack(timestamp, EVENT_PORTION, name, random.uniform(2.5, 3.5))
+                events += EVENT.pack(timestamp, EVENT_FINISH, name, random.choice((0, 0, 0, 1)))
+                if random.random() < 0.01:
+                    events += EVENT.pack(timestamp, random.choice((EVENT_FAILURE, EVENT_EMPTY)), name, 0)
+    return bytes(events)
+
+def _time(function, repeat = 5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def run(days = 365, feedingsPerDay = 6, machines = 2):
+    history = buildHistory(days, feedingsPerDay, machines)
+    analytics = Analytics(hopperCapacity={"machine0": 40})
+    rebuildTime, events = _time(lambda: analytics.rebuild(history), 3)
+    queries = {
+        "today": lambda: analytics.totals("daily", 1),
+        "last_7_days": lambda: analytics.totals("daily", 7, "machine0"),
+        "last_year": lambda: analytics.totals("daily", 365),
+        "last_48_hours_series": lambda: analytics.series("hourly", 48),
+        "monthly_series": lambda: analytics.series("monthly", 12),
+        "status_summary": analytics.summary
+    }
+    result = {
+        "events": events,
+        "history_bytes": len(history),
+        "rebuild_s": round(rebuildTime, 4),
+        "events_per_second": round(events / rebuildTime),
+        "query_ms": {name: round(_time(query, 20)[0] * 1000, 4) for name, query in queries.items()},
+        "last_year": analytics.totals("daily", 365),
+        "hopper_level_machine0": analytics.hopperLevel("machine0")
+    }
+    return result
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[1:4]]
+    print(json.dumps(run(*arguments), indent=2))
@@ -0,0 +1,229 @@
+"""Minimal in-process MQTT 3.1.1 broker stand-in for load tests
+
+Supports what the feeders use: CONNECT with a last will, SUBSCRIBE and
+UNSUBSCRIBE with + and # wildcards, PUBLISH at QoS 0 and 1 (delivered at
+QoS 0), retained messages, PINGREQ and DISCONNECT. It is not meant to be
+a real broker: there are no persistent sessions and no authentication.
+"""
+import socket, socketserver, struct, threading
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+def topicMatches(topicFilter, topic):
+    filterParts = topicFilter.split("/")
+    topicParts = topic.split("/")
+    for index, part in enumerate(filterParts):
+        if part == "#":
+            return True
+        if index >= len(topicParts):
+            return False
+        if part != "+" and part != topicParts[index]:
+            return False
+    return len(filterParts) == len(topicParts)
+
+def _encodeLength(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length > 0:
+            byte |= 0x80
+        encoded.append(byte)
+        if length == 0:
+            return bytes(encoded)
+
+def _encodeString(value):
+    data = value.encode() if isinstance(value, str) else value
+    return struct.pack("!H", len(data)) + data
+
+def _readString(data, offset):
+    length = struct.unpack_from("!H", data, offset)[0]
+    return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+def publishPacket(topic, payload, retain = False):
+    body = _encodeString(topic) + payload
+    return bytes([(PUBLISH << 4) | (1 if retain else 0)]) + _encodeLength(len(body)) + body
+
+class _Session:
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.clientId = None
+        self.subscriptions = set()
+        self.will = None
+        self._sendLock = threading.Lock()
+
+    def send(self, packet):
+        with self._sendLock:
+            try:
+                self.sock.sendall(packet)
+            except OSError:
+                pass
+
+class _Handler(socketserver.BaseRequestHandler):
+    def _readExactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed")
+            data += chunk
+        return bytes(data)
+
+    def _readPacket(self):
+        header = self._readExactly(1)[0]
+        multiplier = 1
+        length = 0
+        while True:
+            byte = self._readExactly(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header >> 4, header & 0x0F, self._readExactly(length) if length else b""
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        broker = self.server.broker
+        session = _Session(broker, self.request)
+        cleanExit = False
+        try:
+            while True:
+                packetType, flags, body = self._readPacket()
+                with broker._lock:
+                    broker.received += 1
+                if packetType == CONNECT:
+                    self._connect(session, body)
+                elif packetType == PUBLISH:
+                    self._publish(session, flags, body)
+                elif packetType == SUBSCRIBE:
+                    self._subscribe(session, body)
+                elif packetType == UNSUBSCRIBE:
+                    packetId = body[:2]
+                    offset = 2
+                    while offset < len(body):
+                        topic, offset = _readString(body, offset)
+                        session.subscriptions.discard(topic.decode())
+                    session.send(bytes([UNSUBACK << 4, 2]) + packetId)
+                elif packetType == PINGREQ:
+                    session.send(bytes([PINGRESP << 4, 0]))
+                elif packetType == DISCONNECT:
+                    cleanExit = True
+                    break
+        except (ConnectionError, OSError, struct.error):
+            pass
+        finally:
+            broker._removeSession(session)
+            if not cleanExit and session.will is not None:
+                broker.publish(*session.will)
+
+    def _connect(self, session, body):
+        offset = 0
+        _, offset = _readString(body, offset)
+        offset += 1
+        connectFlags = body[offset]
+        offset += 3
+        clientId, offset = _readString(body, offset)
+        session.clientId = clientId.decode()
+        if connectFlags & 0x04:
+            willTopic, offset = _readString(body, offset)
+            willMessage, offset = _readString(body, offset)
+            session.will = (willTopic.decode(), willMessage, bool(connectFlags & 0x20))
+        self.server.broker._addSession(session)
+        session.send(bytes([CONNACK << 4, 2, 0, 0]))
+
+    def _publish(self, session, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic, offset = _readString(body, 0)
+        if qos > 0:
+            packetId = body[offset:offset + 2]
+            offset += 2
+            session.send(bytes([PUBACK << 4, 2]) + packetId)
+        self.server.broker.publish(topic.decode(), body[offset:], bool(flags & 0x01))
+
+    def _subscribe(self, session, body):
+        packetId = body[:2]
+        offset = 2
+        granted = bytearray()
+        topics = []
+        while offset < len(body):
+            topic, offset = _readString(body, offset)
+            qos = body[offset]
+            offset += 1
+            topics.append(topic.decode())
+            granted.append(min(qos, 1))
+        session.subscriptions.update(topics)
+        session.send(bytes([SUBACK << 4]) + _encodeLength(2 + len(granted)) + packetId + bytes(granted))
+        for topicFilter in topics:
+            for topic, payload in self.server.broker.retainedFor(topicFilter):
+                session.send(publishPacket(topic, payload, True))
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class Broker:
+    """Runs the broker on 127.0.0.1 in a background thread"""
+
+    def __init__(self, port = 0):
+        self.received = 0
+        self.delivered = 0
+        self._sessions = []
+        self._retained = {}
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), _Handler)
+        self._server.broker = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="Broker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            try:
+                session.sock.close()
+            except OSError:
+                pass
+
+    def _addSession(self, session):
+        with self._lock:
+            self._sessions.append(session)
+
+    def _removeSession(self, session):
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+
+    def retainedFor(self, topicFilter):
+        with self._lock:
+            return [(topic, payload) for topic, payload in self._retained.items() if topicMatches(topicFilter, topic)]
+
+    def publish(self, topic, payload, retain = False):
+        with self._lock:
+            if retain:
+                if payload:
+                    self._retained[topic] = payload
+                else:
+                    self._retained.pop(topic, None)
+            receivers = [session for session in self._sessions if any([topicMatches(topicFilter, topic) for topicFilter in session.subscriptions])]
+            self.delivered += len(receivers)
+        packet = publishPacket(topic, payload)
+        for session in receivers:
+            session.send(packet)
@@ -0,0 +1,53 @@
+"""Shared setup for the offline benchmarks
+
+Import this module before any app module: it puts app/ on the path, selects
+gpiozero's mock pin factory and speeds up the emulated motor.
+"""
+import os, sys, json, tempfile, logging
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, os.path.abspath(APP_DIR))
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+
+logging.basicConfig(level=logging.ERROR)
+
+from FeedingMachine import FeedingMachine
+
+def fastMotor(duration = 0.02, sensorArmDelay = 0.002, stopDelay = 0.001):
+    FeedingMachine.fakeMotorDuration = duration
+    FeedingMachine.sensorArmDelay = sensorArmDelay
+    FeedingMachine.stopDelay = stopDelay
+
+def makeConfig(machines = 1, directory = None, **overrides):
+    """Write a config.json with emulated machines and an unreachable broker, returns its path"""
+    with open(os.path.join(APP_DIR, "config.example.json"), "r") as f:
+        data = json.loads(f.read())
+    data["mqtt"]["host"] = "127.0.0.1"
+    data["manualFeedingButtonPort"] = None
+    data["statusLedPort"] = None
+    data["tracing"]["exportFile"] = None
+    data["notifications"]["enabled"] = False
+    data["feedingMachines"] = [{
+        "name": f"machine{index}",
+        "enabled": True,
+        "motorPort": None,
+        "motorSensorPort": None,
+        "foodSensorPortOut": None,
+        "foodSensorPortIn": None
+    } for index in range(machines)]
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix="catfeeder-bench-")
+    data["state"]["file"] = os.path.join(directory, "state.json")
+    data["analytics"]["file"] = os.path.join(directory, "analytics.bin")
+    data.update(overrides)
+    path = os.path.join(directory, "config.json")
+    with open(path, "w") as f:
+        f.write(json.dumps(data, indent=2))
+    return path
+
+def createFeeder(configFile):
+    from Config import Config
+    from CatFeeder import CatFeeder
+    feeder = CatFeeder()
+    feeder._reloadConfig(Config(configFile))
+    return feeder
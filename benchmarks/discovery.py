@@ -0,0 +1,66 @@
+"""Broker load caused by a discovery broadcast to a simulated fleet
+
+Every feeder gets an MQTTClient whose paho client only records publishes.
+One discovery message is delivered to all of them and the replies are
+counted per 10 ms bucket, with and without the response jitter.
+
+    python benchmarks/discovery.py [feeders]
+"""
+import common
+import sys, json, time, threading
+from types import SimpleNamespace
+from MQTTClient import MQTTClient, TOPIC_PREFIX
+
+BUCKET = 0.01
+
+class RecordingClient:
+    def __init__(self, published):
+        self.published = published
+
+    def publish(self, topic, payload = None, qos = 0, retain = False):
+        self.published.append(time.monotonic())
+
+def _fleet(size, jitter, published):
+    clients = []
+    for index in range(size):
+        config = SimpleNamespace(
+            mqtt={"host": "127.0.0.1", "discovery": {"fleetSize": size, "jitter": jitter}},
+            device={"id": f"feeder{index}", "name": f"Feeder {index}"}
+        )
+        client = MQTTClient(config, {})
+        client.client = RecordingClient(published)
+        client.connected = True
+        clients.append(client)
+    return clients
+
+def _broadcast(size, jitter):
+    published = []
+    clients = _fleet(size, jitter, published)
+    message = SimpleNamespace(topic=f"{TOPIC_PREFIX}/discovery", payload=b"{}")
+    started = time.monotonic()
+    for client in clients:
+        client._on_message(None, None, message)
+    deadline = time.monotonic() + jitter * size + 2
+    while len(published) < size and time.monotonic() < deadline:
+        time.sleep(0.01)
+    buckets = {}
+    for timestamp in published:
+        bucket = int((timestamp - started) / BUCKET)
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    return {
+        "replies": len(published),
+        "spread_s": round(max(published) - started, 3) if published else None,
+        "peak_per_10ms": max(buckets.values()) if buckets else 0,
+        "mean_per_second": round(len(published) / max(BUCKET, max(published) - started), 1) if published else 0
+    }
+
+def run(size = 200):
+    return {
+        "no_jitter": _broadcast(size, 0),
+        "jitter_5ms": _broadcast(size, 0.005),
+        "jitter_50ms": _broadcast(size, 0.05)
+    }
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(json.dumps(run(size), indent=2))
@@ -0,0 +1,73 @@
+"""Makespan and motor overlap of the FeedJob dispatch planner
+
+Runs one job on emulated machines with different dispatch settings and
+reports the job duration, the peak number of running motors and the peak
+number of motor starts within one inrush window.
+
+    python benchmarks/dispatch.py [machines] [portions]
+"""
+import common
+import sys, json, time, threading
+from FeedJob import FeedJob
+from FeedingMachine import FeedingMachine
+from EventBus import EventBus, MachineFailed, MachineSuccessful, MachineFinished, JobFinished
+
+INRUSH_WINDOW = 0.05
+
+def _simulate(machines, portions, concurrency = None, powerBudget = None, startStagger = 0):
+    bus = EventBus()
+    feedingMachines = [FeedingMachine(f"machine{index}", bus=bus) for index in range(machines)]
+    for machine in feedingMachines:
+        machine.power = 500
+    job = FeedJob(portions, None, feedingMachines, bus=bus)
+    job.concurrency = concurrency
+    job.powerBudget = powerBudget
+    job.startStagger = startStagger
+    done = threading.Event()
+    bus.subscriber("job", inline=True) \
+        .on(MachineFailed, lambda event: job.machineFailed(event.machine, event.error)) \
+        .on(MachineSuccessful, lambda event: job.machineSuccessful(event.machine)) \
+        .on(MachineFinished, lambda event: job.machineFinished(event.machine)) \
+        .on(JobFinished, lambda event: done.set())
+
+    starts = []
+    peak = [0]
+    def sample():
+        active = set()
+        while not done.is_set():
+            now = set([machine.name for machine in feedingMachines if machine.motorActive])
+            for name in now - active:
+                starts.append(time.monotonic())
+            active = now
+            peak[0] = max(peak[0], len(active))
+            time.sleep(0.0005)
+    sampler = threading.Thread(target=sample, daemon=True)
+
+    started = time.monotonic()
+    sampler.start()
+    job.feed()
+    done.wait(120)
+    makespan = time.monotonic() - started
+    sampler.join()
+    for machine in feedingMachines:
+        machine.closeAll()
+    inrush = max([len([other for other in starts if 0 <= other - start < INRUSH_WINDOW]) for start in starts] or [0])
+    return {
+        "makespan_s": round(makespan, 3),
+        "peak_motors": peak[0],
+        "peak_starts_in_window": inrush
+    }
+
+def run(machines = 4, portions = 3):
+    common.fastMotor(duration=0.2, sensorArmDelay=0.05, stopDelay=0.03)
+    return {
+        "parallel": _simulate(machines, portions),
+        "staggered": _simulate(machines, portions, startStagger=0.1),
+        "concurrency_2": _simulate(machines, portions, concurrency=2, startStagger=0.1),
+        "power_budget_1000": _simulate(machines, portions, powerBudget=1000, startStagger=0.1)
+    }
+
+if __name__ == "__main__":
+    machines = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    portions = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    print(json.dumps(run(machines, portions), indent=2))
@@ -0,0 +1,111 @@
+"""Publish cost and delivery latency of the internal event bus
+
+Measures what publish() costs the producing thread with different
+subscribers, against calling a handler directly, and the latency from
+publish to handler for events published at the rate of motor events, with
+and without a slow consumer and CPU load in other threads.
+
+    python benchmarks/events.py [events]
+"""
+import common
+import sys, json, time, threading
+from EventBus import EventBus, DROP_OLDEST, DROP_NEWEST, BLOCK, MachineRound
+
+def _noop(event):
+    pass
+
+def _slow(event):
+    # an MQTT publish or display write that takes a while
+    time.sleep(0.005)
+
+def _publishCost(bus, events):
+    machine = object()
+    best = None
+    for _ in range(5):
+        started = time.perf_counter()
+        for index in range(events):
+            bus.publish(MachineRound(machine, index, 3.0))
+        elapsed = (time.perf_counter() - started) / events
+        best = elapsed if best is None else min(best, elapsed)
+        # let the consumers catch up between repeats
+        time.sleep(0.05)
+    return round(best * 1000000, 3)
+
+def publishCost(events):
+    machine = object()
+    results = {}
+    best = None
+    for _ in range(5):
+        started = time.perf_counter()
+        for index in range(events):
+            _noop(MachineRound(machine, index, 3.0))
+        elapsed = (time.perf_counter() - started) / events
+        best = elapsed if best is None else min(best, elapsed)
+    results["direct_call_us"] = round(best * 1000000, 3)
+
+    # queues large enough that nothing is dropped, dropping would make publish look cheaper
+    setups = {
+        "no_subscribers": [],
+        "inline": [dict(inline=True)],
+        "queued": [dict(queueSize=events)],
+        "queued_drop_newest": [dict(overflow=DROP_NEWEST, queueSize=events)],
+        "queued_block": [dict(overflow=BLOCK, queueSize=events)],
+        "queued_3": [dict(queueSize=events), dict(queueSize=events), dict(queueSize=events)]
+    }
+    for name, subscribers in setups.items():
+        bus = EventBus()
+        for index, options in enumerate(subscribers):
+            bus.subscriber(f"s{index}", **options).on(MachineRound, _noop)
+        bus.start()
+        results[name + "_us"] = _publishCost(bus, events)
+        bus.stop()
+    return results
+
+def _burn(stopEvent):
+    payload = {"queue": {"depth": 0}, "lag": {"p99": 0.001}}
+    while not stopEvent.is_set():
+        json.loads(json.dumps(payload))
+
+def latency(events, slowConsumer = False, loadThreads = 0, interval = 0.001):
+    bus = EventBus()
+    fast = bus.subscriber("fast", 1024, DROP_OLDEST).on(MachineRound, _noop)
+    slow = None
+    if slowConsumer:
+        slow = bus.subscriber("slow", 64, DROP_OLDEST).on(MachineRound, _slow)
+    bus.start()
+    stopEvent = threading.Event()
+    threads = [threading.Thread(target=_burn, args=(stopEvent,), daemon=True) for _ in range(loadThreads)]
+    for thread in threads:
+        thread.start()
+    machine = object()
+    publishTimes = []
+    for index in range(events):
+        started = time.perf_counter()
+        bus.publish(MachineRound(machine, index, 3.0))
+        publishTimes.append(time.perf_counter() - started)
+        time.sleep(interval)
+    time.sleep(0.2)
+    stopEvent.set()
+    bus.stop()
+    publishTimes.sort()
+    result = {
+        "publish_p50_us": round(publishTimes[len(publishTimes) // 2] * 1000000, 3),
+        "publish_p99_us": round(publishTimes[int((len(publishTimes) - 1) * 0.99)] * 1000000, 3),
+        "fast": fast.statistics()
+    }
+    if slow is not None:
+        result["slow"] = slow.statistics()
+    return result
+
+def run(events = 2000):
+    return {
+        "publish_cost": publishCost(events * 10),
+        "latency": latency(events),
+        "latency_slow_consumer": latency(events, slowConsumer=True),
+        "latency_cpu_load": latency(events, loadThreads=4),
+        "latency_slow_consumer_cpu_load": latency(events, slowConsumer=True, loadThreads=4)
+    }
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(json.dumps(run(events), indent=2))
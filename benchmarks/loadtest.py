@@ -0,0 +1,168 @@
+"""Fleet load test against an in-process broker stand-in
+
+Starts N emulated feeders, each a complete CatFeeder with mocked GPIO, a
+loop:// serial port and emulated motors, connected to a local Broker. A
+driver publishes a mix of /feed, /status_request, /displaytest and
+discovery commands at a fixed rate and reports throughput, command to
+acknowledgement latency, threads and RSS per feeder.
+
+    python benchmarks/loadtest.py --feeders 10 --rate 50 --duration 20 \\
+        --mix feed=1,status_request=5,displaytest=2,discovery=0.1
+"""
+import common
+import argparse, json, random, threading, time, tempfile, uuid
+import psutil
+import paho.mqtt.client as mqtt
+from broker import Broker
+from MQTTClient import TOPIC_PREFIX
+from LagMonitor import percentiles
+
+class Driver:
+    def __init__(self, port, feederIds):
+        self.feederIds = feederIds
+        self.latencies = {"feed": [], "status_request": [], "discovery": []}
+        self.sent = {"feed": 0, "status_request": 0, "displaytest": 0, "discovery": 0}
+        self.received = 0
+        self._pendingFeeds = {}
+        self._pendingStatus = {feederId: [] for feederId in feederIds}
+        self._discoverySentAt = None
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self.client = mqtt.Client("loadtest-driver")
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.connect("127.0.0.1", port, 30)
+        self.client.loop_start()
+        self._connected.wait(10)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        client.subscribe(f"{TOPIC_PREFIX}/+/feed_result")
+        client.subscribe(f"{TOPIC_PREFIX}/+/status")
+        client.subscribe(f"{TOPIC_PREFIX}/discovery_response")
+        self._connected.set()
+
+    def _on_message(self, client, userdata, msg):
+        now = time.monotonic()
+        payload = json.loads(msg.payload.decode())
+        parts = msg.topic.split("/")
+        with self._lock:
+            self.received += 1
+            if msg.topic.endswith("/feed_result"):
+                sentAt = self._pendingFeeds.pop(payload.get("request_id"), None)
+                if sentAt is not None:
+                    self.latencies["feed"].append(now - sentAt)
+            elif msg.topic.endswith("/status"):
+                pending = self._pendingStatus.get(parts[1])
+                if pending:
+                    self.latencies["status_request"].append(now - pending.pop(0))
+            elif msg.topic.endswith("/discovery_response"):
+                if self._discoverySentAt is not None:
+                    self.latencies["discovery"].append(now - self._discoverySentAt)
+
+    def send(self, command):
+        feederId = random.choice(self.feederIds)
+        now = time.monotonic()
+        with self._lock:
+            self.sent[command] += 1
+            if command == "feed":
+                requestId = uuid.uuid4().hex
+                self._pendingFeeds[requestId] = now
+                topic, payload = f"{TOPIC_PREFIX}/{feederId}/feed", {"portions": 1, "request_id": requestId}
+            elif command == "status_request":
+                self._pendingStatus[feederId].append(now)
+                topic, payload = f"{TOPIC_PREFIX}/{feederId}/status_request", {}
+            elif command == "displaytest":
+                topic, payload = f"{TOPIC_PREFIX}/{feederId}/displaytest", {"method": 5, "params": [0]}
+            else:
+                self._discoverySentAt = now
+                topic, payload = f"{TOPIC_PREFIX}/discovery", {}
+        self.client.publish(topic, json.dumps(payload))
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+def _parseMix(mix):
+    weights = {}
+    for part in mix.split(","):
+        command, weight = part.split("=")
+        weights[command.strip()] = float(weight)
+    return weights
+
+def run(feeders = 10, rate = 50, duration = 20, mix = "feed=1,status_request=5,displaytest=2,discovery=0.1"):
+    common.fastMotor(duration=0.05, sensorArmDelay=0.01, stopDelay=0.01)
+    weights = _parseMix(mix)
+    process = psutil.Process()
+    broker = Broker().start()
+    directory = tempfile.mkdtemp(prefix="catfeeder-load-")
+    rssBefore = process.memory_info().rss
+    threadsBefore = threading.active_count()
+
+    fleet = []
+    for index in range(feeders):
+        configFile = common.makeConfig(1, tempfile.mkdtemp(dir=directory),
+            mqtt={"host": "127.0.0.1", "port": broker.port, "user": None, "pass": None, "discovery": {"fleetSize": feeders, "jitter": 0.005}},
+            device={"id": f"feeder{index}", "name": f"Feeder {index}", "config_url": None},
+            display={"port": "loop://"})
+        fleet.append(common.createFeeder(configFile))
+    deadline = time.monotonic() + 30
+    while not all([feeder.mqttClient.connected for feeder in fleet]) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.5)
+
+    running = threading.Event()
+    running.set()
+    def daemonLoop():
+        while running.is_set():
+            for feeder in fleet:
+                feeder.run()
+            time.sleep(1)
+    threading.Thread(target=daemonLoop, daemon=True).start()
+
+    rssFleet = process.memory_info().rss
+    threadsFleet = threading.active_count()
+    driver = Driver(broker.port, [f"feeder{index}" for index in range(feeders)])
+    commands = list(weights.keys())
+    started = time.monotonic()
+    sent = 0
+    peakThreads = threadsFleet
+    while time.monotonic() - started < duration:
+        driver.send(random.choices(commands, [weights[command] for command in commands])[0])
+        sent += 1
+        peakThreads = max(peakThreads, threading.active_count())
+        nextSend = started + sent / rate
+        time.sleep(max(0, nextSend - time.monotonic()))
+    elapsed = time.monotonic() - started
+    time.sleep(2)
+
+    rssAfter = process.memory_info().rss
+    running.clear()
+    driver.stop()
+    for feeder in fleet:
+        feeder._unload()
+    broker.stop()
+
+    return {
+        "feeders": feeders,
+        "duration_s": round(elapsed, 1),
+        "commands_sent": driver.sent,
+        "command_rate": round(sent / elapsed, 1),
+        "driver_messages_received": driver.received,
+        "broker_messages_in": broker.received,
+        "broker_messages_out": broker.delivered,
+        "latency_ms": {command: percentiles(samples, 1000, 2) for command, samples in driver.latencies.items()},
+        # the broker stand-in runs one thread per connected feeder
+        "threads_per_feeder": round((threadsFleet - threadsBefore - feeders) / feeders, 1),
+        "peak_threads": peakThreads,
+        "rss_per_feeder_kb": (rssFleet - rssBefore) // 1024 // feeders,
+        "rss_growth_under_load_kb": (rssAfter - rssFleet) // 1024
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CatFeeder fleet load test")
+    parser.add_argument("--feeders", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=50, help="commands per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--mix", default="feed=1,status_request=5,displaytest=2,discovery=0.1")
+    args = parser.parse_args()
+    print(json.dumps(run(args.feeders, args.rate, args.duration, args.mix), indent=2))
@@ -0,0 +1,70 @@
+"""RSS and allocations per feeding cycle
+
+Runs simulated feeds through a complete CatFeeder with emulated motors and
+reports the RSS growth and the net Python allocations per cycle.
+
+    python benchmarks/memory.py [feeds] [machines]
+"""
+import common
+import sys, gc, time, json, tracemalloc
+import psutil
+from Tracing import tracer
+
+def _bufferFill(feeder):
+    # a buffer that is full or does not grow any more is done
+    buffers = [tracer.spans, feeder.display.capture.records]
+    return [len(buffer) for buffer in buffers]
+
+def run(feeds = 10000, machines = 1):
+    common.fastMotor()
+    feeder = common.createFeeder(common.makeConfig(machines))
+    process = psutil.Process()
+    gc.collect()
+    gc.freeze()
+
+    # traced from the start, so an entry that replaces one in a full buffer
+    # frees what its predecessor took
+    tracemalloc.start(1)
+    # warm up, so caches, thread pools and the bounded span and UART capture
+    # buffers filling up do not count as growth
+    warmup = 0
+    while True:
+        filled = _bufferFill(feeder)
+        for _ in range(50):
+            feeder._feedPortions(1, "mqtt").wait(5)
+        warmup += 50
+        if _bufferFill(feeder) == filled:
+            break
+
+    gc.collect()
+    rssBefore = process.memory_info().rss
+    tracedBefore = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    failed = 0
+    for _ in range(feeds):
+        if feeder._feedPortions(1, "mqtt").wait(5) != "successful":
+            failed += 1
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    tracedAfter, tracedPeak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rssAfter = process.memory_info().rss
+    feeder._unload()
+
+    return {
+        "feeds": feeds,
+        "machines": machines,
+        "warmup_feeds": warmup,
+        "failed": failed,
+        "seconds": round(elapsed, 2),
+        "rss_before_kb": rssBefore // 1024,
+        "rss_after_kb": rssAfter // 1024,
+        "rss_growth_per_feed_bytes": round((rssAfter - rssBefore) / feeds, 1),
+        "traced_growth_per_feed_bytes": round((tracedAfter - tracedBefore) / feeds, 1),
+        "traced_peak_kb": tracedPeak // 1024
+    }
+
+if __name__ == "__main__":
+    feeds = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    machines = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    print(json.dumps(run(feeds, machines), indent=2))
@@ -0,0 +1,63 @@
+"""Motor stop overshoot and portion size under CPU load
+
+Feeds with emulated motors while background threads keep the interpreter
+busy with MQTT-like JSON traffic, UART frame encoding, logging and garbage
+collection, and reports how far past the intended stop time the motor was
+stopped and how much the portion size varies. Each feed is two portions,
+the rotation time is only learned between the sensor edges of a sequence.
+The drift runs slow the emulated motor down halfway, with and without a
+nominal rotation time to scale the stop delay with.
+
+    python benchmarks/motor_jitter.py [feeds] [loadThreads]
+"""
+import common
+import os, sys, json, time, threading, logging, tempfile
+from FeedingMachine import FeedingMachine
+
+def _load(stopEvent, logFile):
+    from Display import Display
+    loadLogger = logging.getLogger("load")
+    loadLogger.propagate = False
+    loadLogger.addHandler(logging.FileHandler(logFile))
+    loadLogger.setLevel(logging.DEBUG)
+    status = {"last_feed": "2024-01-01T08:00:00+01:00", "queue": {"depth": 0}, "lag": {"p99": 0.001}}
+    frames = []
+    while not stopEvent.is_set():
+        payload = json.dumps(status)
+        json.loads(payload)
+        line = Display.displayAddress + [9, 6, 0, 0, 0, 12, 30, 0]
+        line.append(sum(line) & 0xFF)
+        frames.append(bytearray(line))
+        if len(frames) > 1000:
+            frames = []
+        loadLogger.debug(f"published {payload}")
+
+def run(feeds = 200, loadThreads = 4, motorProcess = False, drift = None, nominalRotationTime = None, portions = 2):
+    common.fastMotor(duration=0.05, sensorArmDelay=0.01, stopDelay=0.02)
+    directory = tempfile.mkdtemp(prefix="catfeeder-jitter-")
+    configFile = common.makeConfig(1, directory, motorProcess={"enabled": motorProcess, "priority": 50})
+    feeder = common.createFeeder(configFile)
+    machine = feeder.feedingMachines[0]
+    if not motorProcess:
+        machine.nominalRotationTime = nominalRotationTime
+    stopEvent = threading.Event()
+    threads = [threading.Thread(target=_load, args=(stopEvent, os.path.join(directory, "load.log")), daemon=True) for _ in range(loadThreads)]
+    for thread in threads:
+        thread.start()
+    for index in range(feeds):
+        if drift != None and index == feeds // 2:
+            FeedingMachine.fakeMotorDuration *= drift
+        feeder._feedPortions(portions, "mqtt").wait(10)
+    stopEvent.set()
+    feeder._unload()
+    return machine.stats.statistics()
+
+if __name__ == "__main__":
+    feeds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    loadThreads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print(json.dumps({
+        "in_process": run(feeds, loadThreads, False),
+        "motor_process": run(feeds, loadThreads, True),
+        "drift": run(feeds, loadThreads, False, 1.3),
+        "drift_nominal_rotation_time": run(feeds, loadThreads, False, 1.3, 0.05)
+    }, indent=2))
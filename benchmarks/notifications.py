@@ -0,0 +1,55 @@
+"""Cost of a notification on the motor thread and delivery to local sinks
+
+Sends a burst of failure notifications through a NotificationDispatcher
+with the SMTP relay and webhook stand-ins. Reports the time notify() takes
+on the calling thread, what arrived at the sinks, how many connections
+were opened and how the burst was folded into digests.
+
+    python benchmarks/notifications.py [notifications] [rateLimit]
+"""
+import common
+import sys, json, time
+from relays import SmtpRelay, WebhookServer
+from Notification import Notification, NotificationDispatcher, SmtpSink, WebhookSink
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[int((len(ordered) - 1) * fraction)]
+
+def run(count = 200, rateLimit = 0.5):
+    relay = SmtpRelay().start()
+    webhook = WebhookServer().start()
+    sinks = [
+        SmtpSink({"host": "127.0.0.1", "port": relay.port, "to": ["root@localhost"]}),
+        WebhookSink({"url": f"http://127.0.0.1:{webhook.port}/alert"})
+    ]
+    dispatcher = NotificationDispatcher(sinks, queueSize=count, rateLimit=rateLimit)
+    dispatcher.start()
+    costs = []
+    for index in range(count):
+        code = "blocked" if index % 2 else "empty"
+        notification = Notification(code, f"machine{index % 4} {code}", "Motor took too long", "bench", f"machine{index % 4}")
+        started = time.perf_counter()
+        dispatcher.notify(notification)
+        costs.append(time.perf_counter() - started)
+        time.sleep(0.001)
+    time.sleep(rateLimit + 0.5)
+    dispatcher.stop()
+    relay.stop()
+    webhook.stop()
+    return {
+        "notifications": count,
+        "notify_us_p50": round(_percentile(costs, 0.5) * 1e6, 2),
+        "notify_us_p99": round(_percentile(costs, 0.99) * 1e6, 2),
+        "stats": dispatcher.metrics(),
+        "smtp_messages": len(relay.messages),
+        "smtp_connections": relay.connections,
+        "webhook_messages": len(webhook.messages),
+        "webhook_connections": webhook.connections,
+        "notifications_in_digests": sum([message["count"] for message in webhook.messages])
+    }
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rateLimit = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    print(json.dumps(run(count, rateLimit), indent=2))
@@ -0,0 +1,106 @@
+"""Local SMTP relay and webhook stand-ins for the notification benchmark
+
+Both count connections and received messages, so connection reuse can be
+checked. The SMTP relay speaks just enough SMTP for smtplib: HELO/EHLO,
+MAIL, RCPT, DATA, RSET, NOOP and QUIT, without authentication or TLS.
+"""
+import json, socketserver, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        relay = self.server.relay
+        with relay._lock:
+            relay.connections += 1
+        self._reply("220 localhost stand-in")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self._reply("250 localhost")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b".\r\n":
+                        break
+                    lines.append(data)
+                with relay._lock:
+                    relay.messages.append(b"".join(lines).decode(errors="replace"))
+                self._reply("250 OK queued")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class SmtpRelay:
+    """Runs the SMTP stand-in on 127.0.0.1 in a background thread"""
+
+    def __init__(self, port = 0):
+        self.connections = 0
+        self.messages = []
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), _SmtpHandler)
+        self._server.relay = self
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="SmtpRelay", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super(_WebhookHandler, self).setup()
+        with self.server.webhook._lock:
+            self.server.webhook.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.webhook._lock:
+            self.server.webhook.messages.append(json.loads(body))
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class WebhookServer:
+    """Runs an HTTP/1.1 server on 127.0.0.1 that accepts JSON POSTs"""
+
+    def __init__(self, port = 0):
+        self.connections = 0
+        self.messages = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _WebhookHandler)
+        self._server.daemon_threads = True
+        self._server.webhook = self
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="Webhook", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,109 @@
+"""Threaded main loop against the asyncio runtime
+
+Runs one feeder with the display on a pseudo terminal (so the asyncio
+runtime can watch its fd) against the broker stand-in, first with the
+threaded main loop and then on the AsyncRuntime. Sends status requests,
+feed commands and panel frames, and reports the command to answer latency
+and the threads the feeder runs.
+
+    python benchmarks/runtime.py [requests]
+"""
+import common
+import os, sys, json, time, threading
+from broker import Broker
+from loadtest import Driver
+from Config import Config
+from CatFeeder import CatFeeder
+from AsyncRuntime import AsyncRuntime
+from LagMonitor import percentiles
+
+def _panelFrame(method, data):
+    line = [255, 255, method, len(data)] + data
+    return bytes(line + [sum(line) & 0xFF])
+
+def _configFile(broker):
+    master, slave = os.openpty()
+    configFile = common.makeConfig(1,
+        mqtt={"host": "127.0.0.1", "port": broker.port, "user": None, "pass": None},
+        device={"id": "runtime", "name": "Runtime", "config_url": None},
+        display={"port": os.ttyname(slave)})
+    return configFile, master
+
+def _feederThreads(harness):
+    # leave out the benchmark's own threads and the broker's connection handlers
+    return sorted(thread.name for thread in threading.enumerate()
+        if thread not in harness and "process_request_thread" not in thread.name)
+
+def _drive(feeder, driver, master, requests, result, harness):
+    deadline = time.monotonic() + 30
+    while not (feeder.mqttClient != None and feeder.mqttClient.connected) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.5)
+    panelAnswers = []
+    for index in range(requests):
+        driver.send("status_request")
+        time.sleep(0.02)
+        if index % 10 == 0:
+            driver.send("feed")
+        started = time.monotonic()
+        os.write(master, _panelFrame(5, [0]))
+        while time.monotonic() - started < 1:
+            try:
+                if os.read(master, 64):
+                    panelAnswers.append(time.monotonic() - started)
+                    break
+            except BlockingIOError:
+                time.sleep(0.0005)
+    time.sleep(1)
+    result["threads"] = _feederThreads(harness)
+    result["status_request_ms"] = percentiles(driver.latencies["status_request"], 1000, 2)
+    result["feed_ms"] = percentiles(driver.latencies["feed"], 1000, 2)
+    result["panel_answer_ms"] = percentiles(panelAnswers, 1000, 2)
+
+def runThreaded(broker, requests):
+    configFile, master = _configFile(broker)
+    os.set_blocking(master, False)
+    driver = Driver(broker.port, ["runtime"])
+    harness = set(threading.enumerate())
+    feeder = common.createFeeder(configFile)
+    result = {}
+    _drive(feeder, driver, master, requests, result, harness)
+    feeder._unload()
+    driver.stop()
+    return result
+
+def runAsync(broker, requests):
+    configFile, master = _configFile(broker)
+    os.set_blocking(master, False)
+    driver = Driver(broker.port, ["runtime"])
+    feeder = CatFeeder()
+    feeder.config = Config(configFile)
+    feeder.runtime = AsyncRuntime(feeder)
+    result = {}
+
+    def drive():
+        while feeder.eventLoop is None:
+            time.sleep(0.01)
+        _drive(feeder, driver, master, requests, result, harness)
+        feeder.runtime.stop()
+
+    driveThread = threading.Thread(target=drive, daemon=True)
+    harness = set(threading.enumerate()) | {driveThread}
+    driveThread.start()
+    feeder.runtime.run()
+    driver.stop()
+    return result
+
+def run(requests = 200):
+    common.fastMotor(duration=0.05, sensorArmDelay=0.01, stopDelay=0.01)
+    broker = Broker().start()
+    result = {
+        "threaded": runThreaded(broker, requests),
+        "asyncio": runAsync(broker, requests)
+    }
+    broker.stop()
+    return result
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(json.dumps(run(requests), indent=2))
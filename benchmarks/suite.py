@@ -0,0 +1,186 @@
+"""Micro and macro benchmarks of the daemon hot paths
+
+Runs offline with mocked GPIO, a discarding serial port, the broker
+stand-in and emulated motors. Results are written as JSON; when a baseline
+is given every benchmark that got slower than its threshold is reported
+and the exit code is 1.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --baseline baseline.json --threshold 0.25
+    python benchmarks/suite.py --save-baseline baseline.json
+"""
+import common
+import argparse, json, platform, sys, time, gc
+from types import SimpleNamespace
+from broker import Broker
+
+# noisy benchmarks get more room before they count as a regression
+THRESHOLDS = {
+    "reload_config": 0.5,
+    "feed_job_1": 0.5,
+    "feed_job_2": 0.5,
+    "feed_job_4": 0.5,
+    "feed_job_8": 0.5
+}
+
+class NullSerial:
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+def measure(function, number, repeat = 5):
+    """Best time per call over repeat runs of number calls"""
+    gc.collect()
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = (time.perf_counter() - started) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return {"seconds_per_op": best, "ops_per_s": round(1 / best, 1) if best else None, "calls": number * repeat}
+
+def _display(feeder):
+    display = feeder.display
+    display.ser = NullSerial()
+    return display
+
+def benchDisplay(feeder, scale):
+    display = _display(feeder)
+    results = {}
+    results["display_send_signal"] = measure(lambda: display.sendSignal(9, [0, 0, 0, 12, 30, 15]), 20000 * scale)
+    results["display_send_feeding_jobs"] = measure(display.sendFeedingJobs, 200 * scale)
+    data = [0, 0, 0, 0, 0, 0]
+    checksum = sum(display.ownAddress + [9, len(data)] + data) & 0xFF
+    results["display_validate_input"] = measure(lambda: display._validateInput(9, len(data), data, checksum), 20000 * scale)
+    return results
+
+def benchMqtt(feeder, scale):
+    client = feeder.mqttClient
+    published = []
+    # only count what would be published, the broker round trip is not part of the dispatch
+    client.client.publish = lambda topic, payload=None, qos=0, retain=False: published.append(topic)
+    client.connected = True
+    client.feeding_callback = lambda portions, requestId: None
+    client.displaytest_callback = lambda method, params: None
+    prefix = f"cat_feeder/{client.feeder_id}"
+    messages = [
+        SimpleNamespace(topic=f"{prefix}/feed", payload=b'{"portions": 2, "request_id": "bench"}'),
+        SimpleNamespace(topic=f"{prefix}/status_request", payload=b'{}'),
+        SimpleNamespace(topic=f"{prefix}/displaytest", payload=b'{"method": 5, "params": [0]}')
+    ]
+    def dispatch():
+        for message in messages:
+            client._on_message(None, None, message)
+        published.clear()
+    results = {}
+    results["mqtt_on_message"] = measure(dispatch, 2000 * scale)
+    results["status_payload"] = measure(client.status_callback, 2000 * scale)
+    results["status_payload_json"] = measure(lambda: json.dumps(client.status_callback()), 2000 * scale)
+    return results
+
+def benchScheduler(feeder, scale):
+    return {
+        "next_run_lookup": measure(lambda: min(feeder.scheduler.get_jobs('feeding')).next_run, 20000 * scale),
+        "time_until_next_feeding": measure(feeder._timeUntilNextFeeding, 20000 * scale)
+    }
+
+def benchReload(feeder, scale):
+    return {"reload_config": measure(lambda: feeder._reloadConfig(feeder.config), 2 * scale, repeat=3)}
+
+def benchFeedJobs(scale, maxMachines):
+    from FeedJob import FeedJob
+    from FeedingMachine import FeedingMachine
+    from EventBus import EventBus, MachineFailed, MachineSuccessful, MachineFinished, JobFinished
+    results = {}
+    machines = 1
+    while machines <= maxMachines:
+        # one bus for all jobs, like the daemon
+        bus = EventBus()
+        feedingMachines = [FeedingMachine(f"machine{index}", bus=bus) for index in range(machines)]
+        current = {}
+        bus.subscriber("job", inline=True) \
+            .on(MachineFailed, lambda event: current["job"].machineFailed(event.machine, event.error)) \
+            .on(MachineSuccessful, lambda event: current["job"].machineSuccessful(event.machine)) \
+            .on(MachineFinished, lambda event: current["job"].machineFinished(event.machine)) \
+            .on(JobFinished, lambda event: current["done"].append(True))
+        def feed():
+            current["job"] = FeedJob(2, None, feedingMachines, bus=bus)
+            current["done"] = done = []
+            current["job"].feed()
+            while not done:
+                time.sleep(0.0005)
+        results[f"feed_job_{machines}"] = measure(feed, 3 * scale, repeat=3)
+        for machine in feedingMachines:
+            machine.closeAll()
+        machines *= 2
+    return results
+
+def run(scale = 1, maxMachines = 8):
+    common.fastMotor()
+    broker = Broker().start()
+    configFile = common.makeConfig(1, mqtt={"host": "127.0.0.1", "port": broker.port, "user": None, "pass": None}, display={"port": "/nonexistent"})
+    feeder = common.createFeeder(configFile)
+    results = {}
+    results.update(benchDisplay(feeder, scale))
+    results.update(benchMqtt(feeder, scale))
+    results.update(benchScheduler(feeder, scale))
+    results.update(benchReload(feeder, scale))
+    feeder._unload()
+    results.update(benchFeedJobs(scale, maxMachines))
+    broker.stop()
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "node": platform.node(),
+            "scale": scale
+        },
+        "results": results
+    }
+
+def compare(current, baseline, threshold):
+    regressions = []
+    lines = []
+    for name, result in sorted(current["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            lines.append(f"{name:30} {result['seconds_per_op'] * 1e6:12.2f} us   (new)")
+            continue
+        change = result["seconds_per_op"] / base["seconds_per_op"] - 1
+        limit = THRESHOLDS.get(name, threshold)
+        marker = ""
+        if change > limit:
+            marker = "  REGRESSION"
+            regressions.append(name)
+        lines.append(f"{name:30} {result['seconds_per_op'] * 1e6:12.2f} us {change * 100:+7.1f}%{marker}")
+    return regressions, "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CatFeeder benchmark suite")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--save-baseline", help="write the results as a new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument("--scale", type=int, default=1, help="multiply the number of iterations")
+    parser.add_argument("--machines", type=int, default=8, help="largest number of machines for the FeedJob benchmark")
+    args = parser.parse_args()
+
+    current = run(args.scale, args.machines)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(json.dumps(current, indent=2))
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.loads(f.read())
+        regressions, report = compare(current, baseline, args.threshold)
+        print(report)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        print(json.dumps(current, indent=2))
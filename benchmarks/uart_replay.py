@@ -0,0 +1,50 @@
+"""Display protocol parser throughput on a synthetic UART capture
+
+Builds a capture of panel requests (status, time, schedule, recording and
+an unknown method), with noise bytes, frames split over several reads and
+a corrupted checksum, each followed by an answer 5 ms later. The capture
+is written to a file, read back and replayed as fast as possible.
+
+    python benchmarks/uart_replay.py [frames]
+"""
+import common
+import os, sys, json, random, tempfile
+from UartCapture import writeCapture, readCapture, RX, TX
+from UartReplay import replay
+from Display import Display
+
+REQUESTS = [(5, [0]), (9, [0, 0, 0, 0, 0, 0]), (9, [255]), (2, [0]), (17, [255]), (17, [0]), (18, [0]), (99, [1])]
+
+def _frame(method, data, corrupt = False):
+    line = Display.ownAddress + [method, len(data)] + data
+    checksum = sum(line) & 0xFF
+    return bytes(line + [(checksum + 1) & 0xFF if corrupt else checksum])
+
+def buildCapture(frames, seed = 1):
+    random.seed(seed)
+    records = []
+    timestamp = 0
+    for index in range(frames):
+        method, data = REQUESTS[index % len(REQUESTS)]
+        frame = _frame(method, data, corrupt=index % 97 == 0)
+        if index % 13 == 0:
+            frame = bytes([1, 2, 3]) + frame
+        split = random.randint(1, len(frame))
+        for part in (frame[:split], frame[split:]):
+            if part:
+                records.append((RX, timestamp, part))
+                timestamp += 1000000
+        records.append((TX, timestamp + 5000000, bytes([255, 252, 5, 1, 0, 1])))
+        timestamp += 20000000
+    return records
+
+def run(frames = 20000):
+    path = os.path.join(tempfile.mkdtemp(prefix="catfeeder-uart-"), "capture.bin")
+    writeCapture(path, buildCapture(frames))
+    result = replay(readCapture(path))
+    result["capture_bytes"] = os.path.getsize(path)
+    return result
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(json.dumps(run(frames), indent=2))
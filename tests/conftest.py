@@ -0,0 +1,8 @@
+import os, sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, os.path.abspath(APP_DIR))
+# the broker, SMTP relay and webhook stand-ins of the benchmarks
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+sys.path.append(os.path.abspath(BENCHMARKS_DIR))
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
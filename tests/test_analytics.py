@@ -0,0 +1,85 @@
+import time
+from Analytics import Analytics, Rollup, RESOLUTIONS, EVENT, EVENT_PORTION, EVENT_FINISH, METRICS, PORTIONS, RETRIES
+
+DAY = 86400
+
+def test_rollup_totals_and_series():
+    rollup = Rollup(4)
+    rollup.add(10, PORTIONS, 1)
+    rollup.add(10, PORTIONS, 2)
+    rollup.add(12, RETRIES, 1)
+    assert rollup.total(9, 12)[PORTIONS] == 3
+    assert rollup.total(11, 12)[PORTIONS] == 0
+    assert [(key, values[PORTIONS], values[RETRIES]) for key, values in rollup.series(10, 12)] == [(10, 3, 0), (11, 0, 0), (12, 0, 1)]
+
+def test_rollup_reuses_stale_slots():
+    rollup = Rollup(4)
+    rollup.add(1, PORTIONS, 5)
+    rollup.add(5, PORTIONS, 1)
+    assert rollup.total(5, 5)[PORTIONS] == 1
+    # bucket 1 is no longer in the ring
+    assert rollup.total(1, 1)[PORTIONS] == 0
+    assert rollup.total(2, 5)[PORTIONS] == 1
+
+def test_rollup_ignores_events_older_than_the_slot():
+    rollup = Rollup(4)
+    rollup.add(5, PORTIONS, 1)
+    rollup.add(1, PORTIONS, 7)
+    assert rollup.epochs[1] == 5
+    assert rollup.total(2, 5)[PORTIONS] == 1
+
+def test_rollup_range_wraps_around_the_ring():
+    rollup = Rollup(4)
+    for key in range(3, 8):
+        rollup.add(key, PORTIONS, key)
+    assert rollup.total(0, 7)[PORTIONS] == 4 + 5 + 6 + 7
+
+def _history(events):
+    return b"".join([EVENT.pack(timestamp, event, machine.encode(), value) for timestamp, event, machine, value in events])
+
+def test_rebuild_from_history():
+    now = time.time()
+    analytics = Analytics()
+    history = _history([
+        (now - 2 * DAY, EVENT_PORTION, "Links", 3.0),
+        (now, EVENT_PORTION, "Links", 3.5),
+        (now, EVENT_PORTION, "Rechts", 4.0),
+        (now, EVENT_FINISH, "Links", 1)
+    ])
+    # a torn last record is ignored
+    assert analytics.rebuild(history + b"\x01\x02") == 4
+    totals = analytics.totals("daily", 1, "Links")
+    assert (totals["portions"], totals["retries"], totals["sequences"], totals["mean_rotation_time"]) == (1, 1, 1, 3.5)
+    assert analytics.totals("daily", 3)["portions"] == 3
+    assert [bucket["portions"] for bucket in analytics.series("daily", 3, "Links")] == [1, 0, 1]
+    assert analytics.sinceRefill == {"Links": 2, "Rechts": 1}
+
+def test_rebuild_keeps_newer_buckets_for_out_of_order_history():
+    now = time.time()
+    size = RESOLUTIONS["daily"]
+    analytics = Analytics()
+    # the old event maps to the same daily slot as today's one and comes after it
+    analytics.rebuild(_history([
+        (now, EVENT_PORTION, "Links", 3.0),
+        (now - size * DAY, EVENT_PORTION, "Links", 3.0)
+    ]))
+    assert analytics.totals("daily", 1, "Links")["portions"] == 1
+
+def test_rebuild_replaces_the_rollups():
+    now = time.time()
+    analytics = Analytics()
+    analytics.recordPortion("Links", 3.0, now)
+    analytics.rebuild(_history([(now, EVENT_PORTION, "Rechts", 3.0)]))
+    assert list(analytics.rollups) == ["Rechts"]
+    assert len(METRICS) == len(analytics.rollups["Rechts"][0].values)
+
+def test_history_survives_a_restart(tmp_path):
+    file = str(tmp_path / "lib" / "analytics.bin")
+    analytics = Analytics(file)
+    analytics.open()
+    analytics.recordPortion("Links", 3.0)
+    analytics.close()
+    analytics = Analytics(file)
+    analytics.open()
+    analytics.close()
+    assert analytics.totals("daily", 1, "Links")["portions"] == 1
@@ -0,0 +1,122 @@
+import os, json, time, signal, threading
+import common
+from broker import Broker
+from Config import Config
+from Display import Display
+from CatFeeder import CatFeeder
+from AsyncRuntime import AsyncRuntime
+
+def _waitFor(predicate, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+def _panelFrame(method, data):
+    line = [255, 255, method, len(data)] + data
+    return bytes(line + [sum(line) & 0xFF])
+
+def _run(tmp_path, actions):
+    """Runs a feeder on the AsyncRuntime until actions returned, then stops it with SIGTERM"""
+    common.fastMotor(duration=0.05, sensorArmDelay=0.01, stopDelay=0.01)
+    broker = Broker().start()
+    master, slave = os.openpty()
+    os.set_blocking(master, False)
+    configFile = common.makeConfig(1, str(tmp_path),
+        mqtt={"host": "127.0.0.1", "port": broker.port, "user": None, "pass": None, "presence": True},
+        device={"id": "runtime", "name": "Runtime", "config_url": None},
+        display={"port": os.ttyname(slave)})
+    feeder = CatFeeder()
+    feeder.config = Config(configFile)
+    feeder.runtime = AsyncRuntime(feeder)
+    errors = []
+
+    def drive():
+        if not _waitFor(lambda: feeder.eventLoop is not None):
+            return
+        try:
+            assert _waitFor(lambda: feeder.mqttClient is not None and feeder.mqttClient.connected)
+            actions(feeder, master, configFile)
+        except BaseException as err:
+            errors.append(err)
+        finally:
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    driveThread = threading.Thread(target=drive, daemon=True)
+    driveThread.start()
+    try:
+        feeder.runtime.run()
+        driveThread.join(5)
+    finally:
+        broker.stop()
+        os.close(master)
+        os.close(slave)
+    if errors:
+        raise errors[0]
+    return feeder, broker
+
+def test_sigterm_shuts_down(tmp_path):
+    feeder, broker = _run(tmp_path, lambda feeder, master, configFile: None)
+    assert feeder.eventLoop is None and feeder.runtime.displayExecutor is None
+    (topic, payload), = broker.retainedFor("cat_feeder/runtime/presence")
+    assert json.loads(payload)["state"] == "offline"
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith(("CatFeederWorker", "CatFeederDisplay"))]
+
+def test_sighup_reloads_the_configuration(tmp_path):
+    def actions(feeder, master, configFile):
+        assert len(feeder.scheduler.get_jobs("feeding")) == 5
+        with open(configFile, "r") as f:
+            data = json.loads(f.read())
+        data["schedule"] = [{"time": "07:30:00", "portions": 1}]
+        with open(configFile, "w") as f:
+            f.write(json.dumps(data))
+        os.kill(os.getpid(), signal.SIGHUP)
+        assert _waitFor(lambda: len(feeder.scheduler.get_jobs("feeding")) == 1)
+        assert not feeder.isReloadSignal
+
+    feeder, broker = _run(tmp_path, actions)
+    assert feeder.config.schedule == [{"time": "07:30:00", "portions": 1}]
+
+def test_sigusr1_feeds_a_portion(tmp_path):
+    def actions(feeder, master, configFile):
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert _waitFor(lambda: feeder.lastJob is not None and not feeder.jobIsRunning)
+
+    feeder, broker = _run(tmp_path, actions)
+    assert feeder.lastJob.portions == 1
+    assert feeder.lastJobStatus == "successful"
+
+def test_panel_frames_are_handled_on_the_display_thread(tmp_path, monkeypatch):
+    threads = []
+    handleFrame = Display._handleFrame
+
+    def recordThread(self, *frame):
+        threads.append(threading.current_thread().name)
+        return handleFrame(self, *frame)
+
+    monkeypatch.setattr(Display, "_handleFrame", recordThread)
+
+    def actions(feeder, master, configFile):
+        # the feeder talks to the panel at startup, leave that out
+        time.sleep(0.2)
+        while True:
+            try:
+                if not os.read(master, 1024):
+                    break
+            except BlockingIOError:
+                break
+        for _ in range(3):
+            os.write(master, _panelFrame(5, [0]))
+        answers = bytearray()
+
+        def answered():
+            try:
+                answers.extend(os.read(master, 1024))
+            except BlockingIOError:
+                pass
+            return len(threads) == 3 and answers
+
+        assert _waitFor(answered)
+
+    _run(tmp_path, actions)
+    assert set(threads) == {"CatFeederDisplay_0"}
@@ -0,0 +1,92 @@
+import json, pytest
+from Config import Config, ConfigError, applyPatch, atomicWrite
+
+BASE = {
+    "schedule": [{"time": "08:00:00", "portions": 2}],
+    "loglevel": "INFO",
+    "feedingMachines": [{"name": "Links", "enabled": True, "motorPort": 17, "motorSensorPort": 23, "foodSensorPortOut": 5, "foodSensorPortIn": 6}],
+    "manualFeedingButtonPort": 16,
+    "statusLedPort": 25,
+    "mqtt": {"host": "localhost"},
+    "device": {"id": "links"},
+    "version": 3
+}
+
+def _config(tmp_path, data = BASE):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(data))
+    return Config(str(path))
+
+def _error(function, *args):
+    with pytest.raises(ConfigError) as info:
+        function(*args)
+    return info.value.code
+
+def test_patch_operations_on_a_copy():
+    document = {"a": {"b": 1}, "list": [1, 2]}
+    patched = applyPatch(document, [
+        {"op": "test", "path": "/a/b", "value": 1},
+        {"op": "replace", "path": "/a/b", "value": 2},
+        {"op": "add", "path": "/a/c", "value": 3},
+        {"op": "add", "path": "/list/0", "value": 0},
+        {"op": "add", "path": "/list/-", "value": 3},
+        {"op": "remove", "path": "/list/1"}
+    ])
+    assert patched == {"a": {"b": 2, "c": 3}, "list": [0, 2, 3]}
+    assert document == {"a": {"b": 1}, "list": [1, 2]}
+
+def test_patch_escaped_pointer():
+    assert applyPatch({"a/b": 1, "c~d": 2}, [{"op": "remove", "path": "/a~1b"}, {"op": "replace", "path": "/c~0d", "value": 3}]) == {"c~d": 3}
+
+def test_patch_errors():
+    document = {"a": 1, "list": []}
+    assert _error(applyPatch, document, [{"op": "test", "path": "/a", "value": 2}]) == "test_failed"
+    assert _error(applyPatch, document, [{"op": "replace", "path": "/missing", "value": 1}]) == "invalid_patch"
+    assert _error(applyPatch, document, [{"op": "remove", "path": "/list/0"}]) == "invalid_patch"
+    assert _error(applyPatch, document, [{"op": "move", "path": "/a", "from": "/b"}]) == "invalid_patch"
+    assert _error(applyPatch, document, [{"op": "replace", "path": "", "value": {}}]) == "invalid_patch"
+    assert _error(applyPatch, document, [{"op": "add", "path": "a", "value": 1}]) == "invalid_patch"
+
+def test_build_update_from_patch(tmp_path):
+    config = _config(tmp_path)
+    data = config.buildUpdate({"version": 4, "base_version": 3, "patch": [{"op": "replace", "path": "/schedule/0/portions", "value": 1}]})
+    assert data["version"] == 4
+    assert data["schedule"] == [{"time": "08:00:00", "portions": 1}]
+    assert config.data["schedule"][0]["portions"] == 2
+
+def test_build_update_from_config(tmp_path):
+    config = _config(tmp_path)
+    data = config.buildUpdate({"version": 5, "config": dict(BASE, loglevel="DEBUG")})
+    assert data["version"] == 5 and data["loglevel"] == "DEBUG"
+
+def test_build_update_rejections(tmp_path):
+    config = _config(tmp_path)
+    assert _error(config.buildUpdate, {"version": "4", "config": BASE}) == "invalid_update"
+    assert _error(config.buildUpdate, {"version": 3, "config": BASE}) == "outdated"
+    assert _error(config.buildUpdate, {"version": 4, "base_version": 2, "patch": []}) == "version_conflict"
+    assert _error(config.buildUpdate, {"version": 4}) == "invalid_update"
+    assert _error(config.buildUpdate, {"version": 4, "base_version": 3, "patch": [{"op": "remove", "path": "/device"}]}) == "invalid_config"
+
+@pytest.mark.parametrize("change", [
+    {"schedule": {}},
+    {"schedule": [{"time": "24:00", "portions": 1}]},
+    {"schedule": [{"time": "08:00", "portions": -1}]},
+    {"feedingMachines": [{"name": "Links"}]},
+    {"feedingMachines": [BASE["feedingMachines"][0], BASE["feedingMachines"][0]]},
+    {"device": {"name": "no id"}}
+])
+def test_validate_rejects(change):
+    assert _error(Config.validate, dict(BASE, **change)) == "invalid_config"
+
+def test_write_config_replaces_the_file(tmp_path):
+    config = _config(tmp_path)
+    config.writeConfig(dict(BASE, version=9))
+    assert json.loads((tmp_path / "config.json").read_text())["version"] == 9
+    assert [path.name for path in tmp_path.iterdir()] == ["config.json"]
+
+def test_atomic_write_removes_the_temporary_file_on_failure(tmp_path):
+    target = tmp_path / "state.json"
+    target.mkdir()
+    with pytest.raises(OSError):
+        atomicWrite(str(target), "{}", ".state.")
+    assert [path.name for path in tmp_path.iterdir()] == ["state.json"]
@@ -0,0 +1,94 @@
+import json, datetime
+from Config import Config
+from CatFeeder import CatFeeder
+from test_config import BASE
+
+class Client:
+    def __init__(self):
+        self.results = []
+        self.disconnected = False
+
+    def send_update_result(self, result):
+        self.results.append(result)
+
+    def disconnect(self):
+        self.disconnected = True
+
+def _feeder(tmp_path, failing = ()):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(BASE))
+    feeder = CatFeeder()
+    feeder.config = Config(str(path))
+    feeder.mqttClient = Client()
+    feeder.reinitialised = []
+    feeder.clients = [feeder.mqttClient]
+
+    def reinitialise(changed):
+        feeder.reinitialised.append((set(changed), feeder.config.version))
+        if len(feeder.reinitialised) in failing:
+            raise RuntimeError("display is gone")
+
+    def initMqtt():
+        feeder.mqttClient.disconnect()
+        feeder.mqttClient = Client()
+        feeder.clients.append(feeder.mqttClient)
+
+    feeder._reinitialise = reinitialise
+    feeder._initMqtt = initMqtt
+    return feeder
+
+def _fileVersion(tmp_path):
+    return json.loads((tmp_path / "config.json").read_text())["version"]
+
+def test_rejected_update_is_reported(tmp_path):
+    feeder = _feeder(tmp_path)
+    feeder.pendingUpdates.append({"version": 2, "config": BASE})
+    feeder._applyConfigUpdate()
+    assert feeder.mqttClient.results == [{"version": 2, "status": "rejected", "error": "outdated", "message": "Version 2 is not newer than 3", "current_version": 3}]
+    assert not feeder.pendingUpdates and feeder.reinitialised == []
+
+def test_applied_update_is_written(tmp_path):
+    feeder = _feeder(tmp_path)
+    feeder.pendingUpdates.append({"version": 4, "base_version": 3, "patch": [{"op": "replace", "path": "/loglevel", "value": "DEBUG"}]})
+    feeder._applyConfigUpdate()
+    assert feeder.mqttClient.results == [{"version": 4, "status": "applied", "changed": ["loglevel"]}]
+    assert feeder.reinitialised == [({"loglevel"}, 4)]
+    assert _fileVersion(tmp_path) == 4
+
+def test_mqtt_change_is_acknowledged_once_by_the_old_client(tmp_path):
+    feeder = _feeder(tmp_path)
+    feeder.pendingUpdates.append({"version": 4, "config": dict(BASE, mqtt={"host": "broker"}, statusLedPort=24)})
+    feeder._applyConfigUpdate()
+    old, new = feeder.clients
+    assert old.results == [{"version": 4, "status": "applied", "changed": ["mqtt", "statusLedPort"]}]
+    assert old.disconnected and new.results == []
+    assert feeder.reinitialised == [({"statusLedPort"}, 4)]
+
+def test_failed_update_is_rolled_back(tmp_path):
+    feeder = _feeder(tmp_path, failing=(1,))
+    feeder.pendingUpdates.append({"version": 4, "config": dict(BASE, mqtt={"host": "broker"}, statusLedPort=24)})
+    feeder._applyConfigUpdate()
+    assert len(feeder.clients) == 1
+    result, = feeder.mqttClient.results
+    assert result["status"] == "rolled_back" and result["current_version"] == 3
+    assert feeder.reinitialised == [({"statusLedPort"}, 4), ({"statusLedPort"}, 3)]
+    assert feeder.config.version == 3 and _fileVersion(tmp_path) == 3
+
+def test_failing_rollback_does_not_raise(tmp_path):
+    feeder = _feeder(tmp_path, failing=(1, 2))
+    feeder.pendingUpdates.append({"version": 4, "config": dict(BASE, statusLedPort=24)})
+    feeder._applyConfigUpdate()
+    assert feeder.mqttClient.results[0]["status"] == "rolled_back"
+    assert feeder.config.version == 3
+
+def test_scheduler_runs_while_an_update_waits_for_the_machines(tmp_path):
+    feeder = _feeder(tmp_path)
+    feeder.jobIsRunning = True
+    ran = []
+    feeder.scheduler.every(1).seconds.do(lambda: ran.append(True))
+    feeder.scheduler.jobs[0].next_run = datetime.datetime.now() - datetime.timedelta(seconds=1)
+    feeder.lagMonitor.recordTimer = lambda lag: None
+    feeder.pendingUpdates.append({"version": 4, "config": dict(BASE, feedingMachines=[])})
+    feeder.run()
+    assert ran == [True]
+    assert len(feeder.pendingUpdates) == 1 and feeder.reinitialised == []
@@ -0,0 +1,171 @@
+import time, asyncio, datetime, threading
+from types import SimpleNamespace
+from EventBus import EventBus, DROP_OLDEST, DROP_NEWEST, BLOCK, MachineRound, MachineFinished, FeedingFinished, FeedRequested
+from CatFeeder import CatFeeder
+from Display import Display
+
+def _waitFor(predicate, timeout = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return predicate()
+
+class Gate:
+    """Handler that holds the consumer on its first event until released"""
+
+    def __init__(self):
+        self.rounds = []
+        self.entered = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, event):
+        self.entered.set()
+        self.released.wait(5)
+        self.rounds.append(event.currentRound)
+
+def _fill(overflow, events = 5):
+    bus = EventBus()
+    gate = Gate()
+    subscriber = bus.subscriber("test", 2, overflow).on(MachineRound, gate)
+    bus.start()
+    bus.publish(MachineRound(None, 0, 0))
+    assert gate.entered.wait(5)
+    return bus, gate, subscriber
+
+def test_drop_oldest_keeps_the_newest_events():
+    bus, gate, subscriber = _fill(DROP_OLDEST)
+    for index in range(1, 5):
+        bus.publish(MachineRound(None, index, 0))
+    gate.released.set()
+    bus.stop()
+    assert gate.rounds == [0, 3, 4]
+    assert subscriber.statistics()["dropped"] == 2
+
+def test_drop_newest_keeps_the_oldest_events():
+    bus, gate, subscriber = _fill(DROP_NEWEST)
+    for index in range(1, 5):
+        bus.publish(MachineRound(None, index, 0))
+    gate.released.set()
+    bus.stop()
+    assert gate.rounds == [0, 1, 2]
+    assert subscriber.statistics()["dropped"] == 2
+
+def test_block_waits_for_space():
+    bus, gate, subscriber = _fill(BLOCK)
+    producer = threading.Thread(target=lambda: [bus.publish(MachineRound(None, index, 0)) for index in range(1, 5)])
+    producer.start()
+    time.sleep(0.1)
+    assert producer.is_alive() and len(subscriber._queue) == 2
+    gate.released.set()
+    producer.join(5)
+    bus.stop()
+    assert gate.rounds == [0, 1, 2, 3, 4]
+    assert subscriber.statistics()["dropped"] == 0
+
+def test_block_does_not_wait_on_the_consumer_thread():
+    bus = EventBus()
+    rounds = []
+
+    def handler(event):
+        rounds.append(event.currentRound)
+        if event.currentRound == 0:
+            # more than fits in the queue, from the thread that would have to make space
+            for index in range(1, 5):
+                bus.publish(MachineRound(None, index, 0))
+
+    bus.subscriber("test", 2, BLOCK).on(MachineRound, handler)
+    bus.start()
+    bus.publish(MachineRound(None, 0, 0))
+    assert _waitFor(lambda: len(rounds) == 5)
+    bus.stop()
+    assert rounds == [0, 1, 2, 3, 4]
+
+def test_sleeping_consumer_is_woken_up():
+    bus = EventBus()
+    rounds = []
+    subscriber = bus.subscriber("test").on(MachineRound, lambda event: rounds.append(event.currentRound))
+    bus.start()
+    for index in range(200):
+        # publish right after the consumer went to sleep, or while it is about to
+        _waitFor(lambda: subscriber._sleeping)
+        bus.publish(MachineRound(None, index, 0))
+        assert _waitFor(lambda: len(rounds) == index + 1, 1), f"event {index} was not delivered"
+    bus.stop()
+    assert subscriber.statistics()["delivered"] == 200
+
+def test_stop_delivers_the_queued_events():
+    bus, gate, subscriber = _fill(DROP_NEWEST)
+    bus.publish(MachineRound(None, 1, 0))
+    gate.released.set()
+    bus.stop()
+    assert gate.rounds == [0, 1]
+    assert not subscriber._thread
+
+def test_inline_subscriber_and_failing_handler():
+    bus = EventBus()
+    threads = []
+
+    def failing(event):
+        raise ValueError("broken handler")
+
+    bus.subscriber("inline", inline=True).on(MachineRound, lambda event: threads.append(threading.current_thread())).on(MachineFinished, failing)
+    bus.publish(MachineFinished(None, 0))
+    bus.publish(MachineRound(None, 1, 0))
+    assert threads == [threading.current_thread()]
+    assert bus.statistics() == {}
+
+def test_loop_subscriber_runs_on_the_loop():
+    async def main():
+        loop = asyncio.get_running_loop()
+        bus = EventBus()
+        threads = []
+        done = asyncio.Event()
+
+        def handler(event):
+            threads.append(threading.current_thread())
+            if event.currentRound == 2:
+                done.set()
+
+        bus.subscriber("loop", loop=loop).on(MachineRound, handler)
+        thread = threading.Thread(target=lambda: [bus.publish(MachineRound(None, index, 0)) for index in range(3)])
+        thread.start()
+        await asyncio.wait_for(done.wait(), 5)
+        thread.join()
+        return threads
+
+    threads = asyncio.run(main())
+    assert threads == [threading.current_thread()] * 3
+
+class Client:
+    def __init__(self):
+        self.overrides = []
+
+    def send_status_message(self, overrides = None):
+        self.overrides.append(overrides)
+
+class SilentDisplay:
+    def __getattr__(self, name):
+        return lambda *args: None
+
+def test_feeding_finished_reports_the_finished_job():
+    feeder = CatFeeder()
+    feeder.mqttClient = Client()
+    feeder.display = SilentDisplay()
+    finished = type("Job", (), {"portions": 2, "span": None})()
+    run = datetime.datetime(2026, 10, 19, 8, 0, 0, 123)
+    # the next job already started when the indicators handle the event
+    feeder.lastJob = type("Job", (), {"portions": 1, "span": None})()
+    feeder.lastJobStatus = "running"
+    feeder._feedingFinished(FeedingFinished(finished, "empty", run))
+    overrides, = feeder.mqttClient.overrides
+    assert overrides["last_feed_status"] == "empty"
+    assert overrides["last_feed_portions"] == 2
+    assert overrides["last_feed"].startswith("2026-10-19T08:00:00")
+
+def test_display_publishes_manual_feeding_on_the_given_bus():
+    bus = EventBus()
+    requests = []
+    bus.subscriber("test", inline=True).on(FeedRequested, requests.append)
+    display = Display(SimpleNamespace(display={}), connect=False, bus=bus)
+    display._interpretInput(1, [0, 0, 1, 0, 1, 0, 1])
+    assert requests == [FeedRequested(1, "display")]
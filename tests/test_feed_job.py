@@ -0,0 +1,116 @@
+import threading, pytest
+from FeedJob import FeedJob
+from FeedQueue import FeedRequest
+from FeedingMachine import FoodDispenseError
+from EventBus import EventBus, JobFinished, JobFailed
+from CatFeeder import CatFeeder
+
+class Machine:
+    """Stands in for a FeedingMachine, runs a sequence in a timer thread"""
+
+    def __init__(self, name, power = 0, failOnRun = None):
+        self.name = name
+        self.power = power
+        self.currentRound = None
+        self.span = None
+        self.runs = []
+        self.failOnRun = failOnRun
+        self.job = None
+        self.tracker = None
+
+    def runSequence(self, rounds):
+        self.currentRound = rounds
+        self.runs.append(rounds)
+        self.tracker.started()
+        threading.Timer(0.02, self._finish, args=(rounds,)).start()
+
+    def _finish(self, rounds):
+        if len(self.runs) == self.failOnRun:
+            self.job.machineFailed(self, FoodDispenseError(self, rounds, "no food"))
+        else:
+            for _ in range(rounds):
+                self.job.machineRound(self)
+            self.job.machineSuccessful(self)
+        self.currentRound = None
+        self.tracker.stopped()
+        self.job.machineFinished(self)
+
+class Tracker:
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def stopped(self):
+        with self._lock:
+            self.running -= 1
+
+def _feed(machines, portions = 2, machinePortions = None, concurrency = None, powerBudget = None, startStagger = 0):
+    job = FeedJob(portions, None, machines, machinePortions, EventBus())
+    job.concurrency = concurrency
+    job.powerBudget = powerBudget
+    job.startStagger = startStagger
+    finished = threading.Event()
+    failed = []
+    job.bus.subscriber("test", inline=True).on(JobFinished, lambda event: finished.set()).on(JobFailed, failed.append)
+    tracker = Tracker()
+    for machine in machines:
+        machine.job = job
+        machine.tracker = tracker
+    job.feed()
+    assert finished.wait(5)
+    return job, tracker, failed
+
+def test_parallel_by_default():
+    machines = [Machine("Links"), Machine("Rechts"), Machine("Midden")]
+    job, tracker, failed = _feed(machines, 3)
+    assert tracker.peak == 3
+    assert [machine.runs for machine in machines] == [[3], [3], [3]]
+    assert job.machinesDone == 3
+
+def test_concurrency_interleaves_rounds():
+    machines = [Machine("Links"), Machine("Rechts"), Machine("Midden")]
+    job, tracker, failed = _feed(machines, 2, {"Rechts": 3}, concurrency=2)
+    assert tracker.peak == 2
+    # not every machine fits at once, so every machine runs one round at a time
+    assert [machine.runs for machine in machines] == [[1, 1], [1, 1, 1], [1, 1]]
+    assert job.remainingPortions() == {}
+
+def test_whole_sequences_when_every_machine_fits():
+    machines = [Machine("Links"), Machine("Rechts")]
+    job, tracker, failed = _feed(machines, 2, concurrency=2, startStagger=0.01)
+    assert [machine.runs for machine in machines] == [[2], [2]]
+
+def test_power_budget():
+    machines = [Machine("Links", 600), Machine("Rechts", 600), Machine("Midden", 300)]
+    job, tracker, failed = _feed(machines, 2, powerBudget=1000)
+    assert tracker.peak == 2
+    assert [sum(machine.runs) for machine in machines] == [2, 2, 2]
+
+def test_machine_without_portions_is_skipped():
+    machines = [Machine("Links"), Machine("Rechts")]
+    job, tracker, failed = _feed(machines, 0, {"Rechts": 2}, concurrency=1)
+    assert machines[0].runs == []
+    assert machines[1].runs == [2]
+
+def test_failed_machine_is_not_requeued():
+    machines = [Machine("Links", failOnRun=1), Machine("Rechts")]
+    job, tracker, failed = _feed(machines, 3, concurrency=1)
+    assert machines[0].runs == [1]
+    assert machines[1].runs == [1, 1, 1]
+    assert [event.machine.name for event in failed] == ["Links"]
+    assert job.machinesDone == 2
+
+@pytest.mark.parametrize("portions, machinePortions, queued", [(0, {"Rechts": 2}, True), (0, {}, False), (0, {"Rechts": 0}, False)])
+def test_schedule_entry_for_some_machines_is_queued(portions, machinePortions, queued):
+    feeder = CatFeeder()
+    feeder._dispatchFeeding = lambda: None
+    request = FeedRequest(portions, "schedule")
+    request.machinePortions = machinePortions
+    assert (feeder._queueFeeding(request) is request) == queued
+    assert len(feeder.feedQueue) == (1 if queued else 0)
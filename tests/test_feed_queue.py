@@ -0,0 +1,76 @@
+from FeedQueue import FeedQueue, FeedRequest
+
+def _sources(batch):
+    return [request.source for request in batch]
+
+def test_pop_orders_by_priority_then_arrival():
+    queue = FeedQueue(merge=False)
+    queue.push(FeedRequest(1, "mqtt"))
+    queue.push(FeedRequest(1, "button"))
+    queue.push(FeedRequest(1, "schedule"))
+    queue.push(FeedRequest(1, "display"))
+    order = [queue.pop()[0].source for _ in range(4)]
+    assert order == ["schedule", "button", "display", "mqtt"]
+    assert queue.pop() == []
+
+def test_merge_combines_within_max_portions():
+    queue = FeedQueue(merge=True, maxPortions=4)
+    queue.push(FeedRequest(2, "schedule"))
+    queue.push(FeedRequest(3, "button"))
+    queue.push(FeedRequest(1, "mqtt"))
+    batch = queue.pop()
+    assert _sources(batch) == ["schedule", "mqtt"]
+    assert sum(request.portions for request in batch) == 3
+    # the request that did not fit stays queued
+    assert _sources(queue.pop()) == ["button"]
+    assert queue.metrics()["merged"] == 1
+
+def test_without_merge_every_request_is_its_own_batch():
+    queue = FeedQueue(merge=False, maxPortions=10)
+    queue.push(FeedRequest(1, "mqtt"))
+    queue.push(FeedRequest(1, "mqtt"))
+    assert len(queue.pop()) == 1
+    assert len(queue.pop()) == 1
+
+def test_duplicate_request_id_returns_the_first_request():
+    queue = FeedQueue()
+    first = FeedRequest(1, "mqtt", requestId="abc")
+    assert queue.push(first) is first
+    assert queue.push(FeedRequest(1, "mqtt", requestId="abc")) is first
+    assert len(queue) == 1
+    assert queue.metrics()["deduplicated"] == 1
+
+def test_request_id_is_remembered_after_dispatch():
+    queue = FeedQueue()
+    first = FeedRequest(1, "mqtt", requestId="abc")
+    queue.push(first)
+    queue.pop()
+    assert queue.push(FeedRequest(1, "mqtt", requestId="abc")) is first
+    assert len(queue) == 0
+
+def test_max_depth_drops_and_completes_the_request():
+    queue = FeedQueue(maxDepth=2)
+    queue.push(FeedRequest(1, "mqtt"))
+    queue.push(FeedRequest(1, "mqtt"))
+    dropped = FeedRequest(1, "mqtt")
+    assert queue.push(dropped) is None
+    assert dropped.wait(0) == "dropped"
+    assert len(queue) == 2
+    assert queue.metrics()["dropped"] == 1
+
+def test_clear_completes_pending_requests():
+    queue = FeedQueue()
+    request = FeedRequest(1, "mqtt")
+    queue.push(request)
+    queue.clear()
+    assert request.wait(0) == "dropped"
+    assert len(queue) == 0
+
+def test_done_callback_runs_once_also_when_added_late():
+    request = FeedRequest(1, "mqtt")
+    results = []
+    request.addDoneCallback(lambda done: results.append(done.result))
+    request.complete("successful")
+    request.complete("error")
+    request.addDoneCallback(lambda done: results.append(done.result))
+    assert results == ["successful", "successful"]
@@ -0,0 +1,48 @@
+import time, threading, pytest
+from FeedingMachine import FeedingMachine
+from EventBus import EventBus, MachineRound, MachineFinished
+
+@pytest.fixture
+def machine(monkeypatch):
+    monkeypatch.setattr(FeedingMachine, "fakeMotorDuration", 0.02)
+    monkeypatch.setattr(FeedingMachine, "sensorArmDelay", 0.005)
+    monkeypatch.setattr(FeedingMachine, "stopDelay", 0.01)
+    machine = FeedingMachine("Links", bus=EventBus())
+    yield machine
+    machine.closeAll()
+
+def _runSequence(machine, monkeypatch, rounds, edges):
+    """Runs a sequence on the emulated motor with the sensor edges at the given times"""
+    edges = list(edges)
+    monkeypatch.setattr(FeedingMachine, "_edgeTime", lambda self: edges.pop(0) if edges else time.monotonic())
+    events = []
+    finished = threading.Event()
+    machine.bus.subscriber("test", inline=True).on(MachineRound, events.append).on(MachineFinished, lambda event: finished.set())
+    machine.runSequence(rounds)
+    assert finished.wait(5)
+    return [event.rotationTime for event in events]
+
+def test_rotation_time_is_learned_from_consecutive_edges(machine, monkeypatch):
+    started = time.monotonic()
+    # the first round includes 0.03 s of spin-up, then one rotation takes 0.05 s
+    first = started + 0.08
+    rotationTimes = _runSequence(machine, monkeypatch, 3, [first, first + 0.05, first + 0.1])
+    assert rotationTimes[0] > 0.07
+    assert rotationTimes[1:] == pytest.approx([0.05, 0.05])
+    assert machine.rotationTime == pytest.approx(0.05)
+    assert machine.stats.rotationTime == pytest.approx(0.05)
+
+def test_first_round_after_a_standstill_is_not_learned(machine, monkeypatch):
+    first = time.monotonic() + 0.08
+    _runSequence(machine, monkeypatch, 2, [first, first + 0.05])
+    assert machine.previousEdgeTime is None
+    time.sleep(0.1)
+    # the gap since the last edge of the previous sequence is no rotation
+    rotationTimes = _runSequence(machine, monkeypatch, 1, [])
+    assert len(rotationTimes) == 1
+    assert machine.rotationTime == pytest.approx(0.05)
+
+def test_single_round_does_not_learn(machine, monkeypatch):
+    _runSequence(machine, monkeypatch, 1, [])
+    assert machine.rotationTime is None
+    assert machine.lastRotationTime is not None
@@ -0,0 +1,24 @@
+import os
+from LagMonitor import LagMonitor
+
+def test_watchdog_enabled_after_fork_with_notify_socket(monkeypatch):
+    monkeypatch.setenv("WATCHDOG_USEC", "20000000")
+    monkeypatch.setenv("WATCHDOG_PID", str(os.getpid() + 1))
+    monkeypatch.setenv("NOTIFY_SOCKET", "/run/systemd/notify")
+    assert LagMonitor()._readWatchdogInterval() == 10
+
+def test_watchdog_for_another_process_without_notify_socket(monkeypatch):
+    monkeypatch.setenv("WATCHDOG_USEC", "20000000")
+    monkeypatch.setenv("WATCHDOG_PID", str(os.getpid() + 1))
+    monkeypatch.delenv("NOTIFY_SOCKET", raising=False)
+    assert LagMonitor()._readWatchdogInterval() is None
+
+def test_watchdog_interval_is_read_again_on_start(monkeypatch):
+    monkeypatch.delenv("WATCHDOG_USEC", raising=False)
+    monitor = LagMonitor()
+    assert monitor._watchdogInterval is None
+    monkeypatch.setenv("WATCHDOG_USEC", "4000000")
+    monkeypatch.setenv("WATCHDOG_PID", str(os.getpid()))
+    monitor.start()
+    monitor.stop()
+    assert monitor._watchdogInterval == 2
@@ -0,0 +1,58 @@
+import os, time, signal, threading
+from FeedingMachine import FeedingMachine
+from MotorProcess import MotorControlProcess
+from EventBus import EventBus, MachineFailed, MachineFinished
+
+MACHINE = {"name": "Links", "motorPort": None, "motorSensorPort": None, "foodSensorPortOut": None, "foodSensorPortIn": None}
+
+def _start(monkeypatch, **options):
+    # a round takes long enough to kill the child in the middle of it
+    monkeypatch.setattr(FeedingMachine, "fakeMotorDuration", 5)
+    bus = EventBus()
+    process = MotorControlProcess([MACHINE], bus=bus, **options)
+    process.start()
+    events = []
+    finished = threading.Event()
+    def onFinished(event):
+        events.append(event)
+        finished.set()
+    bus.subscriber("test", inline=True).on(MachineFailed, events.append).on(MachineFinished, onFinished)
+    return process, events, finished
+
+def _waitFor(predicate, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+def test_child_death_fails_running_machine_and_restarts(monkeypatch):
+    process, events, finished = _start(monkeypatch)
+    try:
+        machine = process.machines[0]
+        pid = process.pid
+        machine.runSequence(2)
+        os.kill(pid, signal.SIGKILL)
+        assert finished.wait(10)
+        assert [type(event) for event in events] == [MachineFailed, MachineFinished]
+        assert events[0].error.roundsLeft == 2
+        assert machine.currentRound is None
+        assert _waitFor(lambda: process.pid != pid and process._ready.is_set())
+        assert not process.failed
+    finally:
+        process.stop()
+
+def test_marked_failed_after_max_restarts(monkeypatch):
+    process, events, finished = _start(monkeypatch, maxRestarts=0)
+    try:
+        machine = process.machines[0]
+        machine.runSequence(1)
+        os.kill(process.pid, signal.SIGKILL)
+        assert finished.wait(10)
+        assert _waitFor(lambda: process.failed)
+        events.clear()
+        finished.clear()
+        machine.runSequence(1)
+        assert finished.wait(1)
+        assert [type(event) for event in events] == [MachineFailed, MachineFinished]
+    finally:
+        process.stop()
@@ -0,0 +1,125 @@
+import time, socket, pytest
+from relays import SmtpRelay, WebhookServer
+from Notification import Notification, NotificationDispatcher, SmtpSink, WebhookSink, digest, DIGEST_LINES
+
+class Sink:
+    name = "memory"
+
+    def __init__(self, failing = False):
+        self.failing = failing
+        self.sent = []
+
+    def send(self, notification):
+        if self.failing:
+            raise ConnectionError("down")
+        self.sent.append(notification)
+
+    def close(self):
+        pass
+
+def _notification(code = "blocked", machine = "Links"):
+    return Notification(code, "Motor is blocked", f"{machine} is blocked", "links", machine)
+
+def _freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def test_smtp_reuses_the_relay_connection():
+    relay = SmtpRelay().start()
+    sink = SmtpSink({"host": "127.0.0.1", "port": relay.port, "from": "feeder@home", "to": ["owner@home"]})
+    try:
+        sink.send(_notification())
+        sink.send(_notification(machine="Rechts"))
+    finally:
+        sink.close()
+        relay.stop()
+    assert relay.connections == 1
+    assert len(relay.messages) == 2
+    assert "Subject: Motor is blocked" in relay.messages[0]
+    assert "Rechts is blocked" in relay.messages[1]
+
+def test_smtp_reconnects_after_the_relay_closed_the_connection():
+    relay = SmtpRelay().start()
+    sink = SmtpSink({"host": "127.0.0.1", "port": relay.port, "to": ["owner@home"]})
+    try:
+        sink.send(_notification())
+        sink._smtp.sock.shutdown(socket.SHUT_RDWR)
+        sink.send(_notification())
+    finally:
+        sink.close()
+        relay.stop()
+    assert relay.connections == 2 and len(relay.messages) == 2
+
+def test_webhook_posts_json_on_one_connection():
+    server = WebhookServer().start()
+    sink = WebhookSink({"url": f"http://127.0.0.1:{server.port}/hook"})
+    try:
+        sink.send(_notification())
+        sink.send(_notification(code="empty"))
+    finally:
+        sink.close()
+        server.stop()
+    assert server.connections == 1
+    assert [message["code"] for message in server.messages] == ["blocked", "empty"]
+    assert server.messages[0]["machine"] == "Links" and server.messages[0]["count"] == 1
+
+def test_webhook_raises_when_unreachable():
+    sink = WebhookSink({"url": f"http://127.0.0.1:{_freePort()}/hook", "timeout": 1})
+    with pytest.raises(OSError):
+        sink.send(_notification())
+
+def test_rate_limit_collects_a_digest():
+    sink = Sink()
+    dispatcher = NotificationDispatcher([sink], rateLimit=0.2)
+    dispatcher.start()
+    for machine in ("Links", "Rechts", "Midden"):
+        dispatcher.notify(_notification(machine=machine))
+    dispatcher.notify(_notification(code="empty"))
+    time.sleep(0.1)
+    assert [notification.code for notification in sink.sent] == ["blocked", "empty"]
+    time.sleep(0.3)
+    dispatcher.stop()
+    assert len(sink.sent) == 3
+    assert sink.sent[2].subject == "2x Motor is blocked" and sink.sent[2].count == 2
+    assert "Rechts is blocked" in sink.sent[2].message and "Midden is blocked" in sink.sent[2].message
+    assert dispatcher.metrics() == {"queued": 4, "sent": 3, "digests": 1, "dropped": 0, "failed": 0}
+
+def test_pending_digest_is_sent_on_stop():
+    sink = Sink()
+    dispatcher = NotificationDispatcher([sink], rateLimit=600)
+    dispatcher.start()
+    dispatcher.notify(_notification())
+    dispatcher.notify(_notification())
+    dispatcher.stop()
+    assert [notification.count for notification in sink.sent] == [1, 1]
+    assert sink.sent[1].subject == "1x Motor is blocked"
+
+def test_failed_delivery_does_not_start_the_rate_limit():
+    failing = Sink(failing=True)
+    dispatcher = NotificationDispatcher([failing], rateLimit=600)
+    dispatcher.start()
+    dispatcher.notify(_notification())
+    time.sleep(0.1)
+    working = Sink()
+    dispatcher.sinks.append(working)
+    dispatcher.notify(_notification())
+    dispatcher.notify(_notification())
+    dispatcher.stop()
+    # the second notification is sent right away, the third waits for the digest
+    assert [notification.subject for notification in working.sent] == ["Motor is blocked", "1x Motor is blocked"]
+    assert dispatcher.metrics()["failed"] == 3
+
+def test_codes_filter_and_full_queue():
+    dispatcher = NotificationDispatcher([Sink()], queueSize=1, codes=["blocked"])
+    assert not dispatcher.notify(_notification(code="error"))
+    assert dispatcher.notify(_notification())
+    assert not dispatcher.notify(_notification())
+    assert dispatcher.metrics() == {"queued": 1, "sent": 0, "digests": 0, "dropped": 1, "failed": 0}
+
+def test_digest_lists_at_most_digest_lines():
+    notifications = [_notification(machine=str(index)) for index in range(DIGEST_LINES + 5)]
+    result = digest(notifications)
+    assert result.count == DIGEST_LINES + 5
+    assert len(result.message.split("\n")) == DIGEST_LINES + 1
+    assert result.message.endswith("... and 5 more")
@@ -0,0 +1,43 @@
+import os, signal, threading
+from Profiler import DebugTools
+
+def _results(tools):
+    results = []
+    done = threading.Event()
+    def callback(result):
+        results.append((result, threading.current_thread().name))
+        done.set()
+    return results, done, callback
+
+def test_memory_snapshot_runs_on_worker(tmp_path):
+    tools = DebugTools(outputDir=str(tmp_path))
+    results, done, callback = _results(tools)
+    tools.submit({"action": "memory_start"})
+    tools.submit({"action": "memory_snapshot"}, callback)
+    assert done.wait(10)
+    tools.submit({"action": "memory_stop"})
+    result, threadName = results[0]
+    assert threadName == "DebugTools"
+    assert os.path.isfile(result["file"])
+
+def test_command_file_from_signal_handler(tmp_path):
+    tools = DebugTools(outputDir=str(tmp_path))
+    results, done, callback = _results(tools)
+    path = tmp_path / "debug.command"
+    path.write_text("memory_start\n")
+    previous = signal.signal(signal.SIGUSR2, lambda signum, frame: tools.submitCommandFile(str(path), callback))
+    try:
+        os.kill(os.getpid(), signal.SIGUSR2)
+        assert done.wait(10)
+    finally:
+        signal.signal(signal.SIGUSR2, previous)
+        tools.memoryProfiler.stop()
+    assert results[0] == ({"action": "memory_start", "started": True}, "DebugTools")
+    assert not path.exists()
+
+def test_unknown_action_is_reported():
+    tools = DebugTools()
+    results, done, callback = _results(tools)
+    tools.submit({"action": "nope"}, callback)
+    assert done.wait(10)
+    assert results[0][0]["error"] == "unknown action"
@@ -0,0 +1,33 @@
+import json, time
+from StateStore import StateStore
+
+def test_updates_are_coalesced_into_one_write(tmp_path):
+    store = StateStore(str(tmp_path / "state.json"), writeInterval=0.1)
+    store.start()
+    for index in range(10):
+        store.update(job={"portions": index})
+    time.sleep(0.3)
+    assert store.writes == 1
+    store.stop()
+    assert json.loads((tmp_path / "state.json").read_text())["job"] == {"portions": 9}
+
+def test_stop_during_the_write_interval_returns_quickly(tmp_path):
+    store = StateStore(str(tmp_path / "state.json"), writeInterval=0.5)
+    store.start()
+    store.update(last_slot="2026-10-19T08:00:00")
+    time.sleep(0.05)
+    started = time.monotonic()
+    store.stop()
+    assert time.monotonic() - started < 1
+    assert store.load()["last_slot"] == "2026-10-19T08:00:00"
+
+def test_load_ignores_other_versions(tmp_path):
+    (tmp_path / "state.json").write_text(json.dumps({"version": 0, "job": {}}))
+    assert StateStore(str(tmp_path / "state.json")).load() == {}
+
+def test_start_creates_the_state_directory(tmp_path):
+    store = StateStore(str(tmp_path / "lib" / "state.json"))
+    store.start()
+    store.update(last_slot="2026-10-19T08:00:00")
+    store.stop()
+    assert store.load()["last_slot"] == "2026-10-19T08:00:00"
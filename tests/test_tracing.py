@@ -0,0 +1,73 @@
+import json
+from Tracing import Tracer, STATUS_OK, STATUS_ERROR
+
+def _trace(tracer):
+    root = tracer.startTrace("feed_job", 1000, portions=2, trigger="schedule")
+    queued = root.child("queued", 1500, source="schedule")
+    queued.finish(2000)
+    machine = root.child("machine", 2000, machine="Links", rounds=2)
+    machine.addEvent("round", rotation_time=3.5)
+    machine.setError("no food")
+    machine.finish(5000)
+    return root
+
+def _exported(file):
+    return [json.loads(line) for line in file.read_text().splitlines()]
+
+def test_trace_is_exported_when_the_root_ends(tmp_path):
+    file = tmp_path / "traces.json"
+    tracer = Tracer(exportFile=str(file))
+    root = _trace(tracer)
+    assert not file.exists()
+    root.finish(6000)
+    lines = _exported(file)
+    assert len(lines) == 1
+    resource, = lines[0]["resourceSpans"]
+    assert resource["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "catfeeder"}}]
+    spans = resource["scopeSpans"][0]["spans"]
+    # ordered by start time, the children below the root
+    assert [span["name"] for span in spans] == ["feed_job", "queued", "machine"]
+    assert {span["traceId"] for span in spans} == {root.traceId}
+    assert "parentSpanId" not in spans[0]
+    assert [span["parentSpanId"] for span in spans[1:]] == [root.spanId, root.spanId]
+
+def test_span_layout(tmp_path):
+    file = tmp_path / "traces.json"
+    tracer = Tracer(exportFile=str(file))
+    _trace(tracer).finish(6000)
+    root, queued, machine = _exported(file)[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert (root["startTimeUnixNano"], root["endTimeUnixNano"]) == ("1000", "6000")
+    assert root["attributes"] == [{"key": "portions", "value": {"intValue": "2"}}, {"key": "trigger", "value": {"stringValue": "schedule"}}]
+    assert root["status"] == {"code": STATUS_OK}
+    assert machine["status"] == {"code": STATUS_ERROR, "message": "no food"}
+    event, = machine["events"]
+    assert event["name"] == "round"
+    assert event["attributes"] == [{"key": "rotation_time", "value": {"doubleValue": 3.5}}]
+    assert isinstance(event["timeUnixNano"], str)
+
+def test_export_file_is_rotated(tmp_path):
+    file = tmp_path / "traces.json"
+    tracer = Tracer(exportFile=str(file), maxFileSize=100)
+    _trace(tracer).finish(6000)
+    first = file.read_text()
+    _trace(tracer).finish(6000)
+    assert (tmp_path / "traces.json.1").read_text() == first
+    assert len(_exported(file)) == 1
+
+def test_disabled_tracer_records_nothing(tmp_path):
+    tracer = Tracer(exportFile=str(tmp_path / "traces.json"))
+    tracer.configure({"enabled": False, "exportFile": str(tmp_path / "traces.json")})
+    root = tracer.startTrace("feed_job")
+    assert root is None
+    assert tracer.startSpan("machine", root) is None
+    assert not (tmp_path / "traces.json").exists()
+
+def test_history_is_bounded():
+    tracer = Tracer(historySize=3)
+    roots = []
+    for _ in range(2):
+        roots.append(_trace(tracer))
+        roots[-1].finish(6000)
+    assert len(tracer.spans) == 3
+    assert [span["name"] for span in tracer.trace(roots[1].traceId)] == ["queued", "machine", "feed_job"]
+    assert tracer.trace(roots[0].traceId) == []
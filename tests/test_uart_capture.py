@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+from UartCapture import UartCapture, FrameDecoder, readCapture, RX, TX
+from Display import Display
+from UartReplay import replay
+
+ADDRESS = [255, 255]
+
+def _frame(method, data, checksum = None):
+    line = ADDRESS + [method, len(data)] + data
+    return bytes(line + [sum(line) & 0xFF if checksum is None else checksum])
+
+def test_decoder_skips_garbage_before_the_address():
+    decoder = FrameDecoder(ADDRESS)
+    assert decoder.feed(b"\x01\x02\x03" + _frame(5, [0])) == [(5, 1, [0], 4)]
+    assert decoder.skipped == 3
+
+def test_decoder_keeps_an_incomplete_frame():
+    decoder = FrameDecoder(ADDRESS)
+    frame = _frame(9, [255, 1])
+    assert decoder.feed(frame[:1]) == []
+    assert decoder.feed(frame[1:5]) == []
+    assert decoder.feed(frame[5:] + frame[:3]) == [(9, 2, [255, 1], frame[-1])]
+    assert decoder.feed(frame[3:]) == [(9, 2, [255, 1], frame[-1])]
+    assert decoder.skipped == 0
+
+def test_decoder_resyncs_on_a_split_address():
+    decoder = FrameDecoder(ADDRESS)
+    assert decoder.feed(b"\x10\x11\xff") == []
+    assert decoder.skipped == 2
+    assert decoder.feed(_frame(5, [0])[1:]) == [(5, 1, [0], 4)]
+
+def test_checksum_error_is_counted_and_the_next_frame_decoded(tmp_path):
+    dump = str(tmp_path / "error.bin")
+    display = Display(SimpleNamespace(display={"capture": {"dumpOnError": dump}}), connect=False)
+    received = _frame(5, [0], checksum=0) + _frame(16, [])
+    display.capture.record(RX, received)
+    frames = display.decoder.feed(received)
+    assert len(frames) == 2
+    assert display._handleFrame(*frames[0]) is None
+    assert display._handleFrame(*frames[1]) is True
+    assert display.checksumErrors == 1
+    assert readCapture(dump)[0][2] == received
+    display.unload()
+
+def test_capture_file_is_appended_when_reopened(tmp_path):
+    file = str(tmp_path / "uart.bin")
+    first = UartCapture(file=file)
+    first.record(RX, b"\xff\xff")
+    first.close()
+    second = UartCapture(file=file)
+    second.record(TX, b"\x01")
+    second.close()
+    assert [(direction, data) for direction, _, data in readCapture(file)] == [(RX, b"\xff\xff"), (TX, b"\x01")]
+
+def test_replay_leaves_the_capture_files_of_the_config_alone(tmp_path):
+    capture = {"file": str(tmp_path / "uart.bin"), "dumpOnError": str(tmp_path / "error.bin")}
+    config = SimpleNamespace(schedule=[], display={"capture": capture})
+    result = replay([(RX, 0, _frame(5, [0], checksum=0) + _frame(5, [0]))], config)
+    assert (result["frames"], result["checksum_errors"], result["responses_sent"]) == (2, 1, 1)
+    assert not (tmp_path / "uart.bin").exists()
+    assert not (tmp_path / "error.bin").exists()